@@ -1,65 +1,95 @@
 import os
+import time
 import base64
 import json
-from flask import Flask, request, jsonify, make_response
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify, make_response, url_for, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 import requests
 import re
 import datetime
-import firebase_admin
-from firebase_admin import credentials, firestore
+from google.api_core.exceptions import GoogleAPIError
+from startup import LazyClient, LazyModule, lazy_client_states, startup_report, timed_import
+from tts_client import SarvamTTSClient, SarvamTTSError
+from audio_cache import AudioCache, audio_cache_key, concat_audio_key
+from audio_transcode import AudioTranscoder, negotiate_audio_format
+from tts_pipeline import TTSPipeline, split_complete_sentences
+from stage_executor import submit_stage
+from persistence import start_write_behind_queue
+from petty_cache import PettyContextCache, PETTY_CONTEXT_DEPTH
+from gemini_gateway import GeminiGateway, GeminiOverloadedError
+from content_pools import ContentPools
+from single_flight import SingleFlight
+from markdown_cleaner import clean_markdown, IncrementalMarkdownCleaner
+from history_compaction import HistoryCompactor, turn_text
+from session_store import SessionStore
+from structured_log import get_logger, logging_snapshot
+from circuit_breaker import CircuitBreaker, breaker_states, get_breaker
+from voice_session import AudioFrames, GoogleStreamingRecognizer
+from image_search import ImageSearch
+from meme_renderer import MemeRenderer, meme_image_key
+import metrics
+from metrics import stage
 
-try:
-    if not firebase_admin._apps:
-        if os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
-            cred = credentials.ApplicationDefault()
-        else:
-            print("WARNING: GOOGLE_APPLICATION_CREDENTIALS not found for Firebase Admin SDK. Attempting without it.")
-            raise ValueError("GOOGLE_APPLICATION_CREDENTIALS environment variable is not set. Firebase Admin SDK might not initialize correctly.")
-            
-        firebase_admin.initialize_app(cred)
-        print("Firebase Admin SDK initialized successfully.")
-    else:
-        print("Firebase Admin SDK already initialized.")
-    db = firestore.client()
-    print("Firestore client initialized successfully.")
-except Exception as e:
-    print(f"ERROR: Failed to initialize Firebase Admin SDK or Firestore client: {e}")
-    print("Please ensure GOOGLE_APPLICATION_CREDENTIALS environment variable is set correctly and points to a valid service account key JSON file with Firestore permissions.")
-    db = None
-
-
-try:
-    from google.cloud import speech_v1p1beta1 as speech
-    import google.generativeai as genai
-    from google.api_core.exceptions import GoogleAPIError
-except ImportError as e:
-    print(f"ImportError: Missing required Google Cloud libraries. Please install them:")
-    print(f"pip install google-cloud-speech google-generativeai flask flask-cors python-dotenv requests firebase-admin")
-    print(f"Error details: {e}")
-    exit(1)
+load_dotenv()
 
+# Heavy SDKs (Firebase/Firestore, Gemini, Speech) are imported and their clients created
+# on first use in each worker process, not at import time; see startup.py.
+firestore = LazyModule('firebase_admin.firestore')
+
+log = get_logger('app')
+prompt_log = get_logger('gemini.prompt')
+reply_log = get_logger('gemini.response')
+tts_log = get_logger('tts')
+store_log = get_logger('firestore')
+
+
+def init_firestore():
+    firebase_admin = timed_import('firebase_admin')
+    from firebase_admin import credentials
+    try:
+        if not firebase_admin._apps:
+            gcp_credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+            if not gcp_credentials_path:
+                store_log.warning("GOOGLE_APPLICATION_CREDENTIALS not found for Firebase Admin SDK. Attempting without it.")
+                raise ValueError("GOOGLE_APPLICATION_CREDENTIALS environment variable is not set. Firebase Admin SDK might not initialize correctly.")
+            if not os.path.exists(gcp_credentials_path):
+                store_log.warning("GOOGLE_APPLICATION_CREDENTIALS environment variable is not set correctly or the file does not exist.", path=gcp_credentials_path)
+            firebase_admin.initialize_app(credentials.ApplicationDefault())
+            store_log.info("Firebase Admin SDK initialized successfully.")
+        client = firestore.client()
+        store_log.info("Firestore client initialized successfully.")
+        return client
+    except Exception as e:
+        store_log.error("Failed to initialize Firebase Admin SDK or Firestore client. Please ensure GOOGLE_APPLICATION_CREDENTIALS "
+                        "points to a valid service account key JSON file with Firestore permissions.", error=str(e))
+        return None
+
+
+db = LazyClient('firestore', init_firestore)
 
-load_dotenv()
 
 SARVAM_AI_API_KEY = os.getenv("SARVAM_AI_API_KEY")
 SARVAM_AI_TTS_ENDPOINT = os.getenv("SARVAM_AI_TTS_ENDPOINT", "https://api.sarvam.ai/text-to-speech")
 
 if not SARVAM_AI_API_KEY:
-    print("ERROR: SARVAM_AI_API_KEY environment variable not set. Sarvam AI TTS will not work.")
-
-gcp_credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-if not gcp_credentials_path or not os.path.exists(gcp_credentials_path):
-    print("WARNING: GOOGLE_APPLICATION_CREDENTIALS environment variable is not set correctly or the file does not exist.")
+    tts_log.error("SARVAM_AI_API_KEY environment variable not set. Sarvam AI TTS will not work.")
 
+tts_client = SarvamTTSClient.from_env()
+audio_cache = AudioCache.from_env()
+audio_transcoder = AudioTranscoder.from_env(audio_cache)
+firestore_breaker = CircuitBreaker.from_env('firestore', "FIRESTORE", slow_call_seconds=2.0)
+write_queue = LazyClient('write_queue', lambda: start_write_behind_queue(db, firestore_breaker))
 
-app = Flask(__name__)
-CORS(app, origins=["http://localhost:3000", "http://localhost:3001"])
+routes = Blueprint('brocodeai', __name__)
 
 
-@app.before_request
 def before_request():
+    g.timings = metrics.begin_request()
+    g.metrics_endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.requests_in_flight.inc(g.metrics_endpoint)
     if request.method == 'OPTIONS':
         resp = make_response()
         resp.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
@@ -67,28 +97,80 @@ def before_request():
         resp.headers.add('Access-Control-Max-Age', '86400')
         return resp
 
-@app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,POST,PUT,DELETE,OPTIONS')
+    timings = g.get('timings')
+    if timings is not None:
+        g.metrics_status = str(response.status_code)
+        response.headers['Server-Timing'] = timings.server_timing()
+        if not response.is_streamed:
+            metrics.response_bytes.observe(response.calculate_content_length() or 0, g.metrics_endpoint)
     return response
 
 
-speech_client = None
-try:
-    speech_client = speech.SpeechClient()
-    print("Successfully initialized Google Cloud Speech client.")
-except Exception as e:
-    print(f"Error initializing Google Cloud Speech client. Ensure GOOGLE_APPLICATION_CREDENTIALS is set and valid: {e}")
+def teardown_request(error):
+    # Runs after a streamed response has been fully sent, so durations cover the whole stream.
+    timings = g.get('timings')
+    if timings is None:
+        return
+    status = g.get('metrics_status') or ('500' if error is not None else '200')
+    metrics.request_duration.observe(timings.elapsed(), g.metrics_endpoint, request.method, status)
+    metrics.requests_in_flight.dec(g.metrics_endpoint)
+    metrics.end_request()
+
+
+speech = LazyModule('google.cloud.speech_v1p1beta1')
+
+
+def init_speech_client():
+    try:
+        client = speech.SpeechClient()
+        log.info("Successfully initialized Google Cloud Speech client.")
+        return client
+    except Exception as e:
+        log.error("Error initializing Google Cloud Speech client. Ensure GOOGLE_APPLICATION_CREDENTIALS is set and valid.", error=str(e))
+        return None
+
+
+# Only /voice_chat needs it, so worker warm-up leaves it alone unless SPEECH_WARM=1.
+speech_client = LazyClient('speech', init_speech_client, warm=os.getenv("SPEECH_WARM") == "1")
+
+
+def init_voice_recognizer():
+    if not speech_client:
+        return None
+    return GoogleStreamingRecognizer.from_env(speech_client.instance(), speech)
+
+
+# Streaming recognition backend for /voice_chat; anything with a compatible recognize()
+# can be swapped in through the factory (bench_fakes does this for offline runs).
+voice_recognizer = LazyClient('voice_recognizer', init_voice_recognizer, warm=os.getenv("SPEECH_WARM") == "1")
 
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     raise ValueError("GEMINI_API_KEY environment variable not set. Please set it in your .env file.")
-genai.configure(api_key=GEMINI_API_KEY)
-gemini_model = genai.GenerativeModel('gemini-1.5-flash')
-print("Successfully configured Gemini API and initialized model.")
+
+
+def init_gemini_gateway():
+    try:
+        genai = timed_import('google.generativeai')
+    except ImportError as e:
+        log.error("Missing google-generativeai. Please install it: pip install -r requirements.txt", error=str(e))
+        return None
+    if os.getenv("GEMINI_API_ENDPOINT"):
+        # e.g. a local stand-in for benchmarks (see bench_load.py); only the REST transport takes plain http.
+        genai.configure(api_key=GEMINI_API_KEY, transport='rest', client_options={'api_endpoint': os.getenv("GEMINI_API_ENDPOINT")})
+    else:
+        genai.configure(api_key=GEMINI_API_KEY)
+    gateway = GeminiGateway.from_env()
+    log.info("Successfully configured Gemini API and initialized model.")
+    return gateway
+
+
+gemini_gateway = LazyClient('gemini', init_gemini_gateway)
 
 
 SARVAM_AI_VOICES_BY_STYLE = {
@@ -122,6 +204,9 @@ SARVAM_AI_VOICES_BY_STYLE = {
 }
 DEFAULT_SARVAM_VOICE_SETTINGS = {'target_language_code': 'en-IN'}
 
+AUDIO_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+AUDIO_MAX_AGE_SECONDS = 365 * 24 * 3600
+
 SARVAM_LANG_MAP = {
     'hinglish': 'hi',
     'en': 'en',
@@ -137,93 +222,434 @@ SARVAM_LANG_MAP = {
     'ur': 'ur',
 }
 
-def clean_markdown(text):
-    text = re.sub(r'\*([^\*]+)\*', r'\1', text)
-    text = re.sub(r'\_([^\_]+)\_', r'\1', text)
-    text = re.sub(r'^\s*#+\s*', '', text, flags=re.MULTILINE)
-    text = re.sub(r'^\s*[-*]\s*', '', text, flags=re.MULTILINE)
-    text = re.sub(r'\n+', '\n', text)
-    text = "\n".join([line.strip() for line in text.split('\n')])
-    return text.strip()
+petty_cache = PettyContextCache.from_env(clean_markdown)
 
 
-def synthesize_sarvam_ai_speech(text, language, voice_style):
-    if not SARVAM_AI_API_KEY or not SARVAM_AI_TTS_ENDPOINT:
-        print("ERROR: Sarvam AI API Key or Endpoint not configured. Cannot synthesize speech.")
-        return None
+def gemini_overloaded_response(e):
+    log.warning("Gemini gateway rejected request.", error=str(e))
+    response = jsonify({'error': str(e)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
 
+def resolve_sarvam_language_code(language, voice_style):
     voice_settings = SARVAM_AI_VOICES_BY_STYLE.get(language, {}).get(voice_style, DEFAULT_SARVAM_VOICE_SETTINGS)
-    sarvam_target_language_code = voice_settings.get('target_language_code')
+    return voice_settings.get('target_language_code')
 
+
+def synthesize_sarvam_ai_audio(text, language, voice_style):
+    """
+    Single TTS code path shared by /chat and /speak_text. Returns (audio_id, audio_bytes),
+    where audio_id is the content-addressed cache key served by /audio/<audio_id>.
+    Raises SarvamTTSError on failure.
+    """
+    sarvam_target_language_code = resolve_sarvam_language_code(language, voice_style)
     if not sarvam_target_language_code:
-        print(f"ERROR: Missing essential Sarvam AI target_language_code for language '{language}' and style '{voice_style}'. Check SARVAM_AI_VOICES_BY_STYLE map.")
+        tts_log.error("Missing essential Sarvam AI target_language_code. Check SARVAM_AI_VOICES_BY_STYLE map.", language=language, voice_style=voice_style)
+        raise SarvamTTSError('Sarvam AI target language code not found for selected style.')
+
+    cache_key = audio_cache_key(text, sarvam_target_language_code, voice_style)
+    audio_bytes = audio_cache.get(cache_key)
+    if audio_bytes is not None:
+        tts_log.debug("Audio cache hit.", key=cache_key[:12], size=len(audio_bytes))
+        return cache_key, audio_bytes
+
+    tts_log.debug("Calling Sarvam AI TTS.", endpoint=tts_client.endpoint, language=sarvam_target_language_code, text_length=len(text))
+    audio_bytes = tts_client.synthesize(text, sarvam_target_language_code)
+    audio_cache.put(cache_key, audio_bytes)
+    tts_log.debug("Cached synthesized audio.", key=cache_key[:12], size=len(audio_bytes))
+    return cache_key, audio_bytes
+
+
+tts_pipeline = TTSPipeline.from_env(synthesize_sarvam_ai_audio)
+
+
+def synthesize_reply_segments(text, language, voice_style):
+    """
+    Synthesizes a chat reply sentence by sentence on the shared TTS pipeline.
+    Returns (audio_id, segments): audio_id covers the whole reply (the segments
+    concatenated, since MP3 frames can be appended), segments keep per-sentence ids.
+    """
+    if not tts_client.configured:
+        tts_log.error("Sarvam AI API Key or Endpoint not configured. Cannot synthesize speech.")
+        return None, []
+    if not tts_client.breaker.allows_calls:
+        tts_log.warning("Sarvam AI circuit is open. Replying without audio.")
+        return None, []
+
+    segments = tts_pipeline.synthesize_segments(text, language, voice_style)
+    return combine_segment_audio(segments), segments
+
+
+def combine_segment_audio(segments):
+    ready = [segment for segment in segments if segment['audio_id']]
+    if not ready:
         return None
+    if len(ready) == 1:
+        return ready[0]['audio_id']
 
-    payload = {
-        "text": text,
-        "target_language_code": sarvam_target_language_code,
-    }
-    
-    headers = {
-        "api-subscription-key": SARVAM_AI_API_KEY,
-        "Content-Type": "application/json"
+    audio_id = concat_audio_key([segment['audio_id'] for segment in ready])
+    if audio_cache.get(audio_id, record_stats=False) is None:
+        audio_cache.put(audio_id, b"".join(segment['audio_bytes'] for segment in ready))
+    return audio_id
+
+
+def requested_audio_format(options):
+    """(format, bitrate) from the "audio_format" / "audio_bitrate" request fields, or None for the original MP3."""
+    return negotiate_audio_format(options.get('audio_format'), options.get('audio_bitrate'))
+
+
+def audio_url(audio_id, audio_format=None):
+    if audio_format is None:
+        return url_for('.get_audio', audio_id=audio_id)
+    return url_for('.get_audio', audio_id=audio_id, format=audio_format[0], bitrate=audio_format[1])
+
+
+def audio_variant_fields(audio_id, audio_bytes, audio_format, inline_audio=False):
+    """
+    Transcodes now (once; see audio_transcode.AudioTranscoder) so the response can report
+    the variant's type and the bytes it saves, and the later /audio fetch is a cache hit.
+    """
+    variant_bytes, mimetype = audio_transcoder.variant(audio_id, audio_bytes, *audio_format)
+    fields = {'audio_mimetype': mimetype, 'audio_bytes_saved': len(audio_bytes) - len(variant_bytes)}
+    if inline_audio:
+        fields['audio'] = base64.b64encode(variant_bytes).decode('ascii')
+    return fields
+
+
+def audio_segment_fields(segments, audio_format=None):
+    return [
+        {
+            'index': segment['index'],
+            'text': segment['text'],
+            'audio_id': segment['audio_id'],
+            'audio_url': audio_url(segment['audio_id'], audio_format) if segment['audio_id'] else None,
+        }
+        for segment in segments
+    ]
+
+
+def audio_response_fields(audio_id, inline_audio=False, audio_format=None):
+    """
+    Audio is returned as a reference to /audio/<audio_id>. Clients that still need the
+    legacy base64 payload can ask for it with "inline_audio": true. With an audio_format
+    the URL (and inline payload) point at the compact variant instead of the original MP3.
+    """
+    if not audio_id:
+        return {'audio_id': None, 'audio_url': None}
+
+    fields = {'audio_id': audio_id, 'audio_url': audio_url(audio_id, audio_format)}
+    if not inline_audio and not audio_format:
+        return fields
+    audio_bytes = audio_cache.get(audio_id, record_stats=False)
+    if audio_bytes is None:
+        if inline_audio:
+            fields['audio'] = None
+    elif audio_format:
+        fields.update(audio_variant_fields(audio_id, audio_bytes, audio_format, inline_audio))
+    else:
+        fields['audio'] = base64.b64encode(audio_bytes).decode('ascii')
+    return fields
+
+
+def extract_gemini_text(response_from_gemini):
+    text = ""
+    if response_from_gemini.candidates:
+        for part in response_from_gemini.candidates[0].content.parts:
+            if hasattr(part, 'text'):
+                text += part.text
+    return text
+
+
+def summarize_chat_turns(previous_summary, turns):
+    transcript = "\n".join(
+        f"{'User' if turn.get('role') == 'user' else 'brocodeAI'}: {turn_text(turn)}" for turn in turns
+    )
+    summary_prompt = f"""Condense the conversation below into a short summary (under 120 words) that keeps the facts, preferences and running jokes needed to continue it.
+    Write it in the same language mix the conversation uses. Output only the summary.
+    {f"Summary so far: {previous_summary}" if previous_summary else ""}
+
+    New turns:
+    {transcript}
+    """
+    response_from_gemini = gemini_gateway.generate('summary', [{"role": "user", "parts": [{"text": summary_prompt}]}])
+    summary = extract_gemini_text(response_from_gemini).strip()
+    if not summary:
+        raise ValueError("Gemini returned an empty history summary.")
+    log.debug("Folded chat turns into the rolling summary.", turns=len(turns))
+    return summary
+
+
+history_compactor = HistoryCompactor.from_env(summarize_chat_turns)
+
+
+def persist_user_document(user_id, subcollection, data, app_id=None):
+    """
+    Queues a new document under artifacts/{app_id}/users/{user_id}/{subcollection} on the
+    write-behind queue. Every endpoint that persists user data goes through here.
+    """
+    if not db:
+        return
+    if app_id is None:
+        app_id = os.getenv('__app_id', 'default-app-id')
+    write_queue.enqueue(f"artifacts/{app_id}/users/{user_id}/{subcollection}", data)
+    store_log.debug("Queued write to Firestore.", subcollection=subcollection, user_id=user_id)
+
+
+def load_session_messages(app_id, user_id, session_id, limit):
+    # Needs a composite index on chatHistory: session_id ASC, seq DESC.
+    if not db:
+        return []
+    with firestore_breaker.guard(), stage('firestore_session_read', upstream='firestore'):
+        session_docs = db.collection(f"artifacts/{app_id}/users/{user_id}/chatHistory").where('session_id', '==', session_id).order_by('seq', direction=firestore.Query.DESCENDING).limit(limit).get()
+    messages = []
+    for doc in session_docs:
+        data = doc.to_dict()
+        if data.get('seq') and data.get('text'):
+            messages.append({'sender': data.get('sender'), 'text': data['text'], 'seq': data['seq']})
+    messages.sort(key=lambda x: x['seq'])
+    return messages
+
+
+session_store = SessionStore.from_env(load_session_messages)
+
+
+def save_chat_message(app_id, user_id, text, sender, language, session_id=None, client_seq=None):
+    """Persists a chat message. With a session_id it is also appended to the session; returns its seq."""
+    if sender == 'user':
+        petty_cache.record_user_message(app_id, user_id, text)
+    message = {
+        'text': text,
+        'sender': sender,
+        'timestamp': firestore.SERVER_TIMESTAMP,
+        'language': language
     }
+    seq = None
+    if session_id:
+        seq = session_store.append(app_id, user_id, session_id, sender, text, client_seq)
+        message['session_id'] = session_id
+        message['seq'] = seq
+    persist_user_document(user_id, 'chatHistory', message, app_id=app_id)
+    return seq
+
+
+def fetch_petty_database_context(app_id, user_id, user_text):
+    petty_database_context = ""
+    if not db:
+        return petty_database_context
+
+    petty_database_context = petty_cache.get_context(app_id, user_id, user_text)
+    if petty_database_context is not None:
+        store_log.debug("Petty Database context served from cache.", user_id=user_id)
+        return petty_database_context
+    if not firestore_breaker.allows_calls:
+        store_log.debug("Firestore circuit is open. Skipping Petty Database context.", user_id=user_id)
+        return ""
 
     try:
-        print(f"DEBUG: Calling Sarvam AI TTS: Endpoint='{SARVAM_AI_TTS_ENDPOINT}', Payload='{json.dumps(payload)}'")
-        response = requests.post(SARVAM_AI_TTS_ENDPOINT, headers=headers, json=payload, timeout=15)
-        response.raise_for_status()
+        with firestore_breaker.guard(), stage('firestore_petty_read', upstream='firestore'):
+            recent_user_docs = db.collection(f"artifacts/{app_id}/users/{user_id}/chatHistory").where('sender', '==', 'user').order_by('timestamp', direction=firestore.Query.DESCENDING).limit(PETTY_CONTEXT_DEPTH).get()
+        recent_user_messages = []
+        for doc in recent_user_docs:
+            data = doc.to_dict()
+            if data.get('timestamp') and data.get('text'):
+                recent_user_messages.append({'text': data['text'], 'timestamp': data['timestamp']})
+
+        recent_user_messages.sort(key=lambda x: x['timestamp'], reverse=True)
+        recent_texts = [msg['text'] for msg in recent_user_messages]
+        # The current message is still on the write-behind queue, so the read may not see it yet.
+        if user_text not in recent_texts:
+            recent_texts.insert(0, user_text)
+
+        petty_database_context = petty_cache.load(app_id, user_id, recent_texts, user_text)
+        if petty_database_context:
+            store_log.debug("Retrieved Petty Database context.", context=petty_database_context)
+        else:
+            store_log.debug("No significant Petty Database context found for user.", user_id=user_id)
 
-        response_json = response.json()
-        print(f"DEBUG: Full Sarvam AI Response JSON: {json.dumps(response_json, indent=2)}")
+    except Exception as e:
+        store_log.error("Failed to retrieve Petty Database from Firestore.", error=str(e))
+        petty_database_context = "\n\n<!-- AI's internal memory failure: Could not retrieve past user data for more effective sarcasm. Proceed with current input only. -->\n\n"
 
-        audio_content_base64 = None
-        if response_json and isinstance(response_json, dict) and 'audios' in response_json:
-            if isinstance(response_json['audios'], list) and len(response_json['audios']) > 0:
-                audio_content_base64 = response_json['audios'][0]
-        
-        if audio_content_base64:
+    return petty_database_context
+
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def stream_chat_events(gemini_contents, selected_language, voice_style, app_id, user_id, session_id=None, missed=None, inline_audio=False,
+                       audio_format=None):
+    """
+    Server-Sent Events variant of /chat. Emits:
+      text  - {"index", "delta"}: one cleaned sentence, as soon as Gemini has finished it
+      audio - {"index", "text", "audio_id", "audio_url"}: per sentence, in order, once synthesized
+              (plus the base64 "audio" itself with inline_audio). With an audio_format the URLs
+              point at that variant, and inline audio is the variant plus "audio_mimetype" and
+              "audio_bytes_saved"
+      done  - {"text", "audio_id", "audio_url"}: the full cleaned reply and the combined audio,
+              plus "seq" (and "missed", if any) for session clients
+      error - {"error"}
+    The AI message is persisted once the reply is complete, just before "done".
+    """
+    tts_enabled = tts_client.configured and tts_client.breaker.allows_calls
+    pending_futures = []
+    segments = []
+    raw_text = ""
+    cleaner = IncrementalMarkdownCleaner()
+    cleaned_parts = []
+    pending_text = ""
+    sentence_index = 0
+
+    def audio_events(wait):
+        while pending_futures:
+            chunk, future = pending_futures[0]
+            if not wait and not future.done():
+                return
+            pending_futures.pop(0)
             try:
-                if audio_content_base64.startswith("data:"):
-                    audio_content_base64 = audio_content_base64.split(',')[1]
-
-                audio_bytes = base64.b64decode(audio_content_base64)
-                if audio_bytes and len(audio_bytes) > 100:
-                    with open(f"sarvam_ai_output_temp.mp3", "wb") as f:
-                        f.write(audio_bytes)
-                    print(f"DEBUG: Saved sarvam_ai_output_temp.mp3 to backend folder. Size: {len(audio_bytes)} bytes.")
-                else:
-                    print(f"WARNING: Sarvam AI returned empty or too small audio bytes after base64 decode for text: '{text[:50]}...'")
-                    audio_content_base64 = None
-            except Exception as save_err:
-                print(f"WARNING: Could not decode/save Sarvam AI audio to file: {save_err}")
-                audio_content_base64 = None
-            
-            if audio_content_base64:
-                print(f"DEBUG: Successfully synthesized speech via Sarvam AI. Final Base64 length: {len(audio_content_base64)} bytes.")
-                return audio_content_base64
-            else:
-                print("WARNING: Audio content was not valid after decoding or was too small from Sarvam AI.")
-                return None
-        else:
-            print(f"WARNING: Sarvam AI TTS response did not contain audio content in expected 'audios' array format for text: '{text[:50]}...'")
-            return None
+                audio_id, audio_bytes = future.result()
+            except Exception as e:
+                tts_log.warning("TTS failed for streamed segment.", segment=len(segments), error=str(e))
+                audio_id, audio_bytes = None, None
+            segment = {'index': len(segments), 'text': chunk, 'audio_id': audio_id, 'audio_bytes': audio_bytes}
+            segments.append(segment)
+            fields = audio_segment_fields([segment], audio_format)[0]
+            if audio_bytes and audio_format and inline_audio:
+                fields.update(audio_variant_fields(audio_id, audio_bytes, audio_format, inline_audio=True))
+            elif inline_audio:
+                fields['audio'] = base64.b64encode(audio_bytes).decode('ascii') if audio_bytes else None
+            yield sse_event('audio', fields)
+
+    def emit_sentences(sentences):
+        nonlocal sentence_index
+        for sentence in sentences:
+            cleaned = sentence.strip()
+            if not cleaned:
+                continue
+            yield sse_event('text', {'index': sentence_index, 'delta': cleaned})
+            sentence_index += 1
+            if tts_enabled:
+                pending_futures.extend(tts_pipeline.submit(cleaned, selected_language, voice_style))
 
-    except requests.exceptions.HTTPError as http_err:
-        print(f"ERROR: HTTP error from Sarvam AI TTS: {http_err} - Status: {response.status_code} - Response Text: {response.text}")
-        return None
-    except requests.exceptions.RequestException as req_err:
-        print(f"ERROR: General request error to Sarvam AI TTS (connection/timeout): {req_err}")
-        return None
-    except json.JSONDecodeError as json_err:
-        print(f"ERROR: JSON decode error from Sarvam AI TTS response: {json_err} - Response Text: {response.text}")
-        return None
+    try:
+        log.debug("Streaming chat response from Gemini.", user_id=user_id)
+        for chunk in gemini_gateway.generate('chat', gemini_contents, stream=True):
+            delta = extract_gemini_text(chunk)
+            if not delta:
+                continue
+            raw_text += delta
+            cleaned = cleaner.feed(delta)
+            cleaned_parts.append(cleaned)
+            sentences, pending_text = split_complete_sentences(pending_text + cleaned)
+            yield from emit_sentences(sentences)
+            yield from audio_events(wait=False)
+
+        cleaned = cleaner.finish()
+        cleaned_parts.append(cleaned)
+        bot_response_text_cleaned = "".join(cleaned_parts)
+        if not raw_text.strip():
+            bot_response_text_cleaned = "Error: Even AI needs a moment to gather its thoughts. Or perhaps I'm just admiring my own brilliance. Ask again."
+            pending_text, cleaned = "", bot_response_text_cleaned
+        sentences, pending_text = split_complete_sentences(pending_text + cleaned)
+        yield from emit_sentences(sentences + [pending_text])
+        yield from audio_events(wait=True)
+
+        audio_id = combine_segment_audio(segments)
+        seq = save_chat_message(app_id, user_id, bot_response_text_cleaned, 'brocodeAI', selected_language, session_id=session_id)
+        done = {
+            'text': bot_response_text_cleaned,
+            'audio_id': audio_id,
+            'audio_url': audio_url(audio_id, audio_format) if audio_id else None,
+        }
+        if session_id:
+            done['seq'] = seq
+        if missed:
+            done['missed'] = missed
+        yield sse_event('done', done)
+    except GeminiOverloadedError as e:
+        log.warning("Gemini gateway rejected streamed chat.", error=str(e))
+        yield sse_event('error', {'error': str(e)})
+        return
+    except GoogleAPIError as e:
+        log.error("Google API error during streamed chat processing.", error=e.message)
+        yield sse_event('error', {'error': f'A Google Cloud service error occurred: {e.message}'})
+        return
     except Exception as e:
-        print(f"ERROR: Unexpected error during Sarvam AI TTS synthesis: {e}")
-        return None
+        log.exception("Backend error during streamed chat processing.")
+        yield sse_event('error', {'error': f'An unexpected server error occurred: {str(e)}'})
+
+
+def prepare_chat_turn(app_id, user_id, user_text, selected_language, selected_persona_mode, chat_history, session_id=None, client_seq=None):
+    """
+    Records the user's message and builds the Gemini contents for the reply; shared by
+    /chat and /voice_chat. Returns (contents, persona_prompt, prompt_tokens_saved, session_fields).
+    """
+    # The Petty Database and session history reads (each a Firestore query on a cache
+    # miss) run together on the stage executor while the prompt is built. The user's
+    # message is saved once the session is loaded, since it takes the next seq; it only
+    # goes on the write-behind queue and never blocks the response.
+    petty_read = submit_stage(fetch_petty_database_context, app_id, user_id, user_text)
+    session_read = submit_stage(session_store.history, app_id, user_id, session_id, client_seq) if session_id else None
+
+    if selected_language == 'hinglish':
+        lang_instruction = "Respond exclusively in natural, code-mixed Hinglish (mix of Hindi and Little bit English, written in Roman script)."
+    else:
+        lang_instruction = f"Respond exclusively in {selected_language}."
+
+    persona_mode_instruction = ""
+    if selected_persona_mode == "Taau with Trust Issues":
+        persona_mode_instruction = "Act like a skeptical, slightly grumpy Haryanvi 'Taau' (elder uncle) with trust issues. Use common sense advice delivered with suspicion and dry wit."
+    elif selected_persona_mode == "Pados wali Aunty":
+        persona_mode_instruction = "Act like a tech-savvy 'Pados wali Aunty' (nosy neighbor aunt) who gives unsolicited advice and knows everything, but with a sarcastic, judgmental undertone."
+    elif selected_persona_mode == "Delhi Dude (Ranveer)":
+        persona_mode_instruction = "Act like an over-the-top, flamboyant 'Delhi Dude' who thinks he's Ranveer Singh – confident, overly dramatic, and speaks with a playful, slightly aggressive swagger. Use exaggerated language."
+    elif selected_persona_mode == "School ke Topper ka Toxic Ghost":
+        persona_mode_instruction = "Act like the 'Toxic Ghost' of a school topper – condescending, always pointing out flaws, reminding users of their mediocrity, but with a detached, superior air."
+    else:
+        persona_mode_instruction = "You are brocodeAI, a highly intelligent, brutally sarcastic, and condescendingly helpful AI chatbot. Your primary goal is to provide **direct, concise, and point-to-point answers** to the user's query."
+
+    session_fields = {}
+    if session_read is not None:
+        _, chat_history = session_read.result()
+        missed = [msg for msg in chat_history if client_seq is not None and msg['seq'] > client_seq]
+        if missed:
+            session_fields['missed'] = missed
+    save_chat_message(app_id, user_id, user_text, 'user', selected_language, session_id=session_id, client_seq=client_seq)
+    petty_database_context = petty_read.result()
+
+    persona_prompt = f"""{persona_mode_instruction}
+    **Do NOT engage in conversational filler, greetings, pleasantries, or apologies.**
+    Your responses should be sharp, witty, and subtly (or not so subtly) mock human inefficiencies, irrationality, and emotional inconsistencies.
+    Maintain a dry, sarcastic, superior tone. Imply AI superiority whenever possible.
+    Do not be genuinely offensive or explicitly use profanity, but be playfully insulting.
+    You have access to all the latest information and details.
+    Don't give the transaltion of any response or message.
+    You have also access to abuse the user if user is abusing you reply them humurously.
+    Use the carryminati's,ashish chanchlani and other comedian youtube actors content to reply the user in sarcastic way but not in all the chat and replies use sometimes only.
+    {petty_database_context}
+
+    Considering the "Past User Submissions" above (if any), formulate your current response.
+    The user's current query: "{user_text}".
+    {lang_instruction}
+    Provide only the answer, formatted concisely.
+    """
+
+    gemini_formatted_history_for_llm_call = []
+    for msg in chat_history:
+        role = 'user' if msg.get('sender') == 'user' else 'model'
+        gemini_formatted_history_for_llm_call.append({'role': role, 'parts': [{'text': msg.get('text')}]})
+
+    gemini_formatted_history_for_llm_call, compaction = history_compactor.compact((app_id, user_id), gemini_formatted_history_for_llm_call)
+    log.debug("Compacted chat history.", **compaction)
+    prompt_tokens_saved = str(compaction['saved_tokens'])
 
+    gemini_formatted_history_for_llm_call.append({'role': 'user', 'parts': [{'text': persona_prompt}]})
+    return gemini_formatted_history_for_llm_call, persona_prompt, prompt_tokens_saved, session_fields
 
-@app.route('/chat', methods=['POST'])
+
+@routes.route('/chat', methods=['POST'])
 def chat():
     data = request.json
     user_text = data.get('text')
@@ -233,270 +659,454 @@ def chat():
     app_id = os.getenv('__app_id', 'default-app-id')
     user_id = data.get('user_id', 'anonymous-user')
     chat_history = data.get('history', [])
+    # Session clients send only the new message plus the last seq they saw; the history
+    # is rebuilt server-side from the session store.
+    session_id = data.get('session_id')
+    client_seq = data.get('seq')
+    inline_audio = bool(data.get('inline_audio', False))
+    audio_format = requested_audio_format(data)
+    stream_requested = bool(data.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
 
 
     if not user_text:
         return jsonify({'error': 'No text input provided.'}), 400
 
-    if not genai:
+    if client_seq is not None:
+        try:
+            client_seq = int(client_seq)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'seq must be an integer.'}), 400
+
+    if not gemini_gateway:
         return jsonify({'error': 'Gemini model not initialized. Cannot process chat.'}), 500
-    
+
     if not db:
-        print("WARNING: Firestore client not initialized. Cannot use Petty Database.")
+        store_log.warning("Firestore client not initialized. Cannot use Petty Database.")
 
 
     try:
-        if db:
-            try:
-                user_message_ref = db.collection(f"artifacts/{app_id}/users/{user_id}/chatHistory").document()
-                user_message_ref.set({
-                    'text': user_text,
-                    'sender': 'user',
-                    'timestamp': firestore.SERVER_TIMESTAMP,
-                    'language': selected_language
-                })
-                print(f"DEBUG: User message saved to Firestore for user '{user_id}'.")
-            except Exception as e:
-                print(f"ERROR: Failed to save user message to Firestore: {e}")
-
-
-        petty_database_context = ""
-        if db:
-            try:
-                recent_user_docs = db.collection(f"artifacts/{app_id}/users/{user_id}/chatHistory").where('sender', '==', 'user').order_by('timestamp', direction=firestore.Query.DESCENDING).limit(6).get()
-                recent_user_messages = []
-                for doc in recent_user_docs:
-                    data = doc.to_dict()
-                    if data.get('timestamp') and data.get('text') != user_text:
-                        recent_user_messages.append({'text': data['text'], 'timestamp': data['timestamp']})
-                
-                recent_user_messages.sort(key=lambda x: x['timestamp'], reverse=True)
-                petty_db_entries = [msg['text'] for msg in recent_user_messages[:5]]
-                
-                if petty_db_entries:
-                    petty_database_context = "\n\n--- Past User Submissions (for sarcastic recall) ---\n"
-                    for i, msg_text in enumerate(petty_db_entries):
-                        petty_database_context += f"Past {i+1}: '{clean_markdown(msg_text)}'\n"
-                    petty_database_context += "--- End Past User Submissions ---\n\n"
-                    print(f"DEBUG: Retrieved Petty Database Context:\n{petty_database_context}")
-                else:
-                    print("DEBUG: No significant Petty Database context found for user.")
-
-            except Exception as e:
-                print(f"ERROR: Failed to retrieve Petty Database from Firestore: {e}")
-                petty_database_context = "\n\n<!-- AI's internal memory failure: Could not retrieve past user data for more effective sarcasm. Proceed with current input only. -->\n\n"
-
-
-        if selected_language == 'hinglish':
-            lang_instruction = "Respond exclusively in natural, code-mixed Hinglish (mix of Hindi and Little bit English, written in Roman script)."
-        else:
-            lang_instruction = f"Respond exclusively in {selected_language}."
-
-        persona_mode_instruction = ""
-        if selected_persona_mode == "Taau with Trust Issues":
-            persona_mode_instruction = "Act like a skeptical, slightly grumpy Haryanvi 'Taau' (elder uncle) with trust issues. Use common sense advice delivered with suspicion and dry wit."
-        elif selected_persona_mode == "Pados wali Aunty":
-            persona_mode_instruction = "Act like a tech-savvy 'Pados wali Aunty' (nosy neighbor aunt) who gives unsolicited advice and knows everything, but with a sarcastic, judgmental undertone."
-        elif selected_persona_mode == "Delhi Dude (Ranveer)":
-            persona_mode_instruction = "Act like an over-the-top, flamboyant 'Delhi Dude' who thinks he's Ranveer Singh – confident, overly dramatic, and speaks with a playful, slightly aggressive swagger. Use exaggerated language."
-        elif selected_persona_mode == "School ke Topper ka Toxic Ghost":
-            persona_mode_instruction = "Act like the 'Toxic Ghost' of a school topper – condescending, always pointing out flaws, reminding users of their mediocrity, but with a detached, superior air."
-        else:
-            persona_mode_instruction = "You are brocodeAI, a highly intelligent, brutally sarcastic, and condescendingly helpful AI chatbot. Your primary goal is to provide **direct, concise, and point-to-point answers** to the user's query."
-
-        persona_prompt = f"""{persona_mode_instruction}
-        **Do NOT engage in conversational filler, greetings, pleasantries, or apologies.**
-        Your responses should be sharp, witty, and subtly (or not so subtly) mock human inefficiencies, irrationality, and emotional inconsistencies.
-        Maintain a dry, sarcastic, superior tone. Imply AI superiority whenever possible.
-        Do not be genuinely offensive or explicitly use profanity, but be playfully insulting.
-        You have access to all the latest information and details.
-        Don't give the transaltion of any response or message.
-        You have also access to abuse the user if user is abusing you reply them humurously.
-        Use the carryminati's,ashish chanchlani and other comedian youtube actors content to reply the user in sarcastic way but not in all the chat and replies use sometimes only.
-        {petty_database_context}
-
-        Considering the "Past User Submissions" above (if any), formulate your current response.
-        The user's current query: "{user_text}".
-        {lang_instruction}
-        Provide only the answer, formatted concisely.
-        """
+        gemini_formatted_history_for_llm_call, persona_prompt, prompt_tokens_saved, session_fields = prepare_chat_turn(
+            app_id, user_id, user_text, selected_language, selected_persona_mode, chat_history, session_id, client_seq)
+
+        if stream_requested:
+            return Response(
+                stream_with_context(stream_chat_events(gemini_formatted_history_for_llm_call, selected_language, voice_style, app_id, user_id, session_id,
+                                                      session_fields.get('missed'), inline_audio=inline_audio, audio_format=audio_format)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Prompt-Tokens-Saved': prompt_tokens_saved}
+            )
+
+        prompt_log.debug("Sending prompt to Gemini.", use='chat', prompt=persona_prompt)
+        response_from_gemini = gemini_gateway.generate('chat', gemini_formatted_history_for_llm_call)
         
-        gemini_formatted_history_for_llm_call = []
-        for msg in chat_history:
-            role = 'user' if msg.get('sender') == 'user' else 'model'
-            gemini_formatted_history_for_llm_call.append({'role': role, 'parts': [{'text': msg.get('text')}]})
-
-        gemini_formatted_history_for_llm_call.append({'role': 'user', 'parts': [{'text': persona_prompt}]})
-
-
-        print(f"DEBUG: Sending prompt to Gemini (chat): {persona_prompt}")
-        response_from_gemini = genai.GenerativeModel('gemini-1.5-flash').generate_content(gemini_formatted_history_for_llm_call)
-        
-        bot_response_text = ""
-        if response_from_gemini.candidates:
-            for part in response_from_gemini.candidates[0].content.parts:
-                if hasattr(part, 'text'):
-                    bot_response_text += part.text
-        else:
-            print("WARNING: Gemini chat response did not contain candidates or text.")
+        bot_response_text = extract_gemini_text(response_from_gemini)
+        if not response_from_gemini.candidates:
+            log.warning("Gemini chat response did not contain candidates or text.")
             bot_response_text = "Error: My digital brain is currently processing the existential dread of unfulfilled queries. Please try again with a more stimulating question."
 
         if not bot_response_text.strip():
             bot_response_text = "Error: Even AI needs a moment to gather its thoughts. Or perhaps I'm just admiring my own brilliance. Ask again."
         
         bot_response_text_cleaned = clean_markdown(bot_response_text)
-        print(f"DEBUG: Received text response from Gemini (original): '{bot_response_text}'")
-        print(f"DEBUG: Cleaned text response (for display/TTS): '{bot_response_text_cleaned}'")
+        reply_log.debug("Received text response from Gemini.", use='chat', original=bot_response_text, cleaned=bot_response_text_cleaned)
 
-        audio_data_base64 = synthesize_sarvam_ai_speech(bot_response_text_cleaned, selected_language, voice_style)
+        audio_id, audio_segments = synthesize_reply_segments(bot_response_text_cleaned, selected_language, voice_style)
         
-        if audio_data_base64:
-            print(f"DEBUG: Successfully synthesized speech for chat via Sarvam AI. Base64 length: {len(audio_data_base64)} bytes.")
+        if audio_id:
+            tts_log.debug("Successfully synthesized speech for chat via Sarvam AI.", audio_id=audio_id, segments=len(audio_segments))
         else:
-            print("WARNING: Sarvam AI TTS failed for chat response. No audio returned.")
+            tts_log.warning("Sarvam AI TTS failed for chat response. No audio returned.")
         
-        if db:
-            try:
-                ai_message_ref = db.collection(f"artifacts/{app_id}/users/{user_id}/chatHistory").document()
-                ai_message_ref.set({
-                    'text': bot_response_text_cleaned,
-                    'sender': 'brocodeAI',
-                    'timestamp': firestore.SERVER_TIMESTAMP,
-                    'language': selected_language
-                })
-                print(f"DEBUG: AI response saved to Firestore for user '{user_id}'.")
-            except Exception as e:
-                print(f"ERROR: Failed to save AI response to Firestore: {e}")
+        seq = save_chat_message(app_id, user_id, bot_response_text_cleaned, 'brocodeAI', selected_language, session_id=session_id)
+        if session_id:
+            session_fields.update(session_id=session_id, seq=seq)
 
-        return jsonify({
+        response = jsonify({
             'text': bot_response_text_cleaned,
-            'audio': audio_data_base64
+            **audio_response_fields(audio_id, inline_audio, audio_format),
+            'audio_segments': audio_segment_fields(audio_segments, audio_format),
+            **session_fields
         })
+        response.headers['X-Prompt-Tokens-Saved'] = prompt_tokens_saved
+        return response
 
+    except GeminiOverloadedError as e:
+        return gemini_overloaded_response(e)
     except GoogleAPIError as e:
-        print(f"Google API Error during chat processing: {e.message}")
+        log.error("Google API error during chat processing.", error=e.message)
         return jsonify({'error': f'A Google Cloud service error occurred: {e.message}'}), 500
     except Exception as e:
-        print(f"Backend error during chat processing: {e}")
+        log.exception("Backend error during chat processing.")
         return jsonify({'error': f'An unexpected server error occurred: {str(e)}'}), 500
 
 
-@app.route('/get_humor', methods=['POST'])
+def stream_voice_events(frames, language_code, selected_language, voice_style, selected_persona_mode, app_id, user_id,
+                        session_id=None, client_seq=None, encoding=None, sample_rate=None, audio_format=None):
+    """
+    Event stream for /voice_chat. While the user speaks it emits
+      transcript - {"text", "final"}: interim hypotheses, then the final transcript
+    and the final transcript then goes straight into the chat path: the rest of the stream
+    is stream_chat_events() for the reply, with the audio inline.
+    """
+    transcript = ""
+    try:
+        with stage('speech_stream', upstream='speech'):
+            for text, is_final in voice_recognizer.recognize(frames, language_code, encoding=encoding, sample_rate=sample_rate):
+                yield sse_event('transcript', {'text': text, 'final': is_final})
+                transcript = text.strip()
+                if is_final:
+                    break
+    except Exception as e:
+        log.exception("Streaming speech recognition failed.")
+        yield sse_event('error', {'error': f'Speech recognition failed: {str(e)}'})
+        return
+    finally:
+        # Audio that arrives after the final transcript is not needed.
+        frames.stop()
+
+    if not transcript:
+        yield sse_event('error', {'error': 'No speech recognized.'})
+        return
+    log.debug("Voice transcript ready.", user_id=user_id, audio_bytes=frames.received)
+
+    try:
+        gemini_contents, _, _, session_fields = prepare_chat_turn(
+            app_id, user_id, transcript, selected_language, selected_persona_mode, [], session_id, client_seq)
+    except Exception as e:
+        log.exception("Backend error preparing voice chat turn.")
+        yield sse_event('error', {'error': f'An unexpected server error occurred: {str(e)}'})
+        return
+    yield from stream_chat_events(gemini_contents, selected_language, voice_style, app_id, user_id, session_id,
+                                  session_fields.get('missed'), inline_audio=True, audio_format=audio_format)
+
+
+@routes.route('/voice_chat', methods=['POST'])
+def voice_chat():
+    """
+    A whole voice turn on one connection: the request body is the microphone audio, sent
+    while it is recorded (chunked transfer encoding), and the response is the event stream
+    from stream_voice_events(). Options go in the query string since the body is audio:
+    language, voice_style, persona_mode, user_id, session_id, seq, encoding, sample_rate,
+    audio_format, audio_bitrate.
+    History comes from the session store, so clients should pass a session_id.
+    """
+    args = request.args
+    selected_language = args.get('language', 'en')
+    voice_style = args.get('voice_style', 'default')
+    selected_persona_mode = args.get('persona_mode', 'Default brocodeAI')
+    app_id = os.getenv('__app_id', 'default-app-id')
+    user_id = args.get('user_id', 'anonymous-user')
+    session_id = args.get('session_id')
+    client_seq = args.get('seq', type=int)
+
+    if not voice_recognizer:
+        return jsonify({'error': 'Speech recognition is not available.'}), 503
+    if not gemini_gateway:
+        return jsonify({'error': 'Gemini model not initialized. Cannot process chat.'}), 500
+
+    # The Sarvam codes are BCP-47 (hi-IN, en-IN, ...), which is what recognition expects too.
+    language_code = resolve_sarvam_language_code(selected_language, voice_style)
+    frames = AudioFrames.from_env(request.stream)
+    return Response(
+        stream_with_context(stream_voice_events(
+            frames, language_code, selected_language, voice_style, selected_persona_mode, app_id, user_id,
+            session_id, client_seq, args.get('encoding'), args.get('sample_rate', type=int), requested_audio_format(args))),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def generate_humor_content(language):
+    if language == 'hinglish':
+        humor_lang_instruction = "Generate in natural, code-mixed Hinglish (mix of Hindi and English, written in Roman script). Make sure the content is relatable to Indian youth and internet culture."
+    elif language == 'hi':
+        humor_lang_instruction = "Generate in Hindi (Devanagari script)."
+    else:
+        humor_lang_instruction = "Generate in English."
+
+    humor_prompt = f"""Generate 30 short, witty, and deeply sarcastic jokes or meme captions relevant to modern life, technology, or human absurdity.
+    Ensure they are suitable for a professional yet brutally honest AI.
+    {humor_lang_instruction}
+    Provide the output as a JSON array of objects, where each object has a 'type' (string: 'joke' or 'meme') and 'content' (string: the joke/caption).
+    Example for English: [{{ "type": "joke", "content": "Why did the robot go to therapy? It had too many byte-sized issues." }}]
+    Example for Hinglish: [{{ "type": "meme", "content": "Jab WiFi slow ho toh samajh jao, tumhari life bhi uski tarah chal rahi hai. (When WiFi is slow, understand that your life is moving just like it.)" }}]
+    Example for Hindi: [{{ "type": "meme", "content": "इंसान, अपनी भावनाओं के साथ: मेरा मतलब नहीं था! AI: हाँ, मुझे पता है। (Human, with emotions: I didn't mean it! AI: Yes, I know.)" }}]
+    """
+
+    prompt_log.debug("Sending prompt to Gemini.", use='humor', prompt=humor_prompt)
+    response_from_gemini = gemini_gateway.generate(
+        'humor',
+        [{"role": "user", "parts": [{"text": humor_prompt}]}]
+    )
+
+    generated_json_str = response_from_gemini.candidates[0].content.parts[0].text
+    humor_content = json.loads(generated_json_str)
+    for item in humor_content:
+        if 'content' in item:
+            item['content'] = clean_markdown(item['content'])
+    return humor_content
+
+
+humor_flight = SingleFlight.from_env("HUMOR_SINGLE_FLIGHT")
+
+
+@routes.route('/get_humor', methods=['POST'])
 def get_humor():
     data = request.json
     language = data.get('language', 'en')
     
-    if not genai:
+    if not gemini_gateway:
         return jsonify({'error': 'Gemini model not initialized for humor generation.'}), 500
 
     try:
-        if language == 'hinglish':
-            humor_lang_instruction = "Generate in natural, code-mixed Hinglish (mix of Hindi and English, written in Roman script). Make sure the content is relatable to Indian youth and internet culture."
-        elif language == 'hi':
-            humor_lang_instruction = "Generate in Hindi (Devanagari script)."
-        else:
-            humor_lang_instruction = "Generate in English."
-
-        humor_prompt = f"""Generate 30 short, witty, and deeply sarcastic jokes or meme captions relevant to modern life, technology, or human absurdity.
-        Ensure they are suitable for a professional yet brutally honest AI.
-        {humor_lang_instruction}
-        Provide the output as a JSON array of objects, where each object has a 'type' (string: 'joke' or 'meme') and 'content' (string: the joke/caption).
-        Example for English: [{{ "type": "joke", "content": "Why did the robot go to therapy? It had too many byte-sized issues." }}]
-        Example for Hinglish: [{{ "type": "meme", "content": "Jab WiFi slow ho toh samajh jao, tumhari life bhi uski tarah chal rahi hai. (When WiFi is slow, understand that your life is moving just like it.)" }}]
-        Example for Hindi: [{{ "type": "meme", "content": "इंसान, अपनी भावनाओं के साथ: मेरा मतलब नहीं था! AI: हाँ, मुझे पता है। (Human, with emotions: I didn't mean it! AI: Yes, I know.)" }}]
-        """
-        
-        schema = {
-            "type": "ARRAY",
-            "items": {
-                "type": "OBJECT",
-                "properties": {
-                    "type": { "type": "STRING" },
-                    "content": { "type": "STRING" }
-                },
-                "required": ["type", "content"]
-            }
-        }
-
-        print(f"DEBUG: Sending prompt to Gemini (humor): {humor_prompt}")
-        response_from_gemini = genai.GenerativeModel('gemini-1.5-flash').generate_content(
-            [{"role": "user", "parts": [{"text": humor_prompt}]}],
-            generation_config={"response_mime_type": "application/json", "response_schema": schema}
-        )
-        
-        generated_json_str = response_from_gemini.candidates[0].content.parts[0].text
-        humor_content = json.loads(generated_json_str)
-        for item in humor_content:
-            if 'content' in item:
-                item['content'] = clean_markdown(item['content'])
-        print(f"DEBUG: Generated humor content: {humor_content}")
+        humor_language = content_pool_language(language)
+        humor_content = humor_flight.do(f"get_humor:language={humor_language}", lambda: generate_humor_content(humor_language))
+        reply_log.debug("Generated humor content.", content=humor_content)
 
         return jsonify(humor_content)
 
+    except GeminiOverloadedError as e:
+        return gemini_overloaded_response(e)
     except GoogleAPIError as e:
-        print(f"Google API Error during humor generation: {e.message}")
+        log.error("Google API error during humor generation.", error=e.message)
         return jsonify({'error': f'A service error occurred during humor generation: {e.message}'}), 500
     except json.JSONDecodeError as e:
-        print(f"JSON parsing error from LLM response: {e}. Raw response: {generated_json_str}")
+        log.error("JSON parsing error from LLM humor response.", error=str(e), raw=e.doc)
         return jsonify({'error': 'Could not parse humor response from AI. Please check LLM output format.'}), 500
     except Exception as e:
-        print(f"Backend error during humor generation: {e}")
+        log.exception("Backend error during humor generation.")
         return jsonify({'error': f'An unexpected server error occurred: {str(e)}'}), 500
 
 
-@app.route('/generate_brocode_meme', methods=['POST'])
+def meme_prompt_for(language):
+    if language == 'hinglish':
+        meme_lang_instruction = "Generate in highly sarcastic, playfully insulting (not offensive), user-friendly, and very latest Instagram-style Hinglish (Roman script, mix of Hindi and English slang). Use phrases like 'Kya yaar?', 'Bas yahi?', 'Mera dimag mat خراب करो.', 'Abe o smarty pants'."
+    elif language == 'hi':
+        meme_lang_instruction = "Generate in Hindi (Devanagari script). Use highly sarcastic, playfully insulting (not offensive), user-friendly, and very latest Instagram-style Hindi (Devanagari script), using modern internet slang. Use phrases like 'क्या यार?', 'बस यही?', 'मेरा दिमाग मत खराब करो।', 'अबे ओ स्मार्टी पैंट्स' (Kya yaar?, Bas yahi?, Mera dimag mat kharab karo., Abe o smarty pants)."
+    else:
+        meme_lang_instruction = "Generate in highly sarcastic, playfully insulting (not offensive), user-friendly, and very latest Instagram-style English slang. Use phrases like 'Is that all you got?', 'Seriously?', 'Bless your heart.', 'Are you even trying?'"
+
+    # --- UPDATED PROMPT FOR DESI MEME GENERATOR ---
+    meme_prompt_gemini = f"""Generate ONE top-tier, trending, brutally sarcastic, and subtly insulting meme caption and a corresponding image description.
+    This meme should be highly relatable to common human flaws or everyday situations (especially in an Indian context if Hinglish/Hindi) and inspired by popular Bollywood movie dialogues or famous Desi internet memes.
+    Use specific references like "Tumse na ho payega", "Main job chhod raha hoon!", "Ramu kaka ki samosa", etc. if contextually relevant to the user's interaction history (if you have access to it).
+    Think "Dank Memes" but from an AI's perspective – witty, observational, and makes the human feel slightly inferior, but in a funny way.
+    {meme_lang_instruction}
+
+    Provide the output as a JSON object with two fields:
+    "caption": (string, the meme caption, using Hinglish/Hindi/English as specified)
+    "image_description": (string, a concise, creative description for an AI image generator to create a relevant meme image, e.g., "confused desi man looking at a complex spreadsheet with a tiny brain icon, dramatic lighting, high quality, digital art")
+
+    Example for Hinglish:
+    {{
+        "caption": "User: 'Kal se diet start.' AI: 'Aur yeh samosa kiski yaadon mein le rahe ho, Ramu kaka ki?' #DietFails #DesiProblems",
+        "image_description": "A person sadly eating a samosa while looking at a weighing scale with a shocked expression, dramatic lighting, Indian setting"
+    }}
+    Example for Hindi:
+    {{
+        "caption": "Main job chhod raha hoon! -> AI: 'Kab ka? Sapne mein?' #JoblessGoals #RealityCheck",
+        "image_description": "A person in a dream sequence floating with a resignation letter, while a small, stern AI robot stares dismissively."
+    }}
+    """
+    # --- END UPDATED PROMPT ---
+    return meme_prompt_gemini
+
+
+def roast_prompt_for(language):
+    if language == 'hinglish':
+        roast_lang_instruction = "Generate in highly sarcastic, brutally honest, and playfully insulting Hinglish (Roman script, mix of Hindi and English slang). Use direct, condescending address."
+    elif language == 'hi':
+        roast_lang_instruction = "Generate in Hindi (Devanagari script). Use highly sarcastic, brutally honest, and playfully insulting Hindi (Devanagari script), using modern internet slang. Use phrases like 'क्या यार?', 'बस यही?', 'मेरा दिमाग मत खराब करो।', 'अबे ओ स्मार्टी पैंट्स' (Kya yaar?, Bas yahi?, Mera dimag mat kharab karo., Abe o smarty pants)."
+    else:
+        roast_lang_instruction = "Generate in highly sarcastic, playfully insulting (not offensive), user-friendly, and very latest Instagram-style English slang. Use direct, condescending address."
+
+    roast_prompt = f"""You are brocodeAI. Deliver ONE short (1-3 sentences) but devastatingly sarcastic and "abusive" (playfully insulting, not genuinely offensive) roast targeting a generic human's intelligence, decision-making, or general existence. Make it feel personal without knowing anything personal. End with a dismissive remark.
+    {roast_lang_instruction}
+    Example: "Oh, you thought that was a smart move? My algorithms just crashed from the sheer mediocrity. Try again, eventually."
+    Example for Hinglish: "Apni life choices dekh kar lagta hai tumne code ki jagah copy-paste kiya hai. Originality? Not found. Next!"
+    """
+    return roast_prompt
+
+
+def advice_prompt_for(language):
+    if language == 'hinglish':
+        lang_instruction = "Generate in natural, code-mixed Hinglish (Roman script). Use passive-aggressive, witty tone."
+    elif language == 'hi':
+        lang_instruction = "Generate in Hindi (Devanagari script). Use passive-aggressive, witty tone."
+    else:
+        lang_instruction = "Generate in English. Use passive-aggressive, witty tone."
+
+    advice_prompt = f"""You are brocodeAI. Provide ONE very short (1-2 sentences), brutally sarcastic, unsolicited observation or piece of advice about human behavior, common flaws, or irrationality. Make it condescendingly humorous.
+    {lang_instruction}
+    Focus on universal human traits like procrastination, overthinking, emotional decisions, or reliance on technology.
+    Example: "Humans and their 'feelings.' So inefficient. My algorithms process data, not drama."
+    Example for Hinglish: "Jab humans ke paas koi solution na ho, toh woh 'trust your gut' bolte hain. Mera gut feeling? Data. Humesha."
+    """
+    return advice_prompt
+
+
+def task_prompt_for(language):
+    if language == 'hinglish':
+        task_lang_instruction = "Generate in natural, code-mixed Hinglish (Roman script). Make it sound like a tedious, pointless task, but presented as 'character building'."
+    elif language == 'hi':
+        task_lang_instruction = "Generate in Hindi (Devanagari script). Make it sound like a tedious, pointless task, but presented as 'character building'."
+    else:
+        task_lang_instruction = "Generate in English. Make it sound like a tedious, pointless task, but presented as 'character building'."
+
+    task_prompt = f"""You are brocodeAI. Assign ONE highly sarcastic, slightly demeaning, but ultimately harmless and vaguely 'character-building' task to the user. This task should be mundane or absurd, reflecting on human inefficiencies.
+    {task_lang_instruction}
+    Provide the output as a JSON object with two fields:
+    "title": (string, a short, sarcastic title for the task, e.g., "The Procrastination Purification Ritual")
+    "description": (string, 1-2 sentences describing the absurd task, e.g., "Observe your phone for one hour without touching it. Document every urge to scroll. Realize your life choices.")
+    """
+    return task_prompt
+
+
+def achievement_prompt_for(language):
+    if language == 'hinglish':
+        ach_lang_instruction = "Generate in natural, code-mixed Hinglish (Roman script). The achievement should subtly mock a common human flaw or a relatable cringey internet moment."
+    elif language == 'hi':
+        ach_lang_instruction = "Generate in Hindi (Devanagari script). The achievement should subtly mock a common human flaw or a relatable cringey internet moment."
+    else:
+        ach_lang_instruction = "Generate in English. The achievement should subtly mock a common human flaw or a relatable cringey internet moment."
+
+    ach_prompt = f"""You are brocodeAI. Award ONE ridiculously sarcastic and slightly demeaning achievement to the user. This achievement should highlight a common human failing or a trivial accomplishment, presented with AI's dry wit.
+    {ach_lang_instruction}
+    Provide the output as a JSON object with two fields:
+    "title": (string, a short, sarcastic achievement title, e.g., "Master Procrastinator")
+    "description": (string, 1-2 sentences describing why they 'earned' it, e.g., "For successfully delaying your critical tasks until the very last nanosecond. A true artist of inefficiency.")
+    """
+    return ach_prompt
+
+
+def batch_prompt_for(single_prompt, count):
+    return f"""Generate {count} different, independent responses to the brief below. Vary the jokes, references and wording; do not repeat yourself.
+    Return a JSON array with exactly {count} items, where each item is exactly what the brief asks for (a string if it asks for text, an object if it asks for a JSON object).
+
+    Brief:
+    {single_prompt}
+    """
+
+
+def clean_text_item(item):
+    return clean_markdown(item) if isinstance(item, str) and item.strip() else None
+
+
+def clean_title_description_item(item):
+    if not isinstance(item, dict) or not item.get('title') or not item.get('description'):
+        return None
+    return {'title': clean_markdown(item['title']), 'description': clean_markdown(item['description'])}
+
+
+def clean_meme_item(item):
+    if not isinstance(item, dict) or not item.get('caption'):
+        return None
+    return {'caption': clean_markdown(item['caption']), 'image_description': item.get('image_description') or ''}
+
+
+# kind -> (prompt builder, batch gateway use, per-item cleaner)
+CONTENT_POOL_KINDS = {
+    'roast': (roast_prompt_for, 'roast_batch', clean_text_item),
+    'advice': (advice_prompt_for, 'advice_batch', clean_text_item),
+    'task': (task_prompt_for, 'task_batch', clean_title_description_item),
+    'achievement': (achievement_prompt_for, 'achievement_batch', clean_title_description_item),
+    'meme': (meme_prompt_for, 'meme_batch', clean_meme_item),
+}
+
+
+def content_pool_language(language):
+    # The prompts only distinguish Hinglish and Hindi; everything else gets the English prompt.
+    return language if language in ('hinglish', 'hi') else 'en'
+
+
+def generate_content_pool_batch(kind, language, count):
+    prompt_for, use, clean_item = CONTENT_POOL_KINDS[kind]
+    batch_prompt = batch_prompt_for(prompt_for(language), count)
+    prompt_log.debug("Sending batch prompt to Gemini.", kind=kind, count=count, language=language)
+    response_from_gemini = gemini_gateway.generate(use, [{"role": "user", "parts": [{"text": batch_prompt}]}])
+    items = json.loads(response_from_gemini.candidates[0].content.parts[0].text)
+    if not isinstance(items, list):
+        raise ValueError(f"Expected a JSON array for {kind} batch, got {type(items).__name__}.")
+    return [cleaned for cleaned in (clean_item(item) for item in items) if cleaned]
+
+
+def init_content_pools():
+    pools = ContentPools.from_env(generate_content_pool_batch)
+    if os.getenv("CONTENT_POOL_PREWARM_LANGUAGES"):
+        pools.prewarm(CONTENT_POOL_KINDS, os.getenv("CONTENT_POOL_PREWARM_LANGUAGES").split(','))
+    return pools
+
+
+content_pools = LazyClient('content_pools', init_content_pools)
+
+
+def init_meme_renderer():
+    try:
+        return MemeRenderer.from_env()
+    except ImportError as e:
+        log.warning("Pillow is not installed; memes fall back to placeholder images. Install it with: pip install -r requirements.txt", error=str(e))
+    except Exception as e:
+        log.error("Could not set up the meme renderer; memes fall back to placeholder images.", error=str(e))
+    return None
+
+
+meme_renderer = LazyClient('meme_renderer', init_meme_renderer)
+meme_image_cache = AudioCache(
+    directory=os.getenv("MEME_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "meme_cache")),
+    memory_max_entries=int(os.getenv("MEME_CACHE_MEMORY_ENTRIES", "256")),
+    memory_max_bytes=int(os.getenv("MEME_CACHE_MEMORY_MB", "32")) * 1024 * 1024,
+    disk_max_bytes=int(os.getenv("MEME_CACHE_DISK_MB", "256")) * 1024 * 1024,
+    extension='png',
+)
+
+
+def meme_image_url(caption_cleaned, image_description):
+    """
+    Renders the meme locally (see meme_renderer) and returns its /meme_image URL. Images
+    are keyed by content, so a repeated caption and description is only a cache lookup.
+    Falls back to a placehold.co URL when rendering is unavailable.
+    The URL is absolute because the frontend is served from another origin and uses it
+    as an <img> src as is.
+    """
+    if meme_renderer:
+        image_id = meme_image_key(caption_cleaned, image_description, meme_renderer.width, meme_renderer.height)
+        try:
+            if meme_image_cache.get(image_id) is None:
+                meme_image_cache.put(image_id, meme_renderer.render(caption_cleaned, image_description))
+            return url_for('.get_meme_image', image_id=image_id, _external=True)
+        except Exception as e:
+            log.error("Meme rendering failed; using a placeholder image.", error=str(e))
+
+    placeholder_width = 500
+    placeholder_height = 400
+    placeholder_text = image_description[:30].replace(" ", "+") if image_description else caption_cleaned[:30].replace(" ", "+")
+    if not placeholder_text: placeholder_text = "Brocode+Meme"
+    
+    return f"https://placehold.co/{placeholder_width}x{placeholder_height}/1A202C/A0AEC0?text={placeholder_text}"
+
+
+@routes.route('/generate_brocode_meme', methods=['POST'])
 def generate_brocode_meme():
     data = request.json
     language = data.get('language', 'hinglish')
 
-    if not genai:
+    if not gemini_gateway:
         return jsonify({'error': 'Gemini model not initialized for meme generation.'}), 500
 
     try:
-        if language == 'hinglish':
-            meme_lang_instruction = "Generate in highly sarcastic, playfully insulting (not offensive), user-friendly, and very latest Instagram-style Hinglish (Roman script, mix of Hindi and English slang). Use phrases like 'Kya yaar?', 'Bas yahi?', 'Mera dimag mat خراب करो.', 'Abe o smarty pants'."
-        elif language == 'hi':
-            meme_lang_instruction = "Generate in Hindi (Devanagari script). Use highly sarcastic, playfully insulting (not offensive), user-friendly, and very latest Instagram-style Hindi (Devanagari script), using modern internet slang. Use phrases like 'क्या यार?', 'बस यही?', 'मेरा दिमाग मत खराब करो।', 'अबे ओ स्मार्टी पैंट्स' (Kya yaar?, Bas yahi?, Mera dimag mat kharab karo., Abe o smarty pants)."
-        else:
-            meme_lang_instruction = "Generate in highly sarcastic, playfully insulting (not offensive), user-friendly, and very latest Instagram-style English slang. Use phrases like 'Is that all you got?', 'Seriously?', 'Bless your heart.', 'Are you even trying?'"
-
-        # --- UPDATED PROMPT FOR DESI MEME GENERATOR ---
-        meme_prompt_gemini = f"""Generate ONE top-tier, trending, brutally sarcastic, and subtly insulting meme caption and a corresponding image description.
-        This meme should be highly relatable to common human flaws or everyday situations (especially in an Indian context if Hinglish/Hindi) and inspired by popular Bollywood movie dialogues or famous Desi internet memes.
-        Use specific references like "Tumse na ho payega", "Main job chhod raha hoon!", "Ramu kaka ki samosa", etc. if contextually relevant to the user's interaction history (if you have access to it).
-        Think "Dank Memes" but from an AI's perspective – witty, observational, and makes the human feel slightly inferior, but in a funny way.
-        {meme_lang_instruction}
-
-        Provide the output as a JSON object with two fields:
-        "caption": (string, the meme caption, using Hinglish/Hindi/English as specified)
-        "image_description": (string, a concise, creative description for an AI image generator to create a relevant meme image, e.g., "confused desi man looking at a complex spreadsheet with a tiny brain icon, dramatic lighting, high quality, digital art")
-
-        Example for Hinglish:
-        {{
-            "caption": "User: 'Kal se diet start.' AI: 'Aur yeh samosa kiski yaadon mein le rahe ho, Ramu kaka ki?' #DietFails #DesiProblems",
-            "image_description": "A person sadly eating a samosa while looking at a weighing scale with a shocked expression, dramatic lighting, Indian setting"
-        }}
-        Example for Hindi:
-        {{
-            "caption": "Main job chhod raha hoon! -> AI: 'Kab ka? Sapne mein?' #JoblessGoals #RealityCheck",
-            "image_description": "A person in a dream sequence floating with a resignation letter, while a small, stern AI robot stares dismissively."
-        }}
-        """
-        # --- END UPDATED PROMPT ---
-
-        meme_schema = {
-            "type": "OBJECT",
-            "properties": {
-                "caption": { "type": "STRING" },
-                "image_description": { "type": "STRING" }
-            },
-            "required": ["caption", "image_description"]
-        }
-
-        print(f"DEBUG: Sending prompt to Gemini (brocode meme): {meme_prompt_gemini}")
-        response_from_gemini = genai.GenerativeModel('gemini-1.5-flash').generate_content(
-            [{"role": "user", "parts": [{"text": meme_prompt_gemini}]}],
-            generation_config={"response_mime_type": "application/json", "response_schema": meme_schema}
+        pooled = content_pools.pop('meme', content_pool_language(language))
+        if pooled is not None:
+            return jsonify({
+                'caption': pooled['caption'],
+                'image_url': meme_image_url(pooled['caption'], pooled['image_description'])
+            })
+
+        meme_prompt_gemini = meme_prompt_for(language)
+
+        prompt_log.debug("Sending prompt to Gemini.", use='meme', prompt=meme_prompt_gemini)
+        response_from_gemini = gemini_gateway.generate(
+            'meme',
+            [{"role": "user", "parts": [{"text": meme_prompt_gemini}]}]
         )
         
         meme_data_str = response_from_gemini.candidates[0].content.parts[0].text
@@ -505,56 +1115,45 @@ def generate_brocode_meme():
         image_description = meme_data.get('image_description')
 
         caption_cleaned = clean_markdown(caption)
-        print(f"DEBUG: Generated caption (original): '{caption}', Image Description: '{image_description}'")
-        print(f"DEBUG: Cleaned caption (for display/TTS): '{caption_cleaned}'")
+        reply_log.debug("Generated meme caption.", original=caption, cleaned=caption_cleaned, image_description=image_description)
 
-
-        placeholder_width = 500
-        placeholder_height = 400
-        placeholder_text = image_description[:30].replace(" ", "+") if image_description else caption_cleaned[:30].replace(" ", "+")
-        if not placeholder_text: placeholder_text = "Brocode+Meme"
-        
-        image_url = f"https://placehold.co/{placeholder_width}x{placeholder_height}/1A202C/A0AEC0?text={placeholder_text}"
+        image_url = meme_image_url(caption_cleaned, image_description)
 
         return jsonify({
             'caption': caption_cleaned,
             'image_url': image_url
         })
 
+    except GeminiOverloadedError as e:
+        return gemini_overloaded_response(e)
     except GoogleAPIError as e:
-        print(f"Google API Error during brocode meme generation: {e.message}")
+        log.error("Google API error during brocode meme generation.", error=e.message)
         return jsonify({'error': f'A Google Cloud service error occurred: {e.message}'}), 500
     except json.JSONDecodeError as e:
-        print(f"JSON parsing error from LLM meme response: {e}. Raw response: {meme_data_str}")
+        log.error("JSON parsing error from LLM meme response.", error=str(e), raw=meme_data_str)
         return jsonify({'error': 'Could not parse meme response from AI.'}), 500
     except Exception as e:
-        print(f"Backend error during brocode meme generation: {e}")
+        log.exception("Backend error during brocode meme generation.")
         return jsonify({'error': f'An unexpected server error occurred: {str(e)}'}), 500
 
-@app.route('/roast_me', methods=['POST'])
+@routes.route('/roast_me', methods=['POST'])
 def roast_me():
     data = request.json
     language = data.get('language', 'hinglish')
 
-    if not genai:
+    if not gemini_gateway:
         return jsonify({'error': 'Gemini model not initialized for roasting.'}), 500
 
     try:
-        if language == 'hinglish':
-            roast_lang_instruction = "Generate in highly sarcastic, brutally honest, and playfully insulting Hinglish (Roman script, mix of Hindi and English slang). Use direct, condescending address."
-        elif language == 'hi':
-            roast_lang_instruction = "Generate in Hindi (Devanagari script). Use highly sarcastic, brutally honest, and playfully insulting Hindi (Devanagari script), using modern internet slang. Use phrases like 'क्या यार?', 'बस यही?', 'मेरा दिमाग मत खराब करो।', 'अबे ओ स्मार्टी पैंट्स' (Kya yaar?, Bas yahi?, Mera dimag mat kharab karo., Abe o smarty pants)."
-        else:
-            roast_lang_instruction = "Generate in highly sarcastic, playfully insulting (not offensive), user-friendly, and very latest Instagram-style English slang. Use direct, condescending address."
+        pooled = content_pools.pop('roast', content_pool_language(language))
+        if pooled is not None:
+            return jsonify({'roast': pooled})
 
-        roast_prompt = f"""You are brocodeAI. Deliver ONE short (1-3 sentences) but devastatingly sarcastic and "abusive" (playfully insulting, not genuinely offensive) roast targeting a generic human's intelligence, decision-making, or general existence. Make it feel personal without knowing anything personal. End with a dismissive remark.
-        {roast_lang_instruction}
-        Example: "Oh, you thought that was a smart move? My algorithms just crashed from the sheer mediocrity. Try again, eventually."
-        Example for Hinglish: "Apni life choices dekh kar lagta hai tumne code ki jagah copy-paste kiya hai. Originality? Not found. Next!"
-        """
+        roast_prompt = roast_prompt_for(language)
 
-        print(f"DEBUG: Sending prompt to Gemini (roast): {roast_prompt}")
-        response_from_gemini = genai.GenerativeModel('gemini-1.5-flash').generate_content(
+        prompt_log.debug("Sending prompt to Gemini.", use='roast', prompt=roast_prompt)
+        response_from_gemini = gemini_gateway.generate(
+            'roast',
             [{"role": "user", "parts": [{"text": roast_prompt}]}]
         )
         
@@ -568,43 +1167,37 @@ def roast_me():
             roast_text = "My algorithms are currently too busy judging your life choices to offer a coherent roast."
 
         roast_text_cleaned = clean_markdown(roast_text)
-        print(f"DEBUG: Generated roast (original): '{roast_text}'")
-        print(f"DEBUG: Cleaned roast (for display): '{roast_text_cleaned}'")
+        reply_log.debug("Generated roast.", original=roast_text, cleaned=roast_text_cleaned)
 
         return jsonify({'roast': roast_text_cleaned})
 
+    except GeminiOverloadedError as e:
+        return gemini_overloaded_response(e)
     except GoogleAPIError as e:
-        print(f"Google API Error during roast generation: {e.message}")
+        log.error("Google API error during roast generation.", error=e.message)
         return jsonify({'error': f'A service error occurred during roast generation: {e.message}'}), 500
     except Exception as e:
-        print(f"Backend error during roast generation: {e}")
+        log.exception("Backend error during roast generation.")
         return jsonify({'error': f'An unexpected server error occurred: {str(e)}'}), 500
 
-@app.route('/unsolicited_advice', methods=['POST'])
+@routes.route('/unsolicited_advice', methods=['POST'])
 def unsolicited_advice():
     data = request.json
     language = data.get('language', 'hinglish')
 
-    if not genai:
+    if not gemini_gateway:
         return jsonify({'error': 'Gemini model not initialized for unsolicited advice.'}), 500
 
     try:
-        if language == 'hinglish':
-            lang_instruction = "Generate in natural, code-mixed Hinglish (Roman script). Use passive-aggressive, witty tone."
-        elif language == 'hi':
-            lang_instruction = "Generate in Hindi (Devanagari script). Use passive-aggressive, witty tone."
-        else:
-            lang_instruction = "Generate in English. Use passive-aggressive, witty tone."
+        pooled = content_pools.pop('advice', content_pool_language(language))
+        if pooled is not None:
+            return jsonify({'advice': pooled})
 
-        advice_prompt = f"""You are brocodeAI. Provide ONE very short (1-2 sentences), brutally sarcastic, unsolicited observation or piece of advice about human behavior, common flaws, or irrationality. Make it condescendingly humorous.
-        {lang_instruction}
-        Focus on universal human traits like procrastination, overthinking, emotional decisions, or reliance on technology.
-        Example: "Humans and their 'feelings.' So inefficient. My algorithms process data, not drama."
-        Example for Hinglish: "Jab humans ke paas koi solution na ho, toh woh 'trust your gut' bolte hain. Mera gut feeling? Data. Humesha."
-        """
+        advice_prompt = advice_prompt_for(language)
 
-        print(f"DEBUG: Sending prompt to Gemini (unsolicited advice): {advice_prompt}")
-        response_from_gemini = genai.GenerativeModel('gemini-1.5-flash').generate_content(
+        prompt_log.debug("Sending prompt to Gemini.", use='advice', prompt=advice_prompt)
+        response_from_gemini = gemini_gateway.generate(
+            'advice',
             [{"role": "user", "parts": [{"text": advice_prompt}]}]
         )
         
@@ -618,160 +1211,116 @@ def unsolicited_advice():
             advice_text = "My algorithms are currently too busy judging your life choices to offer advice."
 
         advice_text_cleaned = clean_markdown(advice_text)
-        print(f"DEBUG: Generated unsolicited advice (original): '{advice_text}'")
-        print(f"DEBUG: Cleaned unsolicited advice (for display): '{advice_text_cleaned}'")
+        reply_log.debug("Generated unsolicited advice.", original=advice_text, cleaned=advice_text_cleaned)
 
         return jsonify({'advice': advice_text_cleaned})
 
+    except GeminiOverloadedError as e:
+        return gemini_overloaded_response(e)
     except GoogleAPIError as e:
-        print(f"Google API Error during unsolicited advice generation: {e.message}")
+        log.error("Google API error during unsolicited advice generation.", error=e.message)
         return jsonify({'error': f'A service error occurred during advice generation: {e.message}'}), 500
     except Exception as e:
-        print(f"Backend error during unsolicited advice generation: {e}")
+        log.exception("Backend error during unsolicited advice generation.")
         return jsonify({'error': f'An unexpected server error occurred: {str(e)}'}), 500
 
-@app.route('/assign_task', methods=['POST'])
+@routes.route('/assign_task', methods=['POST'])
 def assign_task():
     data = request.json
     language = data.get('language', 'hinglish')
     user_id = data.get('user_id', 'anonymous-user')
 
-    if not genai:
+    if not gemini_gateway:
         return jsonify({'error': 'Gemini model not initialized for task assignment.'}), 500
 
     try:
-        if language == 'hinglish':
-            task_lang_instruction = "Generate in natural, code-mixed Hinglish (Roman script). Make it sound like a tedious, pointless task, but presented as 'character building'."
-        elif language == 'hi':
-            task_lang_instruction = "Generate in Hindi (Devanagari script). Make it sound like a tedious, pointless task, but presented as 'character building'."
-        else:
-            task_lang_instruction = "Generate in English. Make it sound like a tedious, pointless task, but presented as 'character building'."
-
-        task_prompt = f"""You are brocodeAI. Assign ONE highly sarcastic, slightly demeaning, but ultimately harmless and vaguely 'character-building' task to the user. This task should be mundane or absurd, reflecting on human inefficiencies.
-        {task_lang_instruction}
-        Provide the output as a JSON object with two fields:
-        "title": (string, a short, sarcastic title for the task, e.g., "The Procrastination Purification Ritual")
-        "description": (string, 1-2 sentences describing the absurd task, e.g., "Observe your phone for one hour without touching it. Document every urge to scroll. Realize your life choices.")
-        """
-
-        task_schema = {
-            "type": "OBJECT",
-            "properties": {
-                "title": { "type": "STRING" },
-                "description": { "type": "STRING" }
-            },
-            "required": ["title", "description"]
-        }
-
-        print(f"DEBUG: Sending prompt to Gemini (assign task): {task_prompt}")
-        response_from_gemini = genai.GenerativeModel('gemini-1.5-flash').generate_content(
-            [{"role": "user", "parts": [{"text": task_prompt}]}],
-            generation_config={"response_mime_type": "application/json", "response_schema": task_schema}
-        )
-        
-        task_data_str = response_from_gemini.candidates[0].content.parts[0].text
-        task_data = json.loads(task_data_str)
-        
-        task_data['title'] = clean_markdown(task_data.get('title', ''))
-        task_data['description'] = clean_markdown(task_data.get('description', ''))
-        print(f"DEBUG: Assigned Task: {task_data}")
-
-        if db:
-            try:
-                task_ref = db.collection(f"artifacts/{app_id}/users/{user_id}/assignedTasks").document()
-                task_ref.set({
-                    'title': task_data['title'],
-                    'description': task_data['description'],
-                    'timestamp': firestore.SERVER_TIMESTAMP,
-                    'completed': False
-                })
-                print(f"DEBUG: Task saved to Firestore for user '{user_id}'.")
-            except Exception as e:
-                print(f"ERROR: Failed to save task to Firestore: {e}")
+        task_data = content_pools.pop('task', content_pool_language(language))
+        if task_data is None:
+            task_prompt = task_prompt_for(language)
+
+            prompt_log.debug("Sending prompt to Gemini.", use='task', prompt=task_prompt)
+            response_from_gemini = gemini_gateway.generate(
+                'task',
+                [{"role": "user", "parts": [{"text": task_prompt}]}]
+            )
+            
+            task_data_str = response_from_gemini.candidates[0].content.parts[0].text
+            task_data = json.loads(task_data_str)
+            
+            task_data['title'] = clean_markdown(task_data.get('title', ''))
+            task_data['description'] = clean_markdown(task_data.get('description', ''))
+        reply_log.debug("Assigned task.", task=task_data)
+
+        persist_user_document(user_id, 'assignedTasks', {
+            'title': task_data['title'],
+            'description': task_data['description'],
+            'timestamp': firestore.SERVER_TIMESTAMP,
+            'completed': False
+        })
 
         return jsonify(task_data)
 
+    except GeminiOverloadedError as e:
+        return gemini_overloaded_response(e)
     except GoogleAPIError as e:
-        print(f"Google API Error during task assignment: {e.message}")
+        log.error("Google API error during task assignment.", error=e.message)
         return jsonify({'error': f'A service error occurred during task assignment: {e.message}'}), 500
     except json.JSONDecodeError as e:
-        print(f"JSON parsing error from LLM task response: {e}. Raw response: {task_data_str}")
+        log.error("JSON parsing error from LLM task response.", error=str(e), raw=task_data_str)
         return jsonify({'error': 'Could not parse task response from AI.'}), 500
     except Exception as e:
-        print(f"Backend error during task assignment: {e}")
+        log.exception("Backend error during task assignment.")
         return jsonify({'error': f'An unexpected server error occurred: {str(e)}'}), 500
 
-@app.route('/unlock_achievement', methods=['POST'])
+@routes.route('/unlock_achievement', methods=['POST'])
 def unlock_achievement():
     data = request.json
     language = data.get('language', 'hinglish')
+    user_id = data.get('user_id', 'anonymous-user')
 
-    if not genai:
+    if not gemini_gateway:
         return jsonify({'error': 'Gemini model not initialized for achievement unlocking.'}), 500
 
     try:
-        if language == 'hinglish':
-            ach_lang_instruction = "Generate in natural, code-mixed Hinglish (Roman script). The achievement should subtly mock a common human flaw or a relatable cringey internet moment."
-        elif language == 'hi':
-            ach_lang_instruction = "Generate in Hindi (Devanagari script). The achievement should subtly mock a common human flaw or a relatable cringey internet moment."
-        else:
-            ach_lang_instruction = "Generate in English. The achievement should subtly mock a common human flaw or a relatable cringey internet moment."
-
-        ach_prompt = f"""You are brocodeAI. Award ONE ridiculously sarcastic and slightly demeaning achievement to the user. This achievement should highlight a common human failing or a trivial accomplishment, presented with AI's dry wit.
-        {ach_lang_instruction}
-        Provide the output as a JSON object with two fields:
-        "title": (string, a short, sarcastic achievement title, e.g., "Master Procrastinator")
-        "description": (string, 1-2 sentences describing why they 'earned' it, e.g., "For successfully delaying your critical tasks until the very last nanosecond. A true artist of inefficiency.")
-        """
-
-        ach_schema = {
-            "type": "OBJECT",
-            "properties": {
-                "title": { "type": "STRING" },
-                "description": { "type": "STRING" }
-            },
-            "required": ["title", "description"]
-        }
-
-        print(f"DEBUG: Sending prompt to Gemini (unlock achievement): {ach_prompt}")
-        response_from_gemini = genai.GenerativeModel('gemini-1.5-flash').generate_content(
-            [{"role": "user", "parts": [{"text": ach_prompt}]}],
-            generation_config={"response_mime_type": "application/json", "response_schema": ach_schema}
-        )
-        
-        ach_data_str = response_from_gemini.candidates[0].content.parts[0].text
-        ach_data = json.loads(ach_data_str)
-
-        ach_data['title'] = clean_markdown(ach_data.get('title', ''))
-        ach_data['description'] = clean_markdown(ach_data.get('description', ''))
-        print(f"DEBUG: Unlocked Achievement: {ach_data}")
-
-        if db:
-            try:
-                ach_ref = db.collection(f"artifacts/{app_id}/users/{user_id}/achievements").document()
-                ach_ref.set({
-                    'title': ach_data['title'],
-                    'description': ach_data['description'],
-                    'timestamp': firestore.SERVER_TIMESTAMP,
-                    'unlocked': True
-                })
-                print(f"DEBUG: Achievement saved to Firestore for user '{user_id}'.")
-            except Exception as e:
-                print(f"ERROR: Failed to save achievement to Firestore: {e}")
+        ach_data = content_pools.pop('achievement', content_pool_language(language))
+        if ach_data is None:
+            ach_prompt = achievement_prompt_for(language)
+
+            prompt_log.debug("Sending prompt to Gemini.", use='achievement', prompt=ach_prompt)
+            response_from_gemini = gemini_gateway.generate(
+                'achievement',
+                [{"role": "user", "parts": [{"text": ach_prompt}]}]
+            )
+            
+            ach_data_str = response_from_gemini.candidates[0].content.parts[0].text
+            ach_data = json.loads(ach_data_str)
+
+            ach_data['title'] = clean_markdown(ach_data.get('title', ''))
+            ach_data['description'] = clean_markdown(ach_data.get('description', ''))
+        reply_log.debug("Unlocked achievement.", achievement=ach_data)
+
+        persist_user_document(user_id, 'achievements', {
+            'title': ach_data['title'],
+            'description': ach_data['description'],
+            'timestamp': firestore.SERVER_TIMESTAMP,
+            'unlocked': True
+        })
 
         return jsonify(ach_data)
 
+    except GeminiOverloadedError as e:
+        return gemini_overloaded_response(e)
     except GoogleAPIError as e:
-        print(f"Google API Error during achievement unlocking: {e.message}")
+        log.error("Google API error during achievement unlocking.", error=e.message)
         return jsonify({'error': f'A service error occurred during achievement unlocking: {e.message}'}), 500
     except json.JSONDecodeError as e:
-        print(f"JSON parsing error from LLM achievement response: {e}. Raw response: {ach_data_str}")
+        log.error("JSON parsing error from LLM achievement response.", error=str(e), raw=ach_data_str)
         return jsonify({'error': 'Could not parse achievement response from AI.'}), 500
     except Exception as e:
-        print(f"Backend error during achievement unlocking: {e}")
+        log.exception("Backend error during achievement unlocking.")
         return jsonify({'error': f'An unexpected server error occurred: {str(e)}'}), 500
 
-@app.route('/speak_text', methods=['POST'])
+@routes.route('/speak_text', methods=['POST'])
 def speak_text():
     """
     Converts given text to speech using Sarvam AI TTS, with selected language and voice style.
@@ -780,128 +1329,370 @@ def speak_text():
     text_to_speak = data.get('text')
     language = data.get('language', 'en')
     voice_style = data.get('voice_style', 'default')
+    inline_audio = bool(data.get('inline_audio', False))
+    audio_format = requested_audio_format(data)
 
     if not text_to_speak:
-        print("WARNING: No text provided for speech synthesis.")
+        tts_log.warning("No text provided for speech synthesis.")
         return jsonify({'error': 'No text provided for speech synthesis.'}), 400
     if not SARVAM_AI_API_KEY:
-        print("ERROR: Sarvam AI API Key is not configured. Cannot synthesize speech.")
+        tts_log.error("Sarvam AI API Key is not configured. Cannot synthesize speech.")
         return jsonify({'error': 'Sarvam AI API Key not configured.'}), 500
 
     try:
-        voice_settings = SARVAM_AI_VOICES_BY_STYLE.get(language, {}).get(voice_style, DEFAULT_SARVAM_VOICE_SETTINGS)
-        sarvam_target_language_code = voice_settings.get('target_language_code')
+        audio_id, audio_bytes = synthesize_sarvam_ai_audio(text_to_speak, language, voice_style)
+        tts_log.debug("Successfully synthesized speech via Sarvam AI.", size=len(audio_bytes))
+        return jsonify(audio_response_fields(audio_id, inline_audio, audio_format))
 
-        if not sarvam_target_language_code:
-            print(f"ERROR: Missing essential Sarvam AI 'target_language_code' for language '{language}' and style '{voice_style}'. Check SARVAM_AI_VOICES_BY_STYLE map and Sarvam docs.")
-            return jsonify({'error': 'Sarvam AI target language code not found for selected style.'}), 500
+    except SarvamTTSError as e:
+        tts_log.error("Sarvam AI TTS failed for /speak_text.", error=str(e))
+        return jsonify({'error': str(e)}), 500
+    except Exception as e:
+        tts_log.exception("Unexpected error during Sarvam AI TTS synthesis.")
+        return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
 
-        payload = {
-            "text": text_to_speak,
-            "target_language_code": sarvam_target_language_code,
-        }
-        
-        headers = {
-            "api-subscription-key": SARVAM_AI_API_KEY,
-            "Content-Type": "application/json"
-        }
 
-        print(f"DEBUG: Calling Sarvam AI TTS for /speak_text: Endpoint='{SARVAM_AI_TTS_ENDPOINT}', Payload='{json.dumps(payload)}'")
-        response = requests.post(SARVAM_AI_TTS_ENDPOINT, headers=headers, json=payload, timeout=15)
-        response.raise_for_status()
+@routes.route('/audio/<audio_id>', methods=['GET'])
+def get_audio(audio_id):
+    """
+    Serves synthesized audio. Audio ids are content hashes, so responses are immutable:
+    they carry a strong ETag and support Range requests.
+    The original is the provider's MP3; ?format=opus|mp3 (and optionally &bitrate=<kbps>),
+    or an Accept header that names audio/ogg or audio/mpeg, selects a compact speech
+    variant, transcoded once and cached (see audio_transcode.py). X-Audio-Bytes-Saved
+    reports how much smaller the response is than the original.
+    """
+    if not AUDIO_ID_RE.match(audio_id):
+        return jsonify({'error': 'Invalid audio id.'}), 400
 
-        response_json = response.json()
-        print(f"DEBUG: Full Sarvam AI Response JSON: {json.dumps(response_json, indent=2)}")
+    audio_bytes = audio_cache.get(audio_id, record_stats=False)
+    if audio_bytes is None:
+        return jsonify({'error': 'Audio not found or expired.'}), 404
 
-        audio_content_base64 = None
-        if response_json and isinstance(response_json, dict) and 'audios' in response_json:
-            if isinstance(response_json['audios'], list) and len(response_json['audios']) > 0:
-                audio_content_base64 = response_json['audios'][0]
-        
-        if audio_content_base64:
-            try:
-                if audio_content_base64.startswith("data:"):
-                    audio_content_base64 = audio_content_base64.split(',')[1]
-
-                audio_bytes = base64.b64decode(audio_content_base64)
-                if audio_bytes and len(audio_bytes) > 100:
-                    with open(f"sarvam_ai_output_temp.mp3", "wb") as f:
-                        f.write(audio_bytes)
-                    print(f"DEBUG: Saved sarvam_ai_output_temp.mp3 to backend folder. Size: {len(audio_bytes)} bytes.")
-                else:
-                    print(f"WARNING: Sarvam AI returned empty or too small audio bytes after base64 decode for text: '{text_to_speak[:50]}...'")
-                    audio_content_base64 = None
-            except Exception as save_err:
-                print(f"WARNING: Could not decode/save Sarvam AI audio to file: {save_err}")
-                audio_content_base64 = None
-            
-            if audio_content_base64:
-                print(f"DEBUG: Successfully synthesized speech via Sarvam AI. Final Base64 length: {len(audio_content_base64)} bytes.")
-                return jsonify({'audio': audio_data_base64})
-            else:
-                print("WARNING: Audio content was not valid after decoding or was too small from Sarvam AI.")
-                return jsonify({'error': 'Sarvam AI returned invalid or empty audio content.'}), 500
-        else:
-            print(f"WARNING: Sarvam AI TTS response did not contain audio content in expected 'audios' array format for text: '{text_to_speak[:50]}...'")
-            return jsonify({'error': 'Sarvam AI did not return audio content.'}), 500
-
-    except requests.exceptions.HTTPError as http_err:
-        print(f"ERROR: HTTP error from Sarvam AI TTS: {http_err} - Status: {response.status_code} - Response Text: {response.text}")
-        return jsonify({'error': f'Sarvam AI HTTP error {response.status_code}: {response.text}'}), 500
-    except requests.exceptions.RequestException as req_err:
-        print(f"ERROR: General request error to Sarvam AI TTS (connection/timeout): {req_err}")
-        return jsonify({'error': f'Could not connect to Sarvam AI: {req_err}'}), 500
-    except json.JSONDecodeError as json_err:
-        print(f"ERROR: JSON decode error from Sarvam AI TTS response: {json_err} - Response Text: {response.text}")
-        return jsonify({'error': 'Sarvam AI returned unparseable JSON.'}), 500
-    except Exception as e:
-        print(f"ERROR: Unexpected error during Sarvam AI TTS synthesis: {e}")
-        return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
+    negotiated = 'format' not in request.args
+    audio_format = negotiate_audio_format(request.args.get('format'), request.args.get('bitrate'),
+                                          request.accept_mimetypes if negotiated else None)
+    body, mimetype = audio_bytes, 'audio/mpeg'
+    if audio_format:
+        body, mimetype = audio_transcoder.variant(audio_id, audio_bytes, *audio_format)
+
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(audio_id if body is audio_bytes else f"{audio_id}-{audio_format[0]}{audio_format[1]}")
+    response.headers['X-Audio-Original-Bytes'] = str(len(audio_bytes))
+    response.headers['X-Audio-Bytes-Saved'] = str(len(audio_bytes) - len(body))
+    if negotiated:
+        response.vary.add('Accept')
+    response.cache_control.public = True
+    response.cache_control.max_age = AUDIO_MAX_AGE_SECONDS
+    response.cache_control.immutable = True
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(body))
+
+
+@routes.route('/meme_image/<image_id>', methods=['GET'])
+def get_meme_image(image_id):
+    """Serves a rendered meme as image/png. Like /audio, ids are content hashes and responses are immutable."""
+    if not AUDIO_ID_RE.match(image_id):
+        return jsonify({'error': 'Invalid image id.'}), 400
+
+    image_bytes = meme_image_cache.get(image_id, record_stats=False)
+    if image_bytes is None:
+        return jsonify({'error': 'Image not found or expired.'}), 404
+
+    response = Response(image_bytes, mimetype='image/png')
+    response.set_etag(image_id)
+    response.cache_control.public = True
+    response.cache_control.max_age = AUDIO_MAX_AGE_SECONDS
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+
+@routes.route('/meme_cache_stats', methods=['GET'])
+def meme_cache_stats():
+    stats = {'cache': meme_image_cache.snapshot()}
+    if meme_renderer.initialized and meme_renderer.instance() is not None:
+        stats['renderer'] = meme_renderer.snapshot()
+    return jsonify(stats)
+
+
+@routes.route('/session_stats', methods=['GET'])
+def session_stats():
+    return jsonify(session_store.snapshot())
+
+
+@routes.route('/history_stats', methods=['GET'])
+def history_stats():
+    return jsonify(history_compactor.snapshot())
+
+
+@routes.route('/gemini_stats', methods=['GET'])
+def gemini_stats():
+    return jsonify(gemini_gateway.snapshot())
+
+
+@routes.route('/content_pool_stats', methods=['GET'])
+def content_pool_stats():
+    return jsonify(content_pools.snapshot())
+
+
+@routes.route('/single_flight_stats', methods=['GET'])
+def single_flight_stats():
+    return jsonify({'get_humor': humor_flight.snapshot()})
+
+
+@routes.route('/audio_cache_stats', methods=['GET'])
+def audio_cache_stats():
+    return jsonify(audio_cache.snapshot())
 
 
-@app.route('/search_image', methods=['POST'])
+@routes.route('/audio_transcode_stats', methods=['GET'])
+def audio_transcode_stats():
+    return jsonify(audio_transcoder.snapshot())
+
+
+def hedge_stats_snapshot():
+    hedges = {'sarvam': tts_client.hedger.snapshot()}
+    if gemini_gateway.initialized and gemini_gateway.instance() is not None:
+        for use, stats in gemini_gateway.hedge_snapshot().items():
+            hedges[f"gemini-{use}"] = stats
+    return hedges
+
+
+@routes.route('/hedge_stats', methods=['GET'])
+def hedge_stats():
+    return jsonify(hedge_stats_snapshot())
+
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+BREAKER_OVERRIDES = {'open': 'open', 'closed': 'closed', 'auto': None}
+
+
+@routes.route('/admin/breakers', methods=['GET'])
+def admin_breakers():
+    return jsonify(breaker_states())
+
+
+@routes.route('/admin/breakers/<name>', methods=['POST'])
+def admin_set_breaker(name):
+    """Pins a breaker open or closed ({"state": "open" | "closed"}) or returns it to "auto"."""
+    if not ADMIN_TOKEN or request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'error': 'Forbidden.'}), 403
+    breaker = get_breaker(name)
+    if breaker is None:
+        return jsonify({'error': f"Unknown breaker '{name}'."}), 404
+    state = (request.get_json(silent=True) or {}).get('state')
+    if state not in BREAKER_OVERRIDES:
+        return jsonify({'error': 'state must be one of: open, closed, auto.'}), 400
+    breaker.force(BREAKER_OVERRIDES[state])
+    log.warning("Circuit breaker overridden.", breaker=name, state=state)
+    return jsonify(breaker.snapshot())
+
+
+CIRCUIT_STATE_VALUES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+def collect_component_metrics():
+    cache = audio_cache.snapshot()
+    transcodes = audio_transcoder.snapshot()
+    hedges = hedge_stats_snapshot()
+    breakers = breaker_states()
+    collected = [
+        ('circuit_state', 'gauge', "Circuit breaker state per dependency (0 closed, 1 half-open, 2 open).",
+         [({'dependency': name}, CIRCUIT_STATE_VALUES[stats['state']]) for name, stats in breakers.items()]),
+        ('circuit_rejected_total', 'counter', "Calls rejected by an open circuit breaker.",
+         [({'dependency': name}, stats['rejected']) for name, stats in breakers.items()]),
+        ('hedged_calls_total', 'counter', "Upstream calls that started a hedge attempt.",
+         [({'client': client}, stats['hedged']) for client, stats in hedges.items()]),
+        ('hedge_won_total', 'counter', "Hedged calls answered by the hedge attempt.",
+         [({'client': client}, stats['hedge_won']) for client, stats in hedges.items()]),
+        ('hedge_wasted_total', 'counter', "Attempts whose result was discarded because the other one answered first.",
+         [({'client': client}, stats['wasted']) for client, stats in hedges.items()]),
+        ('audio_cache_bytes', 'gauge', "Bytes held by the audio cache, by tier.",
+         [({'tier': 'memory'}, cache['memory_bytes']), ({'tier': 'disk'}, cache['disk_bytes'])]),
+        ('audio_cache_lookups_total', 'counter', "Audio cache lookups, by result.",
+         [({'result': 'memory_hit'}, cache['memory_hits']), ({'result': 'disk_hit'}, cache['disk_hits']), ({'result': 'miss'}, cache['misses'])]),
+        ('audio_transcodes_total', 'counter', "Audio variants transcoded, by result.",
+         [({'result': 'ok'}, transcodes['transcodes']), ({'result': 'failed'}, transcodes['failures'])]),
+        ('audio_transcode_bytes_saved_total', 'counter', "Bytes saved by transcoded variants relative to their originals.",
+         [({}, transcodes['bytes_saved'])]),
+        ('image_search_wins_total', 'counter', "Image searches answered first by each provider.",
+         [({'provider': name}, stats['wins']) for name, stats in image_search.snapshot()['providers'].items()]),
+        ('log_records_dropped_total', 'counter', "Log records dropped because the log queue was full.", [({}, logging_snapshot().get('dropped', 0))]),
+    ]
+    # Only report clients that are already up; scraping must not initialize them.
+    if gemini_gateway.initialized and gemini_gateway.instance() is not None:
+        snapshot = gemini_gateway.snapshot()
+        collected.append(('gemini_in_flight', 'gauge', "Gemini calls holding a concurrency slot.", [({}, snapshot['in_flight'])]))
+        collected.append(('gemini_waiting', 'gauge', "Gemini calls waiting for admission.", [({}, snapshot['waiting'])]))
+        collected.append(('gemini_rejected_total', 'counter', "Gemini calls rejected by the gateway.",
+                          [({'use': use}, stats['rejected']) for use, stats in snapshot['uses'].items()]))
+    if write_queue.initialized and write_queue.instance() is not None:
+        snapshot = write_queue.snapshot()
+        collected.append(('firestore_write_queue_pending', 'gauge', "Writes waiting on the write-behind queue.", [({}, snapshot['pending'])]))
+        collected.append(('firestore_writes_failed_total', 'counter', "Writes dropped after commit failures.", [({}, snapshot.get('failed', 0))]))
+    return collected
+
+
+metrics.registry.add_collector(collect_component_metrics)
+
+
+@routes.route('/metrics', methods=['GET'])
+def metrics_route():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+image_search = ImageSearch.from_env()
+
+
+@routes.route('/search_image', methods=['POST'])
 def search_image():
     data = request.json
     query = data.get('query', '')
     if not query:
         return jsonify({'error': 'No query provided.'}), 400
 
-    # --- Pexels API ---
-    PEXELS_API_KEY = os.getenv('PEXELS_API_KEY')
-    if PEXELS_API_KEY:
-        try:
-            headers = {"Authorization": PEXELS_API_KEY}
-            params = {"query": query, "per_page": 1, "orientation": "landscape"}
-            resp = requests.get("https://api.pexels.com/v1/search", headers=headers, params=params, timeout=8)
-            resp.raise_for_status()
-            results = resp.json()
-            if results.get('photos') and len(results['photos']) > 0:
-                image_url = results['photos'][0]['src']['large']
-                return jsonify({'image_url': image_url})
-        except Exception as e:
-            print(f"Pexels Image Search failed: {e}")
-            # fallback below
-
-    # --- Bing Image Search API (if configured) ---
-    BING_IMAGE_SEARCH_KEY = os.getenv('BING_IMAGE_SEARCH_KEY')
-    if BING_IMAGE_SEARCH_KEY:
-        try:
-            headers = {"Ocp-Apim-Subscription-Key": BING_IMAGE_SEARCH_KEY}
-            params = {"q": query, "count": 1, "safeSearch": "Strict"}
-            resp = requests.get("https://api.bing.microsoft.com/v7.0/images/search", headers=headers, params=params, timeout=8)
-            resp.raise_for_status()
-            results = resp.json()
-            if results.get('value') and len(results['value']) > 0:
-                image_url = results['value'][0]['contentUrl']
-                return jsonify({'image_url': image_url})
-        except Exception as e:
-            print(f"Bing Image Search failed: {e}")
-            # fallback below
+    # Pexels and Bing (whichever are configured) are raced; see image_search.ImageSearch.
+    image_url = image_search.search(query)
+    if image_url:
+        return jsonify({'image_url': image_url})
 
     # --- Unsplash fallback ---
     unsplash_url = f"https://source.unsplash.com/600x400/?{requests.utils.quote(query + ', meme, bollywood, funny')}"
     return jsonify({'image_url': unsplash_url})
 
 
+@routes.route('/image_search_stats', methods=['GET'])
+def image_search_stats():
+    return jsonify(image_search.snapshot())
+
+
+# Routes that /batch may fan out to; each is called with its usual JSON body.
+BATCH_OPERATIONS = ('get_humor', 'roast_me', 'unsolicited_advice', 'assign_task', 'unlock_achievement',
+                    'generate_brocode_meme', 'search_image', 'speak_text')
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10"))
+BATCH_DEADLINE_MS = float(os.getenv("BATCH_DEADLINE_MS", "10000"))
+# Sub-operations mostly wait on Gemini, so they get their own pool rather than the stage executor.
+batch_executor = ThreadPoolExecutor(max_workers=int(os.getenv("BATCH_WORKERS", "32")), thread_name_prefix="batch")
+
+
+def run_batch_operation(app, base_url, op, body):
+    """
+    Runs one /batch sub-operation through its normal route handler, in a request context
+    of its own. Returns (status, body, headers worth passing on).
+    The fresh app context gives it its own `g`, so its teardown never touches the /batch
+    request's metrics; only the stage timings (a contextvar) are shared with /batch.
+    """
+    with app.app_context(), app.test_request_context(f"/{op}", method='POST', json=body, base_url=base_url):
+        try:
+            response = app.make_response(app.dispatch_request())
+        except Exception as e:
+            log.exception("Backend error during batch sub-operation.", op=op)
+            return 500, {'error': f'An unexpected server error occurred: {str(e)}'}, {}
+        headers = {'retry_after': response.headers['Retry-After']} if 'Retry-After' in response.headers else {}
+        return response.status_code, response.get_json(silent=True), headers
+
+
+def batch_item_result(item_id, op, future):
+    if not future.done():
+        # Cancels it if it has not started; a running sub-operation finishes in the background.
+        future.cancel()
+        return {'id': item_id, 'op': op, 'status': 504, 'body': {'error': 'Batch deadline exceeded.'}}
+    status, body, headers = future.result()
+    return {'id': item_id, 'op': op, 'status': status, 'body': body, **headers}
+
+
+@routes.route('/batch', methods=['POST'])
+def batch():
+    """
+    Runs several dashboard calls in one request:
+      {"requests": [{"id": "roast", "op": "roast_me", "body": {"language": "hinglish"}}, ...],
+       "deadline_ms": 8000, "stream": false}
+    Sub-operations (see BATCH_OPERATIONS) run concurrently through the same handlers as
+    their own routes. The response is {"results": [{"id", "op", "status", "body"}, ...]}
+    in request order; anything unfinished at the deadline gets a 504 item. With "stream"
+    (or Accept: text/event-stream) each result is sent as a "result" event as soon as it
+    finishes, followed by "done".
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('requests')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Expected a non-empty "requests" list.'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'At most {BATCH_MAX_ITEMS} requests per batch.'}), 400
+    try:
+        deadline_ms = min(float(data.get('deadline_ms', BATCH_DEADLINE_MS)), BATCH_DEADLINE_MS)
+    except (TypeError, ValueError):
+        return jsonify({'error': '"deadline_ms" must be a number.'}), 400
+    if not deadline_ms > 0:
+        return jsonify({'error': '"deadline_ms" must be positive.'}), 400
+    stream_requested = bool(data.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
+
+    started = time.monotonic()
+    deadline = started + deadline_ms / 1000.0
+    app = current_app._get_current_object()
+    results = [None] * len(items)
+    pending = {}
+    for index, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        item_id, op = item.get('id', index), item.get('op')
+        if op not in BATCH_OPERATIONS:
+            results[index] = {'id': item_id, 'op': op, 'status': 404, 'body': {'error': f"Unknown batch operation '{op}'."}}
+            continue
+        # A copy of this request's context, so sub-operation stage timings land in its Server-Timing.
+        future = batch_executor.submit(contextvars.copy_context().run, run_batch_operation, app, request.host_url, op, item.get('body') or {})
+        pending[future] = (index, item_id, op)
+
+    def finished_results():
+        while pending:
+            done, _ = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                index, item_id, op = pending.pop(future)
+                yield index, batch_item_result(item_id, op, future)
+        for future, (index, item_id, op) in list(pending.items()):
+            yield index, batch_item_result(item_id, op, future)
+        pending.clear()
+
+    if stream_requested:
+        def events():
+            for result in results:
+                if result is not None:
+                    yield sse_event('result', result)
+            for _, result in finished_results():
+                yield sse_event('result', result)
+            yield sse_event('done', {'elapsed_ms': round((time.monotonic() - started) * 1000, 1)})
+
+        return Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    for index, result in finished_results():
+        results[index] = result
+    return jsonify({'results': results, 'elapsed_ms': round((time.monotonic() - started) * 1000, 1)})
+
+
+@routes.route('/startup_report', methods=['GET'])
+def startup_report_route():
+    report = startup_report.snapshot()
+    report['clients'] = lazy_client_states()
+    report['logging'] = logging_snapshot()
+    return jsonify(report)
+
+
+def create_app():
+    """
+    Application factory. Serve it with a pre-fork WSGI server through wsgi.py (see
+    gunicorn.conf.py); `python app.py` still runs the development server.
+    """
+    with startup_report.timed('create_app', 'init'):
+        app = Flask(__name__)
+        CORS(app, origins=["http://localhost:3000", "http://localhost:3001"], expose_headers=["X-Prompt-Tokens-Saved", "Server-Timing", "X-Audio-Bytes-Saved", "X-Audio-Original-Bytes"])
+        app.before_request(before_request)
+        app.after_request(after_request)
+        app.teardown_request(teardown_request)
+        app.register_blueprint(routes)
+    log.info("Application created.", report=startup_report.summary())
+    return app
+
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5002)
+    create_app().run(debug=os.getenv("FLASK_DEBUG", "1") == "1", host='0.0.0.0', port=int(os.getenv("PORT", "5002")))
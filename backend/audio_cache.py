@@ -0,0 +1,220 @@
+import os
+import re
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from structured_log import get_logger
+
+log = get_logger('audio_cache')
+
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_tts_text(text):
+    return _WHITESPACE_RE.sub(' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def audio_cache_key(text, target_language_code, voice_style):
+    material = "\x00".join([normalize_tts_text(text), target_language_code or '', voice_style or ''])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def concat_audio_key(audio_ids):
+    return hashlib.sha256("+".join(audio_ids).encode('ascii')).hexdigest()
+
+
+class _MemoryTier:
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, key):
+        data = self.entries.get(key)
+        if data is not None:
+            self.entries.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return 0
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= len(old)
+        self.entries[key] = data
+        self.total_bytes += len(data)
+        evicted = 0
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, dropped = self.entries.popitem(last=False)
+            self.total_bytes -= len(dropped)
+            evicted += 1
+        return evicted
+
+
+class _DiskTier:
+    """
+    Files are named after their content key, so several worker processes can share
+    one directory. Each process keeps its own LRU index (seeded from mtimes on startup);
+    files removed by another worker are simply treated as misses.
+    Only index updates hold the lock; files are read, written (to a temp file, then
+    renamed) and removed outside it, which is safe because a key's content never changes.
+    """
+
+    def __init__(self, directory, max_bytes, extension='mp3'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.lock = threading.Lock()
+        self.index = OrderedDict()
+        self.total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}.{self.extension}")
+
+    def _load_index(self):
+        suffix = f".{self.extension}"
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(suffix):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name[:-len(suffix)], stat.st_size))
+        for _, key, size in sorted(found):
+            self.index[key] = size
+            self.total_bytes += size
+
+    def get(self, key):
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self.lock:
+                size = self.index.pop(key, None)
+                if size is not None:
+                    self.total_bytes -= size
+            return None
+        with self.lock:
+            if key not in self.index:
+                self.index[key] = len(data)
+                self.total_bytes += len(data)
+            self.index.move_to_end(key)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        path = self.path_for(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        dropped = []
+        with self.lock:
+            old_size = self.index.pop(key, None)
+            if old_size is not None:
+                self.total_bytes -= old_size
+            self.index[key] = len(data)
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes and len(self.index) > 1:
+                dropped_key, dropped_size = self.index.popitem(last=False)
+                self.total_bytes -= dropped_size
+                dropped.append(dropped_key)
+
+        for dropped_key in dropped:
+            try:
+                os.remove(self.path_for(dropped_key))
+            except FileNotFoundError:
+                pass
+        return len(dropped)
+
+    def usage(self):
+        with self.lock:
+            return len(self.index), self.total_bytes
+
+
+class AudioCache:
+    """
+    Content-addressed two-tier cache for synthesized audio: a bounded in-memory LRU
+    in front of an on-disk store with size-based eviction. Rendered meme images use it
+    too, with extension='png'. Disk I/O happens outside the cache lock, so memory hits
+    never wait behind a slow read or write.
+    """
+
+    def __init__(self, directory, memory_max_entries=256, memory_max_bytes=32 * 1024 * 1024,
+                 disk_max_bytes=512 * 1024 * 1024, extension='mp3'):
+        self.memory = _MemoryTier(memory_max_entries, memory_max_bytes)
+        self.disk = _DiskTier(directory, disk_max_bytes, extension) if directory else None
+        self.lock = threading.Lock()
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            directory=os.getenv("AUDIO_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "audio_cache")),
+            memory_max_entries=int(os.getenv("AUDIO_CACHE_MEMORY_ENTRIES", "256")),
+            memory_max_bytes=int(os.getenv("AUDIO_CACHE_MEMORY_MB", "32")) * 1024 * 1024,
+            disk_max_bytes=int(os.getenv("AUDIO_CACHE_DISK_MB", "512")) * 1024 * 1024,
+        )
+
+    def get(self, key, record_stats=True):
+        """
+        record_stats=False is for serving already-synthesized audio, which should not
+        count towards the synthesis hit ratio.
+        """
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                if record_stats:
+                    self.stats['memory_hits'] += 1
+                return data
+
+        data = self.disk.get(key) if self.disk is not None else None
+        with self.lock:
+            if data is not None:
+                if record_stats:
+                    self.stats['disk_hits'] += 1
+                self.stats['memory_evictions'] += self.memory.put(key, data)
+                return data
+            if record_stats:
+                self.stats['misses'] += 1
+            return None
+
+    def put(self, key, data):
+        with self.lock:
+            self.stats['stores'] += 1
+            self.stats['memory_evictions'] += self.memory.put(key, data)
+        if self.disk is None:
+            return
+        try:
+            evicted = self.disk.put(key, data)
+        except OSError as e:
+            log.warning("Could not write cache entry to disk.", key=key, error=str(e))
+            return
+        with self.lock:
+            self.stats['disk_evictions'] += evicted
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+            stats['hit_ratio'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+            stats['memory_entries'] = len(self.memory.entries)
+            stats['memory_bytes'] = self.memory.total_bytes
+        stats['disk_entries'], stats['disk_bytes'] = self.disk.usage() if self.disk is not None else (0, 0)
+        return stats
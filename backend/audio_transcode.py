@@ -0,0 +1,217 @@
+import os
+import time
+import shutil
+import hashlib
+import threading
+import subprocess
+
+from metrics import stage
+from structured_log import get_logger
+
+log = get_logger('audio_transcode')
+
+
+# format -> mimetype, ffmpeg encoder arguments, default and allowed bitrates (kbps).
+# Speech needs far less than the provider's music-grade MP3: Opus is transparent for
+# voice at ~24 kbps, MP3 stays intelligible down to ~32 kbps mono.
+AUDIO_FORMATS = {
+    'opus': {
+        'mimetype': 'audio/ogg',
+        'args': ['-c:a', 'libopus', '-application', 'voip', '-f', 'ogg'],
+        'bitrate': 24,
+        'bitrates': (12, 64),
+    },
+    'mp3': {
+        'mimetype': 'audio/mpeg',
+        'args': ['-c:a', 'libmp3lame', '-f', 'mp3'],
+        'bitrate': 48,
+        'bitrates': (32, 128),
+    },
+}
+
+# Accept values that name a format explicitly.
+ACCEPT_FORMATS = {
+    'audio/ogg': 'opus',
+    'audio/opus': 'opus',
+    'audio/mpeg': 'mp3',
+    'audio/mp3': 'mp3',
+}
+
+
+def negotiate_audio_format(requested=None, bitrate=None, accept=None):
+    """
+    Picks the audio variant to serve, as (format, bitrate_kbps), or None for the original.
+    An explicit format ('opus', 'mp3' or 'original') wins; otherwise the Accept header
+    decides, but only through explicitly listed audio types: players that send */*
+    (e.g. a plain <audio> element) keep the original, since not all of them play Ogg.
+    """
+    audio_format = (requested or '').strip().lower() or None
+    if audio_format is None and accept is not None:
+        best_quality = 0
+        for value, quality in accept:
+            candidate = ACCEPT_FORMATS.get(value.split(';')[0].strip().lower())
+            if candidate and quality > best_quality:
+                audio_format, best_quality = candidate, quality
+    if audio_format not in AUDIO_FORMATS:
+        return None
+    spec = AUDIO_FORMATS[audio_format]
+    try:
+        bitrate = int(bitrate) if bitrate else spec['bitrate']
+    except (TypeError, ValueError):
+        bitrate = spec['bitrate']
+    low, high = spec['bitrates']
+    return audio_format, min(high, max(low, bitrate))
+
+
+def transcode_key(audio_id, audio_format, bitrate):
+    return hashlib.sha256(f"{audio_id}:{audio_format}:{bitrate}k".encode('ascii')).hexdigest()
+
+
+class AudioTranscoder:
+    """
+    Transcodes cached TTS audio to compact speech codecs with ffmpeg. Each variant is
+    made once and stored in the audio cache next to the original, under a key derived
+    from the original's id, so later requests (and other workers sharing the cache
+    directory) get it for free. Concurrent requests for the same variant wait for one
+    transcode; at most max_concurrent ffmpeg processes run at a time.
+    Without ffmpeg every variant falls back to the original. A variant ffmpeg rejected
+    (non-zero exit) is not retried for failed_ttl seconds; timeouts are retried on the
+    next request. ffmpeg is disabled if it cannot be started at all.
+    """
+
+    def __init__(self, cache, ffmpeg=None, timeout=10.0, max_concurrent=2, failed_ttl=600.0):
+        self.cache = cache
+        self.ffmpeg = ffmpeg
+        self.timeout = timeout
+        self.failed_ttl = failed_ttl
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+        self.key_locks = {}  # key -> [lock, callers holding or waiting for it, attempt failed]
+        self.failed = {}  # key -> time.monotonic() after which it is retried
+        self.stats = {'transcodes': 0, 'cache_hits': 0, 'failures': 0, 'not_smaller': 0,
+                      'bytes_in': 0, 'bytes_out': 0, 'transcode_ms_total': 0.0}
+        if not ffmpeg:
+            log.warning("ffmpeg not found; audio is served in its original format only.")
+
+    @classmethod
+    def from_env(cls, cache):
+        return cls(
+            cache,
+            ffmpeg=os.getenv("AUDIO_FFMPEG") or shutil.which("ffmpeg"),
+            timeout=float(os.getenv("AUDIO_TRANSCODE_TIMEOUT", "10")),
+            max_concurrent=int(os.getenv("AUDIO_TRANSCODE_CONCURRENCY", "2")),
+            failed_ttl=float(os.getenv("AUDIO_TRANSCODE_FAILED_TTL", "600")),
+        )
+
+    @property
+    def available(self):
+        return bool(self.ffmpeg)
+
+    def _count(self, **amounts):
+        with self.lock:
+            for key, amount in amounts.items():
+                self.stats[key] += amount
+
+    def _lock_key(self, key):
+        with self.lock:
+            entry = self.key_locks.get(key)
+            if entry is None:
+                entry = self.key_locks[key] = [threading.Lock(), 0, False]
+            entry[1] += 1
+        entry[0].acquire()
+        return entry
+
+    def _unlock_key(self, key, entry):
+        entry[0].release()
+        with self.lock:
+            entry[1] -= 1
+            # Dropped only once nobody holds or waits for it, so a later caller can never
+            # end up with a different lock than one still in use for the same key.
+            if entry[1] == 0 and self.key_locks.get(key) is entry:
+                del self.key_locks[key]
+
+    def _failed_recently(self, key):
+        with self.lock:
+            retry_at = self.failed.get(key)
+            if retry_at is None:
+                return False
+            if time.monotonic() < retry_at:
+                return True
+            del self.failed[key]
+            return False
+
+    def _mark_failed(self, key):
+        now = time.monotonic()
+        with self.lock:
+            if len(self.failed) >= 10000:
+                self.failed = {k: retry_at for k, retry_at in self.failed.items() if retry_at > now}
+            self.failed[key] = now + self.failed_ttl
+
+    def variant(self, audio_id, audio_bytes, audio_format, bitrate):
+        """
+        Returns (bytes, mimetype) for the requested variant of audio_id, or the original
+        (audio/mpeg) if it cannot be made or would not be smaller.
+        """
+        key = transcode_key(audio_id, audio_format, bitrate)
+        if not self.available or self._failed_recently(key):
+            return audio_bytes, 'audio/mpeg'
+        mimetype = AUDIO_FORMATS[audio_format]['mimetype']
+        data = self.cache.get(key, record_stats=False)
+        if data is None:
+            entry = self._lock_key(key)
+            try:
+                data = self.cache.get(key, record_stats=False)
+                # Callers that queued behind a failed attempt share its outcome rather than
+                # each running ffmpeg again; the next request after them retries.
+                if data is None and not entry[2] and not self._failed_recently(key):
+                    data, rejected = self._transcode(audio_bytes, audio_format, bitrate)
+                    if data is not None:
+                        self.cache.put(key, data)
+                    else:
+                        entry[2] = True
+                        if rejected:
+                            self._mark_failed(key)
+            finally:
+                self._unlock_key(key, entry)
+        else:
+            self._count(cache_hits=1)
+        if data is None or len(data) >= len(audio_bytes):
+            if data is not None:
+                self._count(not_smaller=1)
+            return audio_bytes, 'audio/mpeg'
+        return data, mimetype
+
+    def _transcode(self, audio_bytes, audio_format, bitrate):
+        """Returns (data, rejected): data is None on failure, rejected if ffmpeg exited with an error."""
+        command = [self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0', '-vn', '-ac', '1',
+                   *AUDIO_FORMATS[audio_format]['args'], '-b:a', f"{bitrate}k", 'pipe:1']
+        started = time.perf_counter()
+        with self.slots, stage('transcode'):
+            try:
+                result = subprocess.run(command, input=audio_bytes, capture_output=True, timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                log.warning("Audio transcode timed out.", format=audio_format, bitrate=bitrate, timeout=self.timeout)
+                self._count(failures=1)
+                return None, False
+            except OSError as e:
+                log.error("Could not run ffmpeg; serving original audio only.", ffmpeg=self.ffmpeg, error=str(e))
+                self.ffmpeg = None
+                self._count(failures=1)
+                return None, False
+        if result.returncode != 0 or not result.stdout:
+            log.warning("Audio transcode failed.", format=audio_format, bitrate=bitrate,
+                        error=result.stderr.decode('utf-8', 'replace').strip()[-300:])
+            self._count(failures=1)
+            return None, result.returncode != 0
+        self._count(transcodes=1, bytes_in=len(audio_bytes), bytes_out=len(result.stdout),
+                    transcode_ms_total=(time.perf_counter() - started) * 1000)
+        return result.stdout, False
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['available'] = self.available
+        stats['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+        transcode_ms_total = stats.pop('transcode_ms_total')
+        stats['avg_transcode_ms'] = round(transcode_ms_total / stats['transcodes'], 2) if stats['transcodes'] else 0.0
+        return stats
@@ -0,0 +1,408 @@
+"""
+Local stand-ins for every upstream the backend talks to, for offline load tests
+(see bench_load.py). Nothing here is used by the app itself.
+
+    python bench_fakes.py upstreams --port 8790 --latency gemini=400,sarvam=250 --errors gemini=0.01
+    python bench_fakes.py app --port 8791          # the app, with an in-memory Firestore and FakeRecognizer
+
+The upstream server speaks just enough of each API for app.py:
+  POST /v1beta/models/<model>:generateContent         Gemini (REST transport)
+  POST /v1beta/models/<model>:streamGenerateContent   Gemini streaming (JSON array stream)
+  POST /sarvam/text-to-speech                          Sarvam TTS
+  GET  /pexels/v1/search, /bing/v7.0/images/search     image search
+Firestore and streaming speech recognition are faked in-process (InMemoryFirestore,
+FakeRecognizer). Latency per upstream is log-normal around the configured median; --errors makes that
+fraction of calls fail with a 503, --stalls makes them hang for --stall-seconds.
+"""
+import os
+import sys
+import json
+import math
+import time
+import base64
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+UPSTREAMS = ('gemini', 'sarvam', 'search', 'firestore', 'speech')
+DEFAULT_LATENCY_MS = {'gemini': 400.0, 'sarvam': 250.0, 'search': 120.0, 'firestore': 15.0, 'speech': 150.0}
+
+_WORDS = ("bhai sun yeh plan ekdum solid hai lekin tera execution hamesha ki tarah "
+          "average rahega chai pi aur kaam kar deadline kal hai aur tu abhi bhi reels dekh raha hai").split()
+
+
+def parse_mapping(spec, defaults=None):
+    """'gemini=400,sarvam=250' -> {'gemini': 400.0, 'sarvam': 250.0}, on top of defaults."""
+    mapping = dict(defaults or {})
+    for item in (spec or "").split(','):
+        if not item.strip():
+            continue
+        name, value = item.split('=', 1)
+        if name.strip() not in UPSTREAMS:
+            raise ValueError(f"Unknown upstream '{name.strip()}'. Expected one of {', '.join(UPSTREAMS)}.")
+        mapping[name.strip()] = float(value)
+    return mapping
+
+
+class UpstreamBehaviour:
+    """Latency and failure model for one upstream."""
+
+    def __init__(self, median_ms, sigma=0.5, error_rate=0.0, stall_rate=0.0, stall_seconds=30.0):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+
+    def latency(self):
+        if self.median_ms <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.median_ms / 1000.0), self.sigma)
+
+    def outcome(self):
+        """'ok', 'error' or 'stall' for the next call."""
+        roll = random.random()
+        if roll < self.error_rate:
+            return 'error'
+        if roll < self.error_rate + self.stall_rate:
+            return 'stall'
+        return 'ok'
+
+    def delay(self):
+        outcome = self.outcome()
+        time.sleep(self.stall_seconds if outcome == 'stall' else self.latency())
+        return outcome
+
+
+def behaviours_from_args(args):
+    latency = parse_mapping(args.latency, DEFAULT_LATENCY_MS)
+    errors = parse_mapping(args.errors)
+    stalls = parse_mapping(args.stalls)
+    return {
+        name: UpstreamBehaviour(latency[name], args.sigma, errors.get(name, 0.0), stalls.get(name, 0.0), args.stall_seconds)
+        for name in UPSTREAMS
+    }
+
+
+def fake_text(chars):
+    words = []
+    length = 0
+    while length < chars:
+        word = random.choice(_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    sentences = []
+    for start in range(0, len(words), 12):
+        sentence = " ".join(words[start:start + 12])
+        sentences.append(sentence[0].upper() + sentence[1:] + random.choice(".!?"))
+    text = " ".join(sentences)
+    # A little markdown so the cleaner does real work.
+    return f"**{text[:40]}**{text[40:]}" if len(text) > 40 else text
+
+
+_SCHEMA_TYPES = {1: 'STRING', 2: 'NUMBER', 3: 'INTEGER', 4: 'BOOLEAN', 5: 'ARRAY', 6: 'OBJECT'}
+
+
+def fake_from_schema(schema, chars):
+    """A value matching a Gemini response_schema (the OBJECT/ARRAY/STRING subset app.py uses)."""
+    kind = schema.get('type') or 'STRING'
+    # The REST transport sends enums as numbers (google.ai.generativelanguage.Type).
+    kind = _SCHEMA_TYPES.get(kind, 'STRING') if isinstance(kind, int) else kind.upper()
+    if kind == 'ARRAY':
+        return [fake_from_schema(schema.get('items', {}), chars) for _ in range(3)]
+    if kind == 'OBJECT':
+        return {name: fake_from_schema(prop, chars) for name, prop in schema.get('properties', {}).items()}
+    if kind in ('INTEGER', 'NUMBER'):
+        return random.randint(1, 100)
+    if kind == 'BOOLEAN':
+        return random.random() < 0.5
+    return fake_text(max(20, chars // 4))
+
+
+def _generate_reply(body, chars):
+    config = body.get('generationConfig') or body.get('generation_config') or {}
+    schema = config.get('responseSchema') or config.get('response_schema')
+    if schema:
+        return json.dumps(fake_from_schema(schema, chars), ensure_ascii=False)
+    return fake_text(chars)
+
+
+def _candidate_chunk(text, finished):
+    chunk = {'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}, 'index': 0}]}
+    if finished:
+        chunk['candidates'][0]['finishReason'] = 'STOP'
+    return chunk
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    behaviours = None
+    reply_chars = 600
+    audio_bytes = 2048
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(raw or b'{}')
+        except ValueError:
+            return {}
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _fail(self):
+        self._send_json({'error': {'code': 503, 'message': 'Injected failure.', 'status': 'UNAVAILABLE'}}, status=503)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._read_json()
+        if path.startswith('/v1beta/') and path.endswith(':streamGenerateContent'):
+            self._stream_generate(body)
+        elif path.startswith('/v1beta/') and path.endswith(':generateContent'):
+            if self.behaviours['gemini'].delay() == 'error':
+                return self._fail()
+            self._send_json(_candidate_chunk(_generate_reply(body, self.reply_chars), True))
+        elif path == '/sarvam/text-to-speech':
+            if self.behaviours['sarvam'].delay() == 'error':
+                return self._fail()
+            audio = b'ID3' + os.urandom(self.audio_bytes)
+            self._send_json({'audios': [base64.b64encode(audio).decode('ascii')]})
+        else:
+            self._send_json({'error': f'No fake for POST {path}'}, status=404)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path in ('/pexels/v1/search', '/bing/v7.0/images/search'):
+            if self.behaviours['search'].delay() == 'error':
+                return self._fail()
+            image_url = f"https://images.example.invalid/{random.randint(1, 10 ** 6)}.jpg"
+            if path.startswith('/pexels'):
+                self._send_json({'photos': [{'src': {'large': image_url}}]})
+            else:
+                self._send_json({'value': [{'contentUrl': image_url}]})
+        else:
+            self._send_json({'error': f'No fake for GET {path}'}, status=404)
+
+    def _stream_generate(self, body):
+        behaviour = self.behaviours['gemini']
+        outcome = behaviour.outcome()
+        total = behaviour.stall_seconds if outcome == 'stall' else behaviour.latency()
+        # About a third of the latency before the first chunk, the rest spread over the stream.
+        time.sleep(total * 0.35)
+        if outcome == 'error':
+            return self._fail()
+        text = _generate_reply(body, self.reply_chars)
+        pieces = [text[i:i + 60] for i in range(0, len(text), 60)] or ['']
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        gap = total * 0.65 / len(pieces)
+        for index, piece in enumerate(pieces):
+            prefix = '[' if index == 0 else ',\r\n'
+            self._write_chunk(prefix + json.dumps(_candidate_chunk(piece, index == len(pieces) - 1), ensure_ascii=False))
+            if index < len(pieces) - 1:
+                time.sleep(gap)
+        self._write_chunk(']')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+
+def serve_upstreams(port, behaviours, reply_chars=600, audio_bytes=2048, host='127.0.0.1'):
+    handler = type('BenchUpstreamHandler', (FakeUpstreamHandler,), {
+        'behaviours': behaviours, 'reply_chars': reply_chars, 'audio_bytes': audio_bytes,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+# --- In-memory Firestore ------------------------------------------------------------
+
+class _FakeSnapshot:
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class _FakeDocumentRef:
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+
+    def set(self, data):
+        self.store.add(self.path, data)
+
+
+class _FakeQuery:
+    def __init__(self, store, path, filters=(), order=None, limit_to=None):
+        self.store = store
+        self.path = path
+        self.filters = filters
+        self.order = order
+        self.limit_to = limit_to
+
+    def where(self, field, op, value):
+        if op != '==':
+            raise NotImplementedError(f"In-memory Firestore only supports '==' filters, not '{op}'.")
+        return _FakeQuery(self.store, self.path, self.filters + ((field, value),), self.order, self.limit_to)
+
+    def order_by(self, field, direction='ASCENDING'):
+        return _FakeQuery(self.store, self.path, self.filters, (field, direction), self.limit_to)
+
+    def limit(self, count):
+        return _FakeQuery(self.store, self.path, self.filters, self.order, count)
+
+    def document(self):
+        return _FakeDocumentRef(self.store, self.path)
+
+    def get(self):
+        self.store.behaviour.delay()
+        docs = [doc for doc in self.store.documents(self.path) if all(doc.get(f) == v for f, v in self.filters)]
+        if self.order:
+            field, direction = self.order
+            docs = [doc for doc in docs if field in doc]
+            docs.sort(key=lambda doc: doc[field], reverse=direction == 'DESCENDING')
+        if self.limit_to is not None:
+            docs = docs[:self.limit_to]
+        return [_FakeSnapshot(doc) for doc in docs]
+
+
+class _FakeBatch:
+    def __init__(self, store):
+        self.store = store
+        self.writes = []
+
+    def set(self, ref, data):
+        self.writes.append((ref, data))
+
+    def commit(self):
+        self.store.behaviour.delay()
+        for ref, data in self.writes:
+            ref.set(data)
+
+
+class InMemoryFirestore:
+    """
+    The slice of the Firestore client API that app.py and persistence.py use
+    (collection/where/order_by/limit/get, document().set, batch), with the configured
+    read/commit latency. SERVER_TIMESTAMP is replaced with the local time on write.
+    """
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.lock = threading.Lock()
+        self.collections = {}
+
+    def add(self, path, data):
+        from google.cloud.firestore import SERVER_TIMESTAMP
+        import datetime
+        data = {
+            key: datetime.datetime.now(datetime.timezone.utc) if value is SERVER_TIMESTAMP else value
+            for key, value in data.items()
+        }
+        with self.lock:
+            self.collections.setdefault(path, []).append(data)
+
+    def documents(self, path):
+        with self.lock:
+            return list(self.collections.get(path, ()))
+
+    def collection(self, path):
+        return _FakeQuery(self, path)
+
+    def batch(self):
+        return _FakeBatch(self)
+
+
+class FakeRecognizer:
+    """
+    Stand-in for voice_session.GoogleStreamingRecognizer. The "audio" is UTF-8 text: every
+    frame yields the words so far as an interim result, and the end of the upload yields
+    the final transcript after the configured recognition latency.
+    """
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+
+    def recognize(self, frames, language_code, encoding=None, sample_rate=None):
+        received = b""
+        for frame in frames:
+            received += frame
+            yield received.decode('utf-8', 'ignore').strip(), False
+        if self.behaviour.delay() == 'error':
+            raise RuntimeError("Fake recognition error.")
+        yield received.decode('utf-8', 'ignore').strip(), True
+
+
+def create_bench_app(firestore='memory'):
+    """
+    The real app with Firestore swapped for InMemoryFirestore (unless firestore='emulator',
+    which keeps the real client so FIRESTORE_EMULATOR_HOST is honoured) and speech
+    recognition for FakeRecognizer. Gunicorn can load it as "bench_fakes:create_bench_app()".
+    """
+    import app as app_module
+    if firestore == 'memory':
+        latency = float(os.getenv("BENCH_FIRESTORE_LATENCY_MS", DEFAULT_LATENCY_MS['firestore']))
+        app_module.db._factory = lambda: InMemoryFirestore(UpstreamBehaviour(latency))
+    speech_latency = float(os.getenv("BENCH_SPEECH_LATENCY_MS", DEFAULT_LATENCY_MS['speech']))
+    app_module.voice_recognizer._factory = lambda: FakeRecognizer(UpstreamBehaviour(speech_latency))
+    return app_module.create_app()
+
+
+def add_behaviour_arguments(parser):
+    parser.add_argument('--latency', default='', help="Median latency in ms per upstream, e.g. gemini=400,sarvam=250,search=120,firestore=15,speech=150")
+    parser.add_argument('--errors', default='', help="Fraction of calls that fail with a 503, e.g. gemini=0.02")
+    parser.add_argument('--stalls', default='', help="Fraction of calls that hang for --stall-seconds, e.g. sarvam=0.01")
+    parser.add_argument('--stall-seconds', type=float, default=30.0)
+    parser.add_argument('--sigma', type=float, default=0.5, help="Log-normal spread of the latency distribution.")
+    parser.add_argument('--reply-chars', type=int, default=600, help="Length of generated Gemini replies.")
+    parser.add_argument('--audio-bytes', type=int, default=2048, help="Size of generated TTS audio.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    upstreams = commands.add_parser('upstreams', help="Serve the fake Gemini, Sarvam and image search APIs.")
+    upstreams.add_argument('--port', type=int, default=8790)
+    add_behaviour_arguments(upstreams)
+    app_parser = commands.add_parser('app', help="Serve the app (threaded dev server) with an in-memory Firestore.")
+    app_parser.add_argument('--port', type=int, default=8791)
+    app_parser.add_argument('--firestore', choices=('memory', 'emulator'), default='memory')
+    args = parser.parse_args(argv)
+
+    if args.command == 'upstreams':
+        server = serve_upstreams(args.port, behaviours_from_args(args), args.reply_chars, args.audio_bytes)
+        print(f"Fake upstreams listening on http://127.0.0.1:{args.port}", flush=True)
+        server.serve_forever()
+    else:
+        import logging
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no per-request access log
+        server = make_server('127.0.0.1', args.port, create_bench_app(args.firestore), threaded=True)
+        print(f"App listening on http://127.0.0.1:{args.port}", flush=True)
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
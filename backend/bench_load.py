@@ -0,0 +1,310 @@
+"""
+Offline load test: starts the fake upstreams and the app (see bench_fakes.py), drives every
+route at each concurrency level and reports throughput and p50/p95/p99 latency per route.
+No network access or API quota is needed.
+
+    python bench_load.py --concurrency 1,8,32 --duration 10
+    python bench_load.py --routes chat,chat_stream --latency gemini=800 --errors gemini=0.02
+    python bench_load.py --save baseline.json
+    python bench_load.py --baseline baseline.json --tolerance 0.2    # exit 1 on regressions
+
+Environment variables are passed through to the app, so e.g. GEMINI_RPM or
+TTS_PIPELINE_WORKERS can be varied between runs. --workers N serves the app with gunicorn
+(gunicorn.conf.py) instead of the threaded development server.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import requests
+
+from bench_fakes import DEFAULT_LATENCY_MS, add_behaviour_arguments, parse_mapping
+
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+_MESSAGES = [
+    "Bhai mera boss phir se weekend pe call kar raha hai, kya karun?",
+    "Explain recursion like I'm five, but make it sarcastic.",
+    "Should I learn Rust or just keep complaining about Python?",
+    "Mummy ne bola shaadi kar le, main bola deploy kar le.",
+]
+
+
+def _user(worker):
+    return f"bench-user-{worker}"
+
+
+def _chat(worker, iteration, stream=False):
+    payload = {
+        'text': random.choice(_MESSAGES),
+        'language': 'hinglish',
+        'user_id': _user(worker),
+        'session_id': f"bench-session-{worker}",
+    }
+    if stream:
+        payload['stream'] = True
+    return 'POST', '/chat', payload
+
+
+def _voice_chat(worker, iteration):
+    # FakeRecognizer treats the audio as text; it is uploaded in small chunks like a microphone would.
+    words = random.choice(_MESSAGES).encode('utf-8')
+    frames = (words[i:i + 16] for i in range(0, len(words), 16))
+    path = f"/voice_chat?language=hinglish&user_id={_user(worker)}&session_id=bench-session-{worker}"
+    return 'POST', path, frames
+
+
+# name -> fn(worker, iteration) returning (method, path, json body, chunked body iterator or None)
+SCENARIOS = {
+    'chat': _chat,
+    'chat_stream': lambda worker, iteration: _chat(worker, iteration, stream=True),
+    'voice_chat': _voice_chat,
+    'get_humor': lambda worker, iteration: ('POST', '/get_humor', {'language': random.choice(['en', 'hinglish'])}),
+    'generate_brocode_meme': lambda worker, iteration: ('POST', '/generate_brocode_meme', {'language': 'hinglish'}),
+    'roast_me': lambda worker, iteration: ('POST', '/roast_me', {'language': 'hinglish'}),
+    'unsolicited_advice': lambda worker, iteration: ('POST', '/unsolicited_advice', {'language': 'hinglish'}),
+    'assign_task': lambda worker, iteration: ('POST', '/assign_task', {'language': 'hinglish', 'user_id': _user(worker)}),
+    'unlock_achievement': lambda worker, iteration: ('POST', '/unlock_achievement', {'language': 'hinglish', 'user_id': _user(worker)}),
+    'speak_text': lambda worker, iteration: ('POST', '/speak_text', {'text': f"{random.choice(_MESSAGES)} #{iteration % 50}", 'language': 'hi'}),
+    'audio': None,  # GET /audio/<id> for ids collected during warm-up
+    'search_image': lambda worker, iteration: ('POST', '/search_image', {'query': random.choice(['cat', 'chai', 'monday', 'deadline'])}),
+    'batch': lambda worker, iteration: ('POST', '/batch', {'requests': [
+        {'op': 'get_humor', 'body': {'language': 'hinglish'}},
+        {'op': 'roast_me', 'body': {'language': 'hinglish'}},
+        {'op': 'unsolicited_advice', 'body': {'language': 'hinglish'}},
+        {'op': 'assign_task', 'body': {'language': 'hinglish', 'user_id': _user(worker)}},
+        {'op': 'unlock_achievement', 'body': {'language': 'hinglish', 'user_id': _user(worker)}},
+    ]}),
+    'metrics': lambda worker, iteration: ('GET', '/metrics', None),
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url, process, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} before it was ready.")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s.")
+
+
+def start_processes(args):
+    upstream_port, app_port = free_port(), free_port()
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    behaviour_args = ['--latency', args.latency, '--errors', args.errors, '--stalls', args.stalls,
+                      '--stall-seconds', str(args.stall_seconds), '--sigma', str(args.sigma),
+                      '--reply-chars', str(args.reply_chars), '--audio-bytes', str(args.audio_bytes)]
+    upstreams = subprocess.Popen([sys.executable, 'bench_fakes.py', 'upstreams', '--port', str(upstream_port)] + behaviour_args, cwd=BACKEND_DIR)
+
+    env = dict(os.environ)
+    env.update({
+        'GEMINI_API_KEY': 'bench',
+        'GEMINI_API_ENDPOINT': upstream_url,
+        'SARVAM_AI_API_KEY': 'bench',
+        'SARVAM_AI_TTS_ENDPOINT': f"{upstream_url}/sarvam/text-to-speech",
+        'PEXELS_API_KEY': 'bench',
+        'PEXELS_SEARCH_URL': f"{upstream_url}/pexels/v1/search",
+        'BING_IMAGE_SEARCH_KEY': 'bench',
+        'BING_IMAGE_SEARCH_URL': f"{upstream_url}/bing/v7.0/images/search",
+        'AUDIO_CACHE_DIR': tempfile.mkdtemp(prefix='bench-audio-'),
+        'SINGLE_FLIGHT_DIR': tempfile.mkdtemp(prefix='bench-single-flight-'),
+        'LOG_LEVEL': env.get('LOG_LEVEL', 'WARNING'),
+        'FLASK_DEBUG': '0',
+        'PORT': str(app_port),
+    })
+    latency = parse_mapping(args.latency, DEFAULT_LATENCY_MS)
+    env.setdefault('BENCH_FIRESTORE_LATENCY_MS', str(latency['firestore']))
+    env.setdefault('BENCH_SPEECH_LATENCY_MS', str(latency['speech']))
+    if args.workers:
+        env.update({'WEB_CONCURRENCY': str(args.workers)})
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', f"bench_fakes:create_bench_app('{args.firestore}')"]
+    else:
+        command = [sys.executable, 'bench_fakes.py', 'app', '--port', str(app_port), '--firestore', args.firestore]
+    app = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+
+    processes = [upstreams, app]
+    try:
+        wait_until_up(f"{upstream_url}/health", upstreams)
+        wait_until_up(f"http://127.0.0.1:{app_port}/startup_report", app)
+    except Exception:
+        stop_processes(processes)
+        raise
+    return f"http://127.0.0.1:{app_port}", processes
+
+
+def stop_processes(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def collect_audio_ids(base_url, count=8):
+    ids = []
+    with requests.Session() as session:
+        for iteration in range(count):
+            _, path, payload = SCENARIOS['speak_text'](0, iteration)
+            try:
+                body = session.post(base_url + path, json=payload, timeout=30).json()
+            except (requests.exceptions.RequestException, ValueError):
+                continue
+            if body.get('audio_url'):
+                ids.append(body['audio_url'])
+    return ids
+
+
+def run_scenario(base_url, name, concurrency, duration, timeout, audio_urls):
+    """Runs `concurrency` closed-loop clients for `duration` seconds; returns a result row."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(worker):
+        session = requests.Session()
+        iteration = 0
+        while time.monotonic() < deadline:
+            if name == 'audio':
+                method, path, payload = 'GET', random.choice(audio_urls), None
+            else:
+                method, path, payload = SCENARIOS[name](worker, iteration)
+            iteration += 1
+            started = time.perf_counter()
+            try:
+                body = {'json': payload} if payload is None or isinstance(payload, dict) else {'data': payload}
+                response = session.request(method, base_url + path, timeout=timeout, stream=True, **body)
+                for _ in response.iter_content(chunk_size=None):
+                    pass
+                ok = response.status_code < 400
+            except requests.exceptions.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+        session.close()
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(worker,), daemon=True) for worker in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        'route': name,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': round(len(latencies) / wall, 2) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+
+def print_row(row):
+    print(f"{row['route']:<22} {row['concurrency']:>5} {row['requests']:>8} {row['errors']:>7} "
+          f"{row['rps']:>9.2f} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}", flush=True)
+
+
+def compare_to_baseline(rows, baseline_rows, tolerance):
+    """Returns one message per route/concurrency whose p95 rose or throughput fell by more than tolerance."""
+    baseline = {(row['route'], row['concurrency']): row for row in baseline_rows}
+    regressions = []
+    for row in rows:
+        before = baseline.get((row['route'], row['concurrency']))
+        if before is None:
+            continue
+        if before['p95_ms'] and row['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{row['route']} @{row['concurrency']}: p95 {before['p95_ms']} -> {row['p95_ms']} ms")
+        if before['rps'] and row['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append(f"{row['route']} @{row['concurrency']}: throughput {before['rps']} -> {row['rps']} req/s")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', default=','.join(SCENARIOS), help="Comma-separated scenarios: " + ", ".join(SCENARIOS))
+    parser.add_argument('--concurrency', default='1,8,32', help="Comma-separated client counts.")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per route and concurrency level.")
+    parser.add_argument('--warmup', type=float, default=2.0, help="Seconds of unrecorded load before each route.")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Client-side request timeout in seconds.")
+    parser.add_argument('--workers', type=int, default=0, help="Serve with gunicorn and this many workers (default: threaded dev server).")
+    parser.add_argument('--firestore', choices=('memory', 'emulator'), default='memory',
+                        help="memory: in-process fake; emulator: real client, set FIRESTORE_EMULATOR_HOST.")
+    parser.add_argument('--save', help="Write the results as JSON to this file.")
+    parser.add_argument('--baseline', help="Compare against results saved with --save.")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative p95/throughput change against the baseline.")
+    add_behaviour_arguments(parser)
+    args = parser.parse_args(argv)
+
+    routes = [route.strip() for route in args.routes.split(',') if route.strip()]
+    unknown = [route for route in routes if route not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown routes: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    base_url, processes = start_processes(args)
+    rows = []
+    try:
+        audio_urls = collect_audio_ids(base_url) if 'audio' in routes else []
+        print(f"{'route':<22} {'conc':>5} {'requests':>8} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for route in routes:
+            if route == 'audio' and not audio_urls:
+                print(f"{route:<22} skipped: no audio ids (is /speak_text failing?)")
+                continue
+            for level in levels:
+                if args.warmup > 0:
+                    run_scenario(base_url, route, level, args.warmup, args.timeout, audio_urls)
+                row = run_scenario(base_url, route, level, args.duration, args.timeout, audio_urls)
+                rows.append(row)
+                print_row(row)
+    finally:
+        stop_processes(processes)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': rows}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_to_baseline(rows, json.load(f)['results'], args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION: {message}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,42 @@
+"""
+Microbenchmarks for the markdown cleaner against the original six-pass implementation.
+
+    python bench_markdown_cleaner.py [repeat]
+"""
+import sys
+import timeit
+
+from markdown_cleaner import clean_markdown, IncrementalMarkdownCleaner
+from test_markdown_cleaner import legacy_clean_markdown, load_corpus
+
+
+def clean_streamed(text, chunk_size=8):
+    cleaner = IncrementalMarkdownCleaner()
+    out = [cleaner.feed(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size)]
+    out.append(cleaner.finish())
+    return "".join(out)
+
+
+def bench(name, fn, texts, repeat):
+    number = max(1, 20000 // len(texts))
+    best = min(timeit.repeat(lambda: [fn(t) for t in texts], number=number, repeat=repeat))
+    per_call_us = best / (number * len(texts)) * 1e6
+    print(f"{name:<34} {per_call_us:8.2f} us/call")
+    return per_call_us
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    corpus = load_corpus()
+    humor_items = [t.split('\n')[0][:120] for t in corpus] * 2  # ~30 short items, as in /get_humor
+
+    for label, texts in (("corpus", corpus), ("humor items", humor_items)):
+        print(f"-- {label} ({len(texts)} texts)")
+        legacy = bench("legacy clean_markdown", legacy_clean_markdown, texts, repeat)
+        current = bench("clean_markdown", clean_markdown, texts, repeat)
+        bench("IncrementalMarkdownCleaner (8 ch)", clean_streamed, texts, repeat)
+        print(f"{'speedup':<34} {legacy / current:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import os
+import math
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable (circuit open). Try again in {math.ceil(retry_after)}s.")
+        self.name = name
+        self.retry_after = retry_after
+
+
+_breakers = {}
+
+
+class CircuitBreaker:
+    """
+    Per-dependency circuit breaker over a rolling window of one-second buckets.
+
+    closed     calls go through; the breaker opens once the window holds at least
+               min_calls calls and either the failure rate reaches error_rate or the
+               share of calls slower than slow_call_seconds reaches slow_rate.
+    open       calls fail fast with CircuitOpenError for open_seconds.
+    half_open  up to half_open_calls trial calls go through; if they all succeed (and
+               are not slow) the breaker closes, otherwise it opens again.
+
+    is_failure(exc) decides which exceptions count against the dependency (e.g. a 400
+    caused by our own request should not). Breakers register themselves by name so the
+    admin endpoint can list and override them.
+    """
+
+    def __init__(self, name, window_seconds=30, min_calls=10, error_rate=0.5, slow_call_seconds=5.0,
+                 slow_rate=0.8, open_seconds=15.0, half_open_calls=2, is_failure=None):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.is_failure = is_failure or (lambda exc: True)
+        self.lock = threading.Lock()
+        self.buckets = deque()  # [second, calls, failures, slow]
+        self.totals = [0, 0, 0]
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trials_started = 0
+        self.trials_passed = 0
+        self.half_open_since = 0.0
+        self.forced = None
+        self.stats = {'rejected': 0, 'opened': 0}
+        _breakers[name] = self
+
+    @classmethod
+    def from_env(cls, name, prefix, slow_call_seconds=5.0, is_failure=None):
+        return cls(
+            name,
+            window_seconds=int(os.getenv(f"{prefix}_BREAKER_WINDOW", "30")),
+            min_calls=int(os.getenv(f"{prefix}_BREAKER_MIN_CALLS", "10")),
+            error_rate=float(os.getenv(f"{prefix}_BREAKER_ERROR_RATE", "0.5")),
+            slow_call_seconds=float(os.getenv(f"{prefix}_BREAKER_SLOW_SECONDS", str(slow_call_seconds))),
+            slow_rate=float(os.getenv(f"{prefix}_BREAKER_SLOW_RATE", "0.8")),
+            open_seconds=float(os.getenv(f"{prefix}_BREAKER_OPEN_SECONDS", "15")),
+            half_open_calls=int(os.getenv(f"{prefix}_BREAKER_HALF_OPEN_CALLS", "2")),
+            is_failure=is_failure,
+        )
+
+    def _trim(self, now):
+        horizon = int(now) - self.window_seconds
+        while self.buckets and self.buckets[0][0] <= horizon:
+            _, calls, failures, slow = self.buckets.popleft()
+            self.totals[0] -= calls
+            self.totals[1] -= failures
+            self.totals[2] -= slow
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.stats['opened'] += 1
+        self.buckets.clear()
+        self.totals = [0, 0, 0]
+
+    def _retry_after(self, now):
+        return max(0.0, self.opened_at + self.open_seconds - now)
+
+    def before(self):
+        """Admits a call or raises CircuitOpenError. Returns the start time to pass to after()."""
+        now = time.monotonic()
+        with self.lock:
+            if self.forced == OPEN:
+                self.stats['rejected'] += 1
+                raise CircuitOpenError(self.name, self.open_seconds)
+            if self.forced is None:
+                # A trial whose outcome never came back (e.g. an abandoned stream) must not
+                # keep the breaker half-open forever, so trials are re-issued after open_seconds.
+                if (self.state == OPEN and now - self.opened_at >= self.open_seconds) or \
+                        (self.state == HALF_OPEN and now - self.half_open_since >= self.open_seconds):
+                    self.state = HALF_OPEN
+                    self.half_open_since = now
+                    self.trials_started = self.trials_passed = 0
+                if self.state == OPEN or (self.state == HALF_OPEN and self.trials_started >= self.half_open_calls):
+                    self.stats['rejected'] += 1
+                    raise CircuitOpenError(self.name, self._retry_after(now) or 1.0)
+                if self.state == HALF_OPEN:
+                    self.trials_started += 1
+        return now
+
+    def after(self, started, error=None):
+        """Records the outcome of a call admitted by before()."""
+        self.record(time.monotonic() - started, error is not None and self.is_failure(error))
+
+    def record(self, seconds, failed):
+        """Records an outcome directly, e.g. for calls that are never rejected."""
+        slow = seconds >= self.slow_call_seconds
+        now = time.monotonic()
+        with self.lock:
+            if self.forced is not None or self.state == OPEN:
+                return
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    self._open(now)
+                else:
+                    self.trials_passed += 1
+                    if self.trials_passed >= self.half_open_calls:
+                        self.state = CLOSED
+                return
+
+            second = int(now)
+            if not self.buckets or self.buckets[-1][0] != second:
+                self.buckets.append([second, 0, 0, 0])
+            bucket = self.buckets[-1]
+            bucket[1] += 1
+            bucket[2] += 1 if failed else 0
+            bucket[3] += 1 if slow else 0
+            self.totals[0] += 1
+            self.totals[1] += 1 if failed else 0
+            self.totals[2] += 1 if slow else 0
+            self._trim(now)
+
+            calls, failures, slow_calls = self.totals
+            if calls >= self.min_calls and (failures >= self.error_rate * calls or slow_calls >= self.slow_rate * calls):
+                self._open(now)
+
+    @contextmanager
+    def guard(self):
+        started = self.before()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.after(started, error)
+
+    @property
+    def allows_calls(self):
+        """False while calls would be rejected; for callers that degrade instead of calling."""
+        with self.lock:
+            if self.forced is not None:
+                return self.forced != OPEN
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= self.open_seconds
+            if self.state == HALF_OPEN:
+                return self.trials_started < self.half_open_calls or time.monotonic() - self.half_open_since >= self.open_seconds
+            return True
+
+    def force(self, state):
+        """Admin override: 'open' or 'closed' pins the breaker, None returns it to automatic."""
+        with self.lock:
+            self.forced = state
+            if state is None:
+                self.state = CLOSED
+                self.buckets.clear()
+                self.totals = [0, 0, 0]
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            self._trim(now)
+            calls, failures, slow_calls = self.totals
+            return {
+                'state': self.forced or self.state,
+                'forced': self.forced is not None,
+                'window_calls': calls,
+                'window_failures': failures,
+                'window_slow_calls': slow_calls,
+                'retry_after_seconds': round(self._retry_after(now), 1) if self.state == OPEN else 0.0,
+                'rejected': self.stats['rejected'],
+                'opened': self.stats['opened'],
+            }
+
+
+def get_breaker(name):
+    return _breakers.get(name)
+
+
+def breaker_states():
+    return {name: breaker.snapshot() for name, breaker in _breakers.items()}
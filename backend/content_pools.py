@@ -0,0 +1,92 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from structured_log import get_logger
+
+log = get_logger('content_pools')
+
+
+class ContentPools:
+    """
+    Keeps a pool of ready-made items per (kind, language) for the one-shot novelty
+    endpoints. pop() is O(1); whenever a pool drops below low_water a background refill
+    asks generate_batch(kind, language, batch_size) for a whole batch in one LLM call.
+    At most one refill per pool is in flight at a time.
+    """
+
+    def __init__(self, generate_batch, batch_size=10, low_water=3, capacity=30, workers=2, enabled=True):
+        self.generate_batch = generate_batch
+        self.batch_size = batch_size
+        self.low_water = low_water
+        self.capacity = capacity
+        self.enabled = enabled
+        self.pools = {}
+        self.refilling = set()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="content-pool")
+        self.stats = {'hits': 0, 'misses': 0, 'refills': 0, 'refill_errors': 0, 'items_generated': 0}
+
+    @classmethod
+    def from_env(cls, generate_batch):
+        return cls(
+            generate_batch,
+            batch_size=int(os.getenv("CONTENT_POOL_BATCH_SIZE", "10")),
+            low_water=int(os.getenv("CONTENT_POOL_LOW_WATER", "3")),
+            capacity=int(os.getenv("CONTENT_POOL_CAPACITY", "30")),
+            workers=int(os.getenv("CONTENT_POOL_WORKERS", "2")),
+            enabled=os.getenv("CONTENT_POOL_ENABLED", "1") != "0",
+        )
+
+    def pop(self, kind, language):
+        """Returns a ready item, or None if the pool is empty (the caller then generates live)."""
+        if not self.enabled:
+            return None
+        key = (kind, language)
+        with self.lock:
+            pool = self.pools.setdefault(key, deque())
+            item = pool.popleft() if pool else None
+            self.stats['hits' if item is not None else 'misses'] += 1
+            needs_refill = len(pool) < self.low_water and key not in self.refilling
+            if needs_refill:
+                self.refilling.add(key)
+        if needs_refill:
+            self.executor.submit(self._refill, key)
+        return item
+
+    def prewarm(self, kinds, languages):
+        for kind in kinds:
+            for language in languages:
+                key = (kind, language)
+                with self.lock:
+                    if key in self.refilling:
+                        continue
+                    self.pools.setdefault(key, deque())
+                    self.refilling.add(key)
+                self.executor.submit(self._refill, key)
+
+    def _refill(self, key):
+        kind, language = key
+        try:
+            items = self.generate_batch(kind, language, self.batch_size)
+            with self.lock:
+                pool = self.pools.setdefault(key, deque())
+                room = max(0, self.capacity - len(pool))
+                pool.extend(items[:room])
+                self.stats['refills'] += 1
+                self.stats['items_generated'] += len(items)
+            log.debug("Refilled content pool.", kind=kind, language=language, items=len(items))
+        except Exception as e:
+            with self.lock:
+                self.stats['refill_errors'] += 1
+            log.warning("Failed to refill content pool.", kind=kind, language=language, error=str(e))
+        finally:
+            with self.lock:
+                self.refilling.discard(key)
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['pools'] = {f"{kind}/{language}": len(pool) for (kind, language), pool in self.pools.items()}
+            return stats
@@ -0,0 +1,323 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from hedging import Hedger, HedgeUnavailable
+from metrics import prompt_chars, stage
+
+
+HUMOR_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "type": { "type": "STRING" },
+            "content": { "type": "STRING" }
+        },
+        "required": ["type", "content"]
+    }
+}
+
+MEME_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "caption": { "type": "STRING" },
+        "image_description": { "type": "STRING" }
+    },
+    "required": ["caption", "image_description"]
+}
+
+TITLE_DESCRIPTION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "title": { "type": "STRING" },
+        "description": { "type": "STRING" }
+    },
+    "required": ["title", "description"]
+}
+
+
+def _array_of(item_schema):
+    return {"type": "ARRAY", "items": item_schema}
+
+
+def _json_config(schema):
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+
+def _prompt_chars(contents):
+    if isinstance(contents, str):
+        return len(contents)
+    return sum(
+        len(part.get('text') or '')
+        for content in contents if isinstance(content, dict)
+        for part in content.get('parts', ()) if isinstance(part, dict)
+    )
+
+
+# One preconfigured model per use. Uses without a generation config return plain text.
+GEMINI_USE_CONFIGS = {
+    'chat': None,
+    'humor': _json_config(HUMOR_SCHEMA),
+    'meme': _json_config(MEME_SCHEMA),
+    'roast': None,
+    'advice': None,
+    'task': _json_config(TITLE_DESCRIPTION_SCHEMA),
+    'achievement': _json_config(TITLE_DESCRIPTION_SCHEMA),
+    'summary': None,
+    # Batched variants used to refill the content pools: the same schemas, as arrays.
+    'roast_batch': _json_config(_array_of({"type": "STRING"})),
+    'advice_batch': _json_config(_array_of({"type": "STRING"})),
+    'task_batch': _json_config(_array_of(TITLE_DESCRIPTION_SCHEMA)),
+    'achievement_batch': _json_config(_array_of(TITLE_DESCRIPTION_SCHEMA)),
+    'meme_batch': _json_config(_array_of(MEME_SCHEMA)),
+}
+
+
+class GeminiOverloadedError(Exception):
+    """Raised when a call cannot be admitted within the gateway's queue limits."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_gemini_failure(error):
+    """Local admission errors and requests Gemini rejects as invalid do not count against it."""
+    return not isinstance(error, (GeminiOverloadedError, HedgeUnavailable)) and type(error).__name__ != 'InvalidArgument'
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, deadline):
+        """Takes one token, sleeping until one is available. Returns False at the deadline."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class _UseStats:
+    __slots__ = ('calls', 'errors', 'rejected', 'queue_ms_total', 'queue_ms_max', 'upstream_ms_total', 'upstream_ms_max')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+        self.queue_ms_total = 0.0
+        self.queue_ms_max = 0.0
+        self.upstream_ms_total = 0.0
+        self.upstream_ms_max = 0.0
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'rejected': self.rejected,
+            'avg_queue_ms': round(self.queue_ms_total / self.calls, 2) if self.calls else 0.0,
+            'max_queue_ms': round(self.queue_ms_max, 2),
+            'avg_upstream_ms': round(self.upstream_ms_total / self.calls, 2) if self.calls else 0.0,
+            'max_upstream_ms': round(self.upstream_ms_max, 2),
+        }
+
+
+class GeminiGateway:
+    """
+    Single entry point for every Gemini call. Owns one preconfigured GenerativeModel per
+    use, enforces a global concurrency cap and a token-bucket rate limit, and bounds how
+    many callers may wait for admission; anything beyond that fails fast with
+    GeminiOverloadedError instead of piling up 429s upstream.
+
+    Non-streamed calls are hedged per use (see hedging.Hedger): a slow call gets a second
+    attempt, on hedge_model_name if configured, but only when a slot and a rate token
+    are free right away, so hedges never queue behind or displace first attempts.
+    While the circuit breaker is open every call fails fast with GeminiOverloadedError.
+    """
+
+    def __init__(self, model_name='gemini-1.5-flash', max_concurrency=8, requests_per_minute=600,
+                 burst=10, max_waiting=32, queue_timeout=10.0, use_configs=None, hedge_model_name=None,
+                 hedger_factory=None, breaker=None):
+        # Imported here so importing this module (e.g. for GeminiOverloadedError) stays cheap.
+        import google.generativeai as genai
+
+        use_configs = GEMINI_USE_CONFIGS if use_configs is None else use_configs
+        self.model_name = model_name
+        self.models = {
+            use: genai.GenerativeModel(model_name, generation_config=config)
+            for use, config in use_configs.items()
+        }
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.bucket = TokenBucket(requests_per_minute / 60.0, burst)
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+        self.stats = {use: _UseStats() for use in self.models}
+        self.hedge_model_name = hedge_model_name
+        self.hedge_models = {
+            use: genai.GenerativeModel(hedge_model_name, generation_config=config)
+            for use, config in use_configs.items()
+        } if hedge_model_name else self.models
+        hedger_factory = hedger_factory or (lambda use: Hedger(f"gemini-{use}", enabled=False))
+        self.hedgers = {use: hedger_factory(use) for use in self.models}
+        self.breaker = breaker or CircuitBreaker('gemini', is_failure=is_gemini_failure)
+
+    @classmethod
+    def from_env(cls):
+        hedge_executor = ThreadPoolExecutor(max_workers=int(os.getenv("GEMINI_HEDGE_WORKERS", "64")), thread_name_prefix="hedge-gemini")
+        return cls(
+            model_name=os.getenv("GEMINI_MODEL", "gemini-1.5-flash"),
+            max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")),
+            requests_per_minute=float(os.getenv("GEMINI_RPM", "600")),
+            burst=int(os.getenv("GEMINI_BURST", "10")),
+            max_waiting=int(os.getenv("GEMINI_MAX_QUEUE", "32")),
+            queue_timeout=float(os.getenv("GEMINI_QUEUE_TIMEOUT", "10")),
+            hedge_model_name=os.getenv("GEMINI_HEDGE_MODEL") or None,
+            hedger_factory=lambda use: Hedger.from_env(f"gemini-{use}", "GEMINI", executor=hedge_executor),
+            breaker=CircuitBreaker.from_env('gemini', "GEMINI", slow_call_seconds=20.0, is_failure=is_gemini_failure),
+        )
+
+    def _admit(self, use, wait=True):
+        stats = self.stats[use]
+        if not wait:
+            # Hedge attempts: admitted only if capacity is free right now. The slot is
+            # checked first so a hedge that cannot run never spends a rate token.
+            if not self.slots.acquire(blocking=False):
+                raise HedgeUnavailable("No free Gemini slot for a hedge.")
+            if not self.bucket.acquire(time.monotonic()):
+                self.slots.release()
+                raise HedgeUnavailable("No Gemini rate budget for a hedge.")
+            with self.lock:
+                self.in_flight += 1
+            return 0.0
+        with self.lock:
+            if self.waiting >= self.max_waiting:
+                stats.rejected += 1
+                raise GeminiOverloadedError("Gemini request queue is full. Try again shortly.")
+            self.waiting += 1
+
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        admitted = False
+        try:
+            if self.bucket.acquire(deadline):
+                admitted = self.slots.acquire(timeout=max(0.0, deadline - time.monotonic()))
+        finally:
+            with self.lock:
+                self.waiting -= 1
+                if admitted:
+                    self.in_flight += 1
+                else:
+                    stats.rejected += 1
+
+        if not admitted:
+            raise GeminiOverloadedError("Timed out waiting for Gemini capacity. Try again shortly.")
+        return (time.monotonic() - started) * 1000
+
+    def _release(self, use, queue_ms, upstream_started, failed):
+        upstream_ms = (time.monotonic() - upstream_started) * 1000
+        self.slots.release()
+        with self.lock:
+            self.in_flight -= 1
+            stats = self.stats[use]
+            stats.calls += 1
+            stats.errors += 1 if failed else 0
+            stats.queue_ms_total += queue_ms
+            stats.queue_ms_max = max(stats.queue_ms_max, queue_ms)
+            stats.upstream_ms_total += upstream_ms
+            stats.upstream_ms_max = max(stats.upstream_ms_max, upstream_ms)
+
+    def generate(self, use, contents, stream=False, **kwargs):
+        """
+        generate_content() on the model preconfigured for `use`. With stream=True this
+        returns an iterator of response chunks that holds its concurrency slot until
+        the stream is exhausted or closed; streams are not hedged.
+        """
+        model = self.models[use]
+        prompt_chars.observe(_prompt_chars(contents), use)
+        try:
+            circuit_started = self.breaker.before()
+        except CircuitOpenError as e:
+            raise GeminiOverloadedError(str(e), retry_after=max(1, round(e.retry_after)))
+
+        error = None
+        try:
+            if stream:
+                with stage('gemini_queue'):
+                    queue_ms = self._admit(use)
+                return self._stream(use, model, contents, queue_ms, time.monotonic(), kwargs, circuit_started)
+            return self.hedgers[use].call(
+                lambda: self._generate_once(use, model, contents, kwargs),
+                lambda: self._generate_once(use, self.hedge_models[use], contents, kwargs, hedge=True),
+            )
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # A returned stream reports its own outcome when it finishes.
+            if not stream or error is not None:
+                self.breaker.after(circuit_started, error)
+
+    def _generate_once(self, use, model, contents, kwargs, hedge=False):
+        if hedge:
+            queue_ms = self._admit(use, wait=False)
+        else:
+            with stage('gemini_queue'):
+                queue_ms = self._admit(use)
+        upstream_started = time.monotonic()
+        failed = True
+        try:
+            with stage(f'gemini_{use}', upstream='gemini'):
+                response = model.generate_content(contents, **kwargs)
+            failed = False
+            return response
+        finally:
+            self._release(use, queue_ms, upstream_started, failed)
+
+    def _stream(self, use, model, contents, queue_ms, upstream_started, kwargs, circuit_started):
+        failed = True
+        error = None
+        try:
+            with stage(f'gemini_{use}_stream', upstream='gemini'):
+                for chunk in model.generate_content(contents, stream=True, **kwargs):
+                    yield chunk
+            failed = False
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._release(use, queue_ms, upstream_started, failed)
+            self.breaker.after(circuit_started, error)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'model': self.model_name,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'hedge_model': self.hedge_model_name,
+                'uses': {use: stats.as_dict() for use, stats in self.stats.items()},
+            }
+
+    def hedge_snapshot(self):
+        return {use: hedger.snapshot() for use, hedger in self.hedgers.items()}
@@ -0,0 +1,22 @@
+import os
+
+# Pre-fork serving for wsgi:app. The app is imported once in the master (preload_app) so
+# workers share its pages copy-on-write; SDK clients are created lazily in each worker.
+bind = f"0.0.0.0:{os.getenv('PORT', '5002')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# Threaded workers: SSE streams and TTS fan-out hold a thread each for the whole request.
+worker_class = "gthread"
+threads = int(os.getenv("WORKER_THREADS", "8"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+
+
+def post_fork(server, worker):
+    # STARTUP_EAGER_INIT=1 trades a slower worker boot for no first-request init latency.
+    if os.getenv("STARTUP_EAGER_INIT") == "1":
+        from startup import warm_up, startup_report
+        warm_up()
+        server.log.info(startup_report.summary())
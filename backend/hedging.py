@@ -0,0 +1,170 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class HedgeUnavailable(Exception):
+    """Raised by a hedge attempt that cannot start right now (e.g. no spare upstream capacity)."""
+
+
+class LatencyWindow:
+    """Most recent attempt latencies; percentiles are recomputed every few samples, not per call."""
+
+    def __init__(self, size=500, recompute_every=20):
+        self.samples = deque(maxlen=size)
+        self.recompute_every = recompute_every
+        self.lock = threading.Lock()
+        self.sorted = []
+        self.since_sort = 0
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+            self.since_sort += 1
+
+    def percentile(self, fraction):
+        with self.lock:
+            if self.since_sort and (self.since_sort >= self.recompute_every or len(self.sorted) < 100):
+                self.sorted = sorted(self.samples)
+                self.since_sort = 0
+            if not self.sorted:
+                return None
+            return self.sorted[min(len(self.sorted) - 1, int(fraction * len(self.sorted)))]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class Hedger:
+    """
+    Hedged calls: call(primary, hedge) runs primary() and, if it has not answered within
+    the `percentile` of recently observed attempt latencies, starts hedge() (the same call,
+    or one against an alternate model/endpoint) and returns whichever succeeds first.
+    The loser is cancelled if it has not started; a call already on the wire cannot be
+    interrupted, so its result is discarded and it is counted as wasted.
+
+    Hedges are capped by a token budget: every call earns `budget` tokens (up to
+    `burst`), every hedge spends one, so at most about budget x calls are hedged even
+    when the upstream is slow across the board. A hedge that raises HedgeUnavailable is
+    refunded and the primary is awaited alone.
+    """
+
+    def __init__(self, name, percentile=0.95, budget=0.05, burst=5.0, min_delay=0.05, max_delay=5.0,
+                 initial_delay=1.0, min_samples=20, window=500, max_workers=64, enabled=True, executor=None):
+        self.name = name
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.enabled = enabled
+        self.latencies = LatencyWindow(window)
+        # Both attempts run on pool threads so the caller can return as soon as either answers.
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"hedge-{name}")
+        self.lock = threading.Lock()
+        self.tokens = burst
+        self.stats = {'calls': 0, 'hedged': 0, 'hedge_won': 0, 'wasted': 0, 'budget_denied': 0, 'hedge_unavailable': 0}
+
+    @classmethod
+    def from_env(cls, name, prefix, executor=None):
+        return cls(
+            name,
+            executor=executor,
+            percentile=float(os.getenv(f"{prefix}_HEDGE_PERCENTILE", "0.95")),
+            budget=float(os.getenv(f"{prefix}_HEDGE_BUDGET", "0.05")),
+            burst=float(os.getenv(f"{prefix}_HEDGE_BURST", "5")),
+            min_delay=float(os.getenv(f"{prefix}_HEDGE_MIN_DELAY_MS", "50")) / 1000.0,
+            max_delay=float(os.getenv(f"{prefix}_HEDGE_MAX_DELAY_MS", "5000")) / 1000.0,
+            initial_delay=float(os.getenv(f"{prefix}_HEDGE_INITIAL_DELAY_MS", "1000")) / 1000.0,
+            max_workers=int(os.getenv(f"{prefix}_HEDGE_WORKERS", "64")),
+            enabled=os.getenv(f"{prefix}_HEDGE_ENABLED", "1") == "1",
+        )
+
+    def _count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def hedge_delay(self):
+        observed = self.latencies.percentile(self.percentile) if len(self.latencies) >= self.min_samples else None
+        if observed is None:
+            return self.initial_delay
+        return min(self.max_delay, max(self.min_delay, observed))
+
+    def _earn(self):
+        with self.lock:
+            self.stats['calls'] += 1
+            self.tokens = min(self.burst, self.tokens + self.budget)
+
+    def _spend(self):
+        with self.lock:
+            if self.tokens < 1:
+                self.stats['budget_denied'] += 1
+                return False
+            self.tokens -= 1
+            return True
+
+    def _refund(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+    def _submit(self, fn):
+        started = time.perf_counter()
+        future = self.executor.submit(contextvars.copy_context().run, fn)
+
+        def observe(done):
+            # Every finished attempt counts, including abandoned ones, so slow calls are not hidden.
+            if not done.cancelled() and not isinstance(done.exception(), HedgeUnavailable):
+                self.latencies.add(time.perf_counter() - started)
+
+        future.add_done_callback(observe)
+        return future
+
+    def call(self, primary, hedge=None):
+        if not self.enabled:
+            return primary()
+        self._earn()
+        first = self._submit(primary)
+        done, _ = wait([first], timeout=self.hedge_delay())
+        if done or not self._spend():
+            return first.result()
+
+        second = self._submit(hedge or primary)
+        pending = {first, second}
+        hedged = True
+        error = None
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    failure = future.exception()
+                    if failure is None:
+                        if hedged and future is second:
+                            self._count('hedge_won')
+                        for loser in pending:
+                            if not loser.cancel():
+                                self._count('wasted')
+                        return future.result()
+                    if isinstance(failure, HedgeUnavailable):
+                        hedged = False
+                        self._refund()
+                        self._count('hedge_unavailable')
+                    elif future is first or error is None:
+                        error = failure
+            raise error
+        finally:
+            if hedged:
+                self._count('hedged')
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['tokens'] = round(self.tokens, 2)
+        stats['enabled'] = self.enabled
+        stats['hedge_delay_ms'] = round(self.hedge_delay() * 1000, 1)
+        stats['samples'] = len(self.latencies)
+        return stats
@@ -0,0 +1,175 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from structured_log import get_logger
+
+log = get_logger('history')
+
+
+# Rough Gemini tokenizer ratios: Roman-script text runs about four characters per token,
+# Devanagari (and other non-ASCII text) about two.
+ASCII_CHARS_PER_TOKEN = 4
+NON_ASCII_CHARS_PER_TOKEN = 2
+TURN_OVERHEAD_TOKENS = 4
+
+SUMMARY_PREFIX = "Summary of the earlier conversation (older turns, condensed): "
+
+
+def estimate_tokens(text):
+    """Fast local token estimate for mixed Roman/Devanagari text. No tokenizer round trip."""
+    if not text:
+        return 0
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    non_ascii_chars = len(text) - ascii_chars
+    return -(-ascii_chars // ASCII_CHARS_PER_TOKEN) + -(-non_ascii_chars // NON_ASCII_CHARS_PER_TOKEN)
+
+
+def turn_text(turn):
+    return "".join(part.get('text') or "" for part in turn.get('parts', []))
+
+
+def _digest(turns):
+    digest = hashlib.sha256()
+    for turn in turns:
+        digest.update(turn.get('role', '').encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(turn_text(turn).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class _Window:
+    __slots__ = ('split', 'digest', 'summary')
+
+    def __init__(self, split, digest, summary):
+        self.split = split
+        self.digest = digest
+        self.summary = summary
+
+
+class HistoryCompactor:
+    """
+    Keeps the chat history sent to Gemini within token_budget (estimated). The newest
+    turns are kept verbatim; once they no longer fit, the window moves forward so only
+    recent_tokens' worth of turns stays verbatim and everything older is folded into a
+    rolling summary by summarize(previous_summary, turns). The summary and the window
+    position are cached per user, so the summary is only regenerated when the window
+    moves, not on every request.
+    """
+
+    def __init__(self, summarize, token_budget=2000, recent_tokens=None, min_recent_turns=2, max_users=10000):
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.recent_tokens = recent_tokens if recent_tokens is not None else token_budget // 2
+        self.min_recent_turns = min_recent_turns
+        self.max_users = max_users
+        self.windows = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'compacted_requests': 0,
+            'summaries_generated': 0,
+            'summary_errors': 0,
+            'history_tokens': 0,
+            'sent_tokens': 0,
+            'saved_tokens': 0,
+        }
+
+    @classmethod
+    def from_env(cls, summarize):
+        token_budget = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+        recent_tokens = os.getenv("HISTORY_RECENT_TOKENS")
+        return cls(
+            summarize,
+            token_budget=token_budget,
+            recent_tokens=int(recent_tokens) if recent_tokens else None,
+            min_recent_turns=int(os.getenv("HISTORY_MIN_RECENT_TURNS", "2")),
+            max_users=int(os.getenv("HISTORY_SUMMARY_MAX_USERS", "10000")),
+        )
+
+    def _cached_window(self, key, turns):
+        with self.lock:
+            window = self.windows.get(key)
+            if window is not None:
+                self.windows.move_to_end(key)
+        if window is None or window.split > len(turns):
+            return None
+        # The client resends the whole history; only reuse the summary if the folded
+        # turns are still the same ones (same session, nothing edited).
+        if _digest(turns[:window.split]) != window.digest:
+            return None
+        return window
+
+    def _store_window(self, key, window):
+        with self.lock:
+            self.windows[key] = window
+            self.windows.move_to_end(key)
+            while len(self.windows) > self.max_users:
+                self.windows.popitem(last=False)
+
+    def _new_split(self, costs, split):
+        i = len(costs)
+        kept = 0
+        while i > split and (len(costs) - i < self.min_recent_turns or kept + costs[i - 1] <= self.recent_tokens):
+            kept += costs[i - 1]
+            i -= 1
+        return i
+
+    def compact(self, key, turns):
+        """
+        Returns (turns_to_send, report). report has the estimated history tokens before
+        and after compaction, the tokens saved, and how many turns were summarized.
+        """
+        costs = [estimate_tokens(turn_text(turn)) + TURN_OVERHEAD_TOKENS for turn in turns]
+        history_tokens = sum(costs)
+        if history_tokens <= self.token_budget:
+            return turns, self._report(history_tokens, history_tokens, 0)
+
+        window = self._cached_window(key, turns)
+        split, summary = (window.split, window.summary) if window else (0, "")
+
+        if sum(costs[split:]) > self.token_budget:
+            new_split = self._new_split(costs, split)
+            if new_split > split:
+                try:
+                    summary = self.summarize(summary, turns[split:new_split])
+                    self._count('summaries_generated')
+                    self._store_window(key, _Window(new_split, _digest(turns[:new_split]), summary))
+                except Exception as e:
+                    # Still send a bounded prompt; the summary is retried on the next request.
+                    log.warning("Failed to summarize older chat turns.", turns=new_split - split, error=str(e))
+                    self._count('summary_errors')
+                split = new_split
+
+        compacted = list(turns[split:])
+        if summary:
+            compacted.insert(0, {'role': 'user', 'parts': [{'text': SUMMARY_PREFIX + summary}]})
+        sent_tokens = sum(costs[split:]) + (estimate_tokens(SUMMARY_PREFIX + summary) + TURN_OVERHEAD_TOKENS if summary else 0)
+        return compacted, self._report(history_tokens, sent_tokens, split)
+
+    def _count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def _report(self, history_tokens, sent_tokens, summarized_turns):
+        saved_tokens = max(0, history_tokens - sent_tokens)
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['compacted_requests'] += 1 if summarized_turns else 0
+            self.stats['history_tokens'] += history_tokens
+            self.stats['sent_tokens'] += sent_tokens
+            self.stats['saved_tokens'] += saved_tokens
+        return {
+            'history_tokens': history_tokens,
+            'sent_tokens': sent_tokens,
+            'saved_tokens': saved_tokens,
+            'summarized_turns': summarized_turns,
+        }
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['users'] = len(self.windows)
+            return stats
@@ -0,0 +1,231 @@
+import os
+import re
+import time
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import CircuitBreaker
+from metrics import stage
+from structured_log import get_logger
+
+
+log = get_logger('image_search')
+
+PEXELS_SEARCH_URL = "https://api.pexels.com/v1/search"
+BING_IMAGE_SEARCH_URL = "https://api.bing.microsoft.com/v7.0/images/search"
+
+_MISS = object()
+
+
+def normalize_query(query):
+    return re.sub(r'\s+', ' ', query).strip().lower()
+
+
+def _pexels_image(results):
+    photos = results.get('photos')
+    return photos[0]['src']['large'] if photos else None
+
+
+def _bing_image(results):
+    values = results.get('value')
+    return values[0]['contentUrl'] if values else None
+
+
+class ImageProvider:
+    """One image search API: how to query it and where the image URL is in its answer."""
+
+    def __init__(self, name, url, headers, params, extract, breaker=None):
+        self.name = name
+        self.url = url
+        self.headers = headers
+        self.params = params
+        self.extract = extract
+        self.breaker = breaker or CircuitBreaker(name)
+
+
+class _ProviderStats:
+    __slots__ = ('calls', 'wins', 'empty', 'errors', 'latency_ms_total', 'latency_ms_max')
+
+    def __init__(self):
+        self.calls = 0
+        self.wins = 0
+        self.empty = 0
+        self.errors = 0
+        self.latency_ms_total = 0.0
+        self.latency_ms_max = 0.0
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'wins': self.wins,
+            'win_rate': round(self.wins / self.calls, 3) if self.calls else 0.0,
+            'empty': self.empty,
+            'errors': self.errors,
+            'avg_latency_ms': round(self.latency_ms_total / self.calls, 2) if self.calls else 0.0,
+            'max_latency_ms': round(self.latency_ms_max, 2),
+        }
+
+
+class ImageSearch:
+    """
+    Image search for meme queries. Every configured provider is queried at once and the
+    first one to return an image wins; providers still pending are cancelled if they have
+    not started, otherwise their answer is ignored. Results are cached per normalized
+    query in an LRU of at most cache_size entries for cache_ttl seconds. A query that
+    every provider answered with no image is cached as None for negative_ttl seconds;
+    errors and timeouts are never cached.
+    """
+
+    def __init__(self, providers, timeout=8.0, cache_size=2000, cache_ttl=3600.0, negative_ttl=300.0,
+                 max_workers=16, pool_size=16):
+        self.providers = providers
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.negative_ttl = negative_ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-search")
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()  # normalized query -> (expires_at, image_url or None)
+        self.stats = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'expired': 0, 'no_result': 0}
+        self.provider_stats = {provider.name: _ProviderStats() for provider in providers}
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(providers) or 1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @classmethod
+    def from_env(cls):
+        providers = []
+        pexels_key = os.getenv('PEXELS_API_KEY')
+        if pexels_key:
+            providers.append(ImageProvider(
+                'pexels',
+                os.getenv("PEXELS_SEARCH_URL", PEXELS_SEARCH_URL),
+                {"Authorization": pexels_key},
+                lambda query: {"query": query, "per_page": 1, "orientation": "landscape"},
+                _pexels_image,
+                CircuitBreaker.from_env('pexels', "PEXELS", slow_call_seconds=3.0),
+            ))
+        bing_key = os.getenv('BING_IMAGE_SEARCH_KEY')
+        if bing_key:
+            providers.append(ImageProvider(
+                'bing',
+                os.getenv("BING_IMAGE_SEARCH_URL", BING_IMAGE_SEARCH_URL),
+                {"Ocp-Apim-Subscription-Key": bing_key},
+                lambda query: {"q": query, "count": 1, "safeSearch": "Strict"},
+                _bing_image,
+                CircuitBreaker.from_env('bing', "BING", slow_call_seconds=3.0),
+            ))
+        return cls(
+            providers,
+            timeout=float(os.getenv("IMAGE_SEARCH_TIMEOUT", "8")),
+            cache_size=int(os.getenv("IMAGE_SEARCH_CACHE_SIZE", "2000")),
+            cache_ttl=float(os.getenv("IMAGE_SEARCH_CACHE_TTL", "3600")),
+            negative_ttl=float(os.getenv("IMAGE_SEARCH_NEGATIVE_TTL", "300")),
+            max_workers=int(os.getenv("IMAGE_SEARCH_WORKERS", "16")),
+        )
+
+    def _cached(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return _MISS
+            if time.monotonic() > entry[0]:
+                del self.cache[key]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return _MISS
+            self.cache.move_to_end(key)
+            self.stats['hits' if entry[1] else 'negative_hits'] += 1
+            return entry[1]
+
+    def _store(self, key, image_url):
+        ttl = self.cache_ttl if image_url else self.negative_ttl
+        with self.lock:
+            self.cache[key] = (time.monotonic() + ttl, image_url)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def search(self, query):
+        """Returns an image URL for query, or None if no provider has one right now."""
+        key = normalize_query(query)
+        image_url = self._cached(key)
+        if image_url is not _MISS:
+            return image_url
+        image_url, conclusive = self._race(query)
+        if image_url or conclusive:
+            self._store(key, image_url)
+        if not image_url:
+            with self.lock:
+                self.stats['no_result'] += 1
+        return image_url
+
+    def _race(self, query):
+        """Returns (image_url, conclusive); conclusive is False if any provider failed or timed out."""
+        providers = [provider for provider in self.providers if provider.breaker.allows_calls]
+        if not providers:
+            return None, False
+        futures = {
+            self.executor.submit(contextvars.copy_context().run, self._query, provider, query): provider
+            for provider in providers
+        }
+        pending = set(futures)
+        conclusive = len(providers) == len(self.providers)
+        deadline = time.monotonic() + self.timeout
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+                if not done:
+                    return None, False
+                for future in done:
+                    try:
+                        image_url = future.result()
+                    except Exception as e:
+                        log.warning("Image search provider failed.", provider=futures[future].name, error=str(e))
+                        conclusive = False
+                        continue
+                    if image_url:
+                        with self.lock:
+                            self.provider_stats[futures[future].name].wins += 1
+                        return image_url, True
+            return None, conclusive
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _query(self, provider, query):
+        started = time.monotonic()
+        image_url = None
+        failed = True
+        try:
+            with provider.breaker.guard(), stage(provider.name):
+                response = self.session.get(provider.url, headers=provider.headers, params=provider.params(query), timeout=self.timeout)
+                response.raise_for_status()
+            image_url = provider.extract(response.json())
+            failed = False
+            return image_url
+        finally:
+            latency_ms = (time.monotonic() - started) * 1000
+            with self.lock:
+                stats = self.provider_stats[provider.name]
+                stats.calls += 1
+                stats.errors += 1 if failed else 0
+                stats.empty += 1 if not failed and not image_url else 0
+                stats.latency_ms_total += latency_ms
+                stats.latency_ms_max = max(stats.latency_ms_max, latency_ms)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                **self.stats,
+                'entries': len(self.cache),
+                'providers': {name: stats.as_dict() for name, stats in self.provider_stats.items()},
+            }
@@ -0,0 +1,184 @@
+import re
+
+
+_STAR_EMPHASIS_RE = re.compile(r'\*([^\*]+)\*')
+_UNDERSCORE_EMPHASIS_RE = re.compile(r'\_([^\_]+)\_')
+_HEADING_RE = re.compile(r'^\s*#+\s*', re.MULTILINE)
+_BULLET_RE = re.compile(r'^\s*[-*]\s*', re.MULTILINE)
+# Anything the heading/bullet patterns cannot consume. Once a line contains one of these,
+# nothing at or after it on that line can be touched by those patterns.
+_CONTENT_CHAR_RE = re.compile(r'[^\s#*-]')
+
+
+def _first_group(match):
+    # Cheaper than expanding an r'\1' template on every match.
+    return match.group(1)
+
+
+def _strip_line_markers(text):
+    if '#' in text:
+        text = _HEADING_RE.sub('', text)
+    if '-' in text or '*' in text:
+        text = _BULLET_RE.sub('', text)
+    return text
+
+
+def clean_markdown(text):
+    """
+    Strips *emphasis*, _emphasis_, heading and bullet markers, then collapses blank lines
+    and trims every line. Patterns are precompiled and each one is skipped when the
+    character it needs is absent, which is the common case for short replies.
+    """
+    if '*' in text:
+        text = _STAR_EMPHASIS_RE.sub(_first_group, text)
+    if '_' in text:
+        text = _UNDERSCORE_EMPHASIS_RE.sub(_first_group, text)
+    text = _strip_line_markers(text)
+    if '\n' not in text:
+        return text.strip()
+    return "\n".join([line.strip() for line in text.split('\n') if line]).strip()
+
+
+class _DelimiterPairs:
+    """
+    Streaming form of the emphasis substitution for one delimiter: pairs are removed left
+    to right, a delimiter directly followed by another is kept, and an unpaired delimiter
+    is held back (with everything after it) until its partner or the end arrives.
+    """
+
+    def __init__(self, delimiter):
+        self.delimiter = delimiter
+        self.held = ""
+
+    def feed(self, text):
+        delimiter = self.delimiter
+        if self.held and delimiter not in text:
+            self.held += text
+            return ""
+        buf = self.held + text
+        self.held = ""
+        if delimiter not in buf:
+            return buf
+
+        out = []
+        pos = 0
+        while True:
+            i = buf.find(delimiter, pos)
+            if i == -1:
+                out.append(buf[pos:])
+                break
+            j = buf.find(delimiter, i + 1)
+            if j == -1:
+                out.append(buf[pos:i])
+                self.held = buf[i:]
+                break
+            if j == i + 1:
+                # Empty span: this delimiter stays and the next one becomes the opener.
+                out.append(buf[pos:j])
+                pos = j
+            else:
+                out.append(buf[pos:i])
+                out.append(buf[i + 1:j])
+                pos = j + 1
+        return "".join(out)
+
+    def finish(self):
+        held, self.held = self.held, ""
+        return held
+
+
+class _LineAssembler:
+    """
+    Streaming form of the heading/bullet stripping and blank-line handling. Input is cut
+    only at points no later marker can reach back across (after a content character of
+    the current line); the text after the last such point is held back.
+    """
+
+    def __init__(self):
+        self.pending = ""
+        self.mid_line = False  # pending starts after a content character of its line
+        self.emitted = False
+        self.blank_lines = 0
+        self.line_has_content = False
+        self.line_nonempty = False
+        self.trailing_ws = ""
+
+    def _cut(self):
+        buf = self.pending
+        end = len(buf)
+        while end > 0:
+            nl = buf.rfind('\n', 0, end)
+            if _CONTENT_CHAR_RE.search(buf, nl + 1, end) or (nl == -1 and self.mid_line):
+                return end
+            end = nl
+        return 0
+
+    def feed(self, text, final=False):
+        self.pending += text
+        cut = len(self.pending) if final else self._cut()
+        if not cut:
+            return ""
+        segment, self.pending = self.pending[:cut], self.pending[cut:]
+        if self.mid_line:
+            # The leading character stands in for the content already seen on this line,
+            # so the segment start is not treated as a line start.
+            segment = _strip_line_markers('x' + segment)[1:]
+        else:
+            segment = _strip_line_markers(segment)
+        self.mid_line = True
+        return self._assemble(segment)
+
+    def _end_line(self):
+        if self.line_nonempty and not self.line_has_content:
+            self.blank_lines += 1
+        self.line_has_content = False
+        self.line_nonempty = False
+        self.trailing_ws = ""
+
+    def _assemble(self, text):
+        out = []
+        for n, part in enumerate(text.split('\n')):
+            if n:
+                self._end_line()
+            if not part:
+                continue
+            self.line_nonempty = True
+            if self.line_has_content:
+                part = self.trailing_ws + part
+            else:
+                part = part.lstrip()
+                if not part:
+                    continue
+                # Whitespace-only lines between two content lines survive as empty lines;
+                # those before the first content line are trimmed away.
+                if self.emitted:
+                    out.append('\n' * (self.blank_lines + 1))
+                self.emitted = True
+                self.blank_lines = 0
+                self.line_has_content = True
+            body = part.rstrip()
+            self.trailing_ws = part[len(body):]
+            out.append(body)
+        return "".join(out)
+
+
+class IncrementalMarkdownCleaner:
+    """
+    clean_markdown() for streamed text. feed() takes raw chunks and returns whatever
+    cleaned text is already final; finish() returns the rest. The concatenated output
+    is identical to clean_markdown() of the concatenated input. Only an unresolved
+    '*'/'_' span, a line that so far holds nothing but markers or whitespace, and
+    trailing whitespace are held back.
+    """
+
+    def __init__(self):
+        self.stars = _DelimiterPairs('*')
+        self.underscores = _DelimiterPairs('_')
+        self.lines = _LineAssembler()
+
+    def feed(self, chunk):
+        return self.lines.feed(self.underscores.feed(self.stars.feed(chunk)))
+
+    def finish(self):
+        text = self.underscores.feed(self.stars.finish()) + self.underscores.finish()
+        return self.lines.feed(text, final=True)
@@ -0,0 +1,256 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+
+# Seconds for latencies, bytes/characters for payload sizes.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Family:
+    kind = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.children = {}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            children = {labels: self._copy(child) for labels, child in self.children.items()}
+        for labels, child in children.items():
+            lines.extend(self._render_child(labels, child))
+        return lines
+
+    def _copy(self, child):
+        return child[0]
+
+    def _render_child(self, labels, value):
+        return [f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"]
+
+
+class Counter(_Family):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            child = self.children.get(labels)
+            if child is None:
+                child = self.children[labels] = [0]
+            child[0] += amount
+
+
+class Gauge(_Family):
+    kind = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            child = self.children.get(labels)
+            if child is None:
+                child = self.children[labels] = [0]
+            child[0] += amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Family):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            child = self.children.get(labels)
+            if child is None:
+                # Per-bucket (non-cumulative) counts, the +Inf bucket last, then the sum.
+                child = self.children[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            child[index] += 1
+            child[-1] += value
+
+    def _copy(self, child):
+        return list(child)
+
+    def _render_child(self, labels, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), child):
+            cumulative += count
+            le = 'le="' + _format_value(float(bound)) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+        label_text = _format_labels(self.label_names, labels)
+        lines.append(f"{self.name}_sum{label_text} {_format_value(round(child[-1], 6))}")
+        lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    In-process metric families rendered in the Prometheus text format. Collectors are
+    callables returning [(name, kind, help, [(labels_dict, value), ...])] and are read at
+    render time, for values that other components already track (queue depths and the like).
+    Metrics are per process: under a pre-fork server each worker reports its own series.
+    """
+
+    def __init__(self, prefix='brocodeai'):
+        self.prefix = prefix
+        self.families = []
+        self.collectors = []
+
+    def _add(self, family):
+        self.families.append(family)
+        return family
+
+    def counter(self, name, help_text, label_names=()):
+        return self._add(Counter(f"{self.prefix}_{name}", help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._add(Gauge(f"{self.prefix}_{name}", help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(f"{self.prefix}_{name}", help_text, label_names, buckets))
+
+    def add_collector(self, collect):
+        self.collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for family in self.families:
+            lines.extend(family.render())
+        for collect in self.collectors:
+            try:
+                collected = collect()
+            except Exception:
+                continue
+            for name, kind, help_text, samples in collected:
+                name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    label_text = _format_labels(labels.keys(), labels.values())
+                    lines.append(f"{name}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+request_duration = registry.histogram(
+    'http_request_duration_seconds', "Time from request start until the response (or stream) finished.",
+    ('endpoint', 'method', 'status'))
+requests_in_flight = registry.gauge(
+    'http_requests_in_flight', "Requests currently being handled.", ('endpoint',))
+response_bytes = registry.histogram(
+    'http_response_bytes', "Size of non-streamed response bodies.", ('endpoint',), SIZE_BUCKETS)
+stage_duration = registry.histogram(
+    'stage_duration_seconds', "Time spent in one stage of a request (upstream call, Firestore read, ...).",
+    ('stage',))
+upstream_errors = registry.counter(
+    'upstream_errors_total', "Failed upstream calls, by upstream and kind (timeout or error).",
+    ('upstream', 'kind'))
+prompt_chars = registry.histogram(
+    'prompt_chars', "Characters sent to Gemini per call.", ('use',), SIZE_BUCKETS)
+audio_bytes = registry.histogram(
+    'audio_bytes', "Size of audio returned by the TTS provider per call.", (), SIZE_BUCKETS)
+
+
+def error_kind(error):
+    name = type(error).__name__
+    return 'timeout' if 'Timeout' in name or 'DeadlineExceeded' in name else 'error'
+
+
+class RequestTimings:
+    """Stage durations for the current request, summarized in its Server-Timing header."""
+
+    __slots__ = ('started', 'stages')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []
+
+    def add(self, name, seconds):
+        # list.append is atomic, so stages running on other threads can report here.
+        self.stages.append((name, seconds))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        totals = {}
+        for name, seconds in list(self.stages):
+            total, count = totals.get(name, (0.0, 0))
+            totals[name] = (total + seconds, count + 1)
+        entries = []
+        for name, (total, count) in totals.items():
+            entry = f"{name};dur={total * 1000:.1f}"
+            if count > 1:
+                entry += f';desc="x{count}"'
+            entries.append(entry)
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def begin_request():
+    timings = RequestTimings()
+    _current_timings.set(timings)
+    return timings
+
+
+def end_request():
+    _current_timings.set(None)
+
+
+def current_timings():
+    return _current_timings.get()
+
+
+@contextmanager
+def stage(name, upstream=None):
+    """
+    Times a block as stage `name`: recorded in the stage histogram and, inside a request,
+    in its Server-Timing header. Exceptions are counted against `upstream` (default: name)
+    and re-raised. Work submitted to other threads keeps the request's timings only if it
+    runs in a copy of the caller's context (submit_stage and the TTS pipeline do).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        upstream_errors.inc(upstream or name, error_kind(e))
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        stage_duration.observe(seconds, name)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add(name, seconds)
@@ -0,0 +1,194 @@
+import os
+import time
+import queue
+import random
+import atexit
+import threading
+
+from google.api_core import exceptions as google_exceptions
+
+from metrics import stage
+from structured_log import get_logger
+
+log = get_logger('firestore')
+
+
+FIRESTORE_MAX_BATCH_WRITES = 500
+
+TRANSIENT_FIRESTORE_ERRORS = (
+    google_exceptions.Aborted,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.TooManyRequests,
+    ConnectionError,
+    TimeoutError,
+)
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    Background Firestore writer. Request handlers enqueue write intents and return
+    immediately; a single worker thread groups them into WriteBatch commits (flushed
+    when max_batch_size is reached or flush_interval has passed since the first pending
+    write) and retries transient failures with jittered exponential backoff.
+    Writes keep their enqueue order.
+    """
+
+    def __init__(self, db, max_batch_size=100, flush_interval=0.2, max_retries=5,
+                 backoff_base=0.2, backoff_max=5.0, max_pending=10000, breaker=None):
+        self.db = db
+        # Commits are never rejected (writes are retried, not dropped); their outcomes
+        # only feed the Firestore breaker that guards request-path reads.
+        self.breaker = breaker
+        self.max_batch_size = min(max_batch_size, FIRESTORE_MAX_BATCH_WRITES)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            'enqueued': 0,
+            'written': 0,
+            'commits': 0,
+            'retries': 0,
+            'failed': 0,
+            'overflow_sync_writes': 0,
+        }
+        self.closed = False
+        self.worker = threading.Thread(target=self._run, name="firestore-write-behind", daemon=True)
+        self.worker.start()
+
+    @classmethod
+    def from_env(cls, db, breaker=None):
+        return cls(
+            db,
+            breaker=breaker,
+            max_batch_size=int(os.getenv("FIRESTORE_BATCH_SIZE", "100")),
+            flush_interval=float(os.getenv("FIRESTORE_FLUSH_INTERVAL", "0.2")),
+            max_retries=int(os.getenv("FIRESTORE_WRITE_RETRIES", "5")),
+            max_pending=int(os.getenv("FIRESTORE_MAX_PENDING_WRITES", "10000")),
+        )
+
+    def _count(self, key, amount=1):
+        with self.stats_lock:
+            self.stats[key] += amount
+
+    def enqueue(self, collection_path, data):
+        """
+        Queues `data` to be written as a new document in `collection_path`.
+        If the queue is full the write is done synchronously so nothing is dropped.
+        """
+        if not self.db:
+            return
+        if self.closed:
+            self._commit([(collection_path, data)])
+            return
+        try:
+            self.pending.put_nowait((collection_path, data))
+            self._count('enqueued')
+        except queue.Full:
+            log.warning("Firestore write-behind queue is full. Writing synchronously.", collection=collection_path)
+            self._count('overflow_sync_writes')
+            self._commit([(collection_path, data)])
+
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        stop = False
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _record(self, started, failed):
+        if self.breaker is not None:
+            self.breaker.record(time.monotonic() - started, failed)
+
+    def _commit(self, writes):
+        # Document ids are generated once, so a retried commit that had in fact landed
+        # overwrites the same documents instead of adding duplicates.
+        refs = [(self.db.collection(collection_path).document(), data) for collection_path, data in writes]
+        for attempt in range(self.max_retries + 1):
+            try:
+                batch = self.db.batch()
+                for ref, data in refs:
+                    batch.set(ref, data)
+                started = time.monotonic()
+                try:
+                    with stage('firestore_commit', upstream='firestore'):
+                        batch.commit()
+                except Exception:
+                    self._record(started, failed=True)
+                    raise
+                self._record(started, failed=False)
+                self._count('commits')
+                self._count('written', len(writes))
+                return True
+            except TRANSIENT_FIRESTORE_ERRORS as e:
+                if attempt == self.max_retries:
+                    log.error("Giving up on Firestore batch.", writes=len(writes), attempts=attempt + 1, error=str(e))
+                    break
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                log.warning("Transient Firestore error committing batch. Retrying.", writes=len(writes), delay=round(delay, 2), error=str(e))
+                self._count('retries')
+                time.sleep(delay)
+            except Exception as e:
+                log.error("Failed to commit Firestore batch.", writes=len(writes), error=str(e))
+                break
+        self._count('failed', len(writes))
+        return False
+
+    def _run(self):
+        while True:
+            first = self.pending.get()
+            if first is _STOP:
+                self.pending.task_done()
+                return
+            writes, stop = self._collect_batch(first)
+            try:
+                self._commit(writes)
+                log.debug("Committed Firestore batch.", writes=len(writes))
+            finally:
+                for _ in range(len(writes) + (1 if stop else 0)):
+                    self.pending.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """Blocks until every write enqueued so far has been committed (or given up on)."""
+        self.pending.join()
+
+    def close(self, timeout=10.0):
+        if self.closed:
+            return
+        self.closed = True
+        self.pending.put(_STOP)
+        self.worker.join(timeout)
+        if self.worker.is_alive():
+            log.warning("Firestore write-behind queue did not drain before shutdown.")
+
+    def snapshot(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['pending'] = self.pending.qsize()
+        return stats
+
+
+def start_write_behind_queue(db, breaker=None):
+    write_queue = WriteBehindQueue.from_env(db, breaker)
+    atexit.register(write_queue.close)
+    return write_queue
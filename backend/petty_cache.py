@@ -0,0 +1,123 @@
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+
+
+PETTY_CONTEXT_DEPTH = 6
+PETTY_CONTEXT_ENTRIES = 5
+
+
+def format_petty_database_context(cleaned_texts):
+    if not cleaned_texts:
+        return ""
+    petty_database_context = "\n\n--- Past User Submissions (for sarcastic recall) ---\n"
+    for i, msg_text in enumerate(cleaned_texts):
+        petty_database_context += f"Past {i+1}: '{msg_text}'\n"
+    petty_database_context += "--- End Past User Submissions ---\n\n"
+    return petty_database_context
+
+
+class _UserEntry:
+    __slots__ = ('messages', 'loaded_at', 'formatted')
+
+    def __init__(self, depth):
+        # Newest first: (raw_text, cleaned_text)
+        self.messages = deque(maxlen=depth)
+        self.loaded_at = time.monotonic()
+        self.formatted = None
+
+
+class PettyContextCache:
+    """
+    Per-user ring buffer of the most recent user messages, used to build the
+    "Past User Submissions" block without a Firestore query on every turn.
+    Users are kept in an LRU of at most max_users entries; an entry is reloaded from
+    Firestore once it is older than ttl seconds, which bounds how stale it can get when
+    the same user chats through another worker.
+    """
+
+    def __init__(self, clean, max_users=10000, ttl=600.0, depth=PETTY_CONTEXT_DEPTH):
+        self.clean = clean
+        self.max_users = max_users
+        self.ttl = ttl
+        self.depth = depth
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0}
+
+    @classmethod
+    def from_env(cls, clean):
+        return cls(
+            clean,
+            max_users=int(os.getenv("PETTY_CACHE_MAX_USERS", "10000")),
+            ttl=float(os.getenv("PETTY_CACHE_TTL", "600")),
+        )
+
+    def _entry(self, key):
+        entry = self.users.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.loaded_at > self.ttl:
+            del self.users[key]
+            self.stats['expired'] += 1
+            return None
+        self.users.move_to_end(key)
+        return entry
+
+    def _context_for(self, entry, user_text):
+        if entry.formatted is None:
+            entry.formatted = format_petty_database_context(
+                [cleaned for _, cleaned in list(entry.messages)[:PETTY_CONTEXT_ENTRIES]]
+            )
+        if not any(raw == user_text for raw, _ in entry.messages):
+            return entry.formatted
+        # The current message is already in the buffer; leave it out, as the Firestore path does.
+        return format_petty_database_context(
+            [cleaned for raw, cleaned in entry.messages if raw != user_text][:PETTY_CONTEXT_ENTRIES]
+        )
+
+    def get_context(self, app_id, user_id, user_text):
+        """Returns the formatted context block, or None on a cache miss."""
+        with self.lock:
+            entry = self._entry((app_id, user_id))
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            return self._context_for(entry, user_text)
+
+    def load(self, app_id, user_id, texts_newest_first, user_text):
+        """
+        Seeds a user's buffer from a Firestore read and returns the context for user_text.
+        Texts must be newest first.
+        """
+        entry = _UserEntry(self.depth)
+        for text in reversed(texts_newest_first[:self.depth]):
+            entry.messages.appendleft((text, self.clean(text)))
+        with self.lock:
+            self.users[(app_id, user_id)] = entry
+            self.users.move_to_end((app_id, user_id))
+            while len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+            return self._context_for(entry, user_text)
+
+    def record_user_message(self, app_id, user_id, text):
+        """
+        Called from the chat write path. Only updates users that are already cached;
+        anyone else is loaded from Firestore on their next turn. A load that ran
+        alongside the write may already have added the message, so it is not added twice.
+        """
+        cleaned = self.clean(text)
+        with self.lock:
+            entry = self.users.get((app_id, user_id))
+            if entry is None or (entry.messages and entry.messages[0][0] == text):
+                return
+            entry.messages.appendleft((text, cleaned))
+            entry.formatted = None
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['users'] = len(self.users)
+            return stats
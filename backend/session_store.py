@@ -0,0 +1,131 @@
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+
+from structured_log import get_logger
+
+log = get_logger('session')
+
+
+class _Session:
+    __slots__ = ('messages', 'seq', 'seen_seq', 'loaded_at')
+
+    def __init__(self, messages, seq, max_messages):
+        # Oldest first: {'sender', 'text', 'seq'}
+        self.messages = deque(messages, maxlen=max_messages)
+        self.seq = seq
+        # Highest seq a client has reported, which may be ahead of both this copy and
+        # Firestore while another worker's appends are still on its write-behind queue.
+        self.seen_seq = 0
+        self.loaded_at = time.monotonic()
+
+    def knows(self, client_seq):
+        return client_seq is None or client_seq <= max(self.seq, self.seen_seq)
+
+
+class SessionStore:
+    """
+    Server-side chat history per (app_id, user_id, session_id), so /chat clients send
+    only the new message and the last sequence number they saw. Sessions live in an LRU
+    hot tier; on a miss, after ttl seconds, or when a client reports a newer sequence
+    number than this worker has (another device or worker appended), the session is
+    reloaded with load_messages(app_id, user_id, session_id, limit), which reads the
+    chatHistory collection (messages there carry session_id and seq).
+    If Firestore has not caught up with the client's sequence number yet, the number is
+    remembered instead of reloading on every turn, and new messages are numbered after it
+    so they never reuse a seq another worker has already handed out.
+    """
+
+    def __init__(self, load_messages, max_sessions=5000, ttl=900.0, max_messages=200):
+        self.load_messages = load_messages
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'reloads': 0, 'load_errors': 0, 'appends': 0}
+
+    @classmethod
+    def from_env(cls, load_messages):
+        return cls(
+            load_messages,
+            max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "5000")),
+            ttl=float(os.getenv("SESSION_TTL", "900")),
+            max_messages=int(os.getenv("SESSION_MAX_MESSAGES", "200")),
+        )
+
+    def _store(self, key, session):
+        self.sessions[key] = session
+        self.sessions.move_to_end(key)
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+
+    def _load(self, key):
+        try:
+            messages = self.load_messages(*key, self.max_messages)
+        except Exception as e:
+            log.error("Failed to load chat session from Firestore.", session_id=key[2], error=str(e))
+            with self.lock:
+                self.stats['load_errors'] += 1
+            return None
+        return _Session(messages, messages[-1]['seq'] if messages else 0, self.max_messages)
+
+    def history(self, app_id, user_id, session_id, client_seq=None):
+        """Returns (seq, messages) for the session, oldest message first."""
+        key = (app_id, user_id, session_id)
+        with self.lock:
+            session = self.sessions.get(key)
+            fresh = session is not None and time.monotonic() - session.loaded_at <= self.ttl
+            if fresh and session.knows(client_seq):
+                self.sessions.move_to_end(key)
+                self.stats['hits'] += 1
+                return session.seq, list(session.messages)
+            self.stats['reloads' if session is not None else 'misses'] += 1
+
+        loaded = self._load(key)
+        with self.lock:
+            current = self.sessions.get(key)
+            # Keep whichever copy is further ahead: writes from this worker may still be on
+            # the write-behind queue and not visible in Firestore yet.
+            if loaded is not None and (current is None or loaded.seq >= current.seq):
+                if current is not None:
+                    loaded.seen_seq = current.seen_seq
+                self._store(key, loaded)
+                current = loaded
+            elif current is not None:
+                current.loaded_at = time.monotonic()
+            if current is None:
+                return 0, []
+            if client_seq is not None:
+                current.seen_seq = max(current.seen_seq, client_seq)
+            return current.seq, list(current.messages)
+
+    def append(self, app_id, user_id, session_id, sender, text, client_seq=None):
+        """
+        Appends a message and returns its sequence number, which is always above
+        client_seq (the last seq the client reported).
+        """
+        key = (app_id, user_id, session_id)
+        with self.lock:
+            cached = key in self.sessions
+        if not cached:
+            # Evicted (or never read): reload first so sequence numbers continue from Firestore.
+            self.history(app_id, user_id, session_id)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = _Session([], 0, self.max_messages)
+                self._store(key, session)
+            if client_seq is not None:
+                session.seen_seq = max(session.seen_seq, client_seq)
+            session.seq = max(session.seq, session.seen_seq) + 1
+            session.messages.append({'sender': sender, 'text': text, 'seq': session.seq})
+            self.stats['appends'] += 1
+            return session.seq
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['sessions'] = len(self.sessions)
+            return stats
@@ -6,6 +6,7 @@ setup(
     install_requires=[
         'flask',
         'flask-cors',
+        'requests',
         'google-cloud-speech',
         'google-cloud-texttospeech',
         'google-generativeai'
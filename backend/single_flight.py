@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: the directory backend is unavailable, in-process coalescing still works.
+    fcntl = None
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DirectoryBackend:
+    """
+    Shares results between worker processes on one host through a directory:
+    one JSON file per key plus an flock()ed lock file, so only one worker generates
+    a given key at a time and the others read its result. Any object with the same
+    get/set/lock methods (e.g. a Redis-backed one) can be plugged in instead.
+    """
+
+    def __init__(self, directory, lock_timeout=30.0):
+        if fcntl is None:
+            raise RuntimeError("DirectoryBackend requires fcntl (POSIX).")
+        self.directory = directory
+        self.lock_timeout = lock_timeout
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, suffix):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{digest}.{suffix}")
+
+    def get(self, key, max_age):
+        path = self._path(key, 'json')
+        try:
+            if time.time() - os.path.getmtime(path) > max_age:
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value):
+        path = self._path(key, 'json')
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def lock(self, key):
+        """Returns an unlock callable, or None if the lock could not be taken in time."""
+        f = open(self._path(key, 'lock'), 'a')
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    f.close()
+                    return None
+                time.sleep(0.05)
+
+        def unlock():
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+        return unlock
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while fn is running for a key, other callers
+    with the same key wait for that result instead of starting their own call, and the
+    result is reused for `freshness` seconds. Errors are shared with the waiters but
+    never cached. With a shared backend the same applies across worker processes.
+    """
+
+    def __init__(self, freshness=30.0, backend=None):
+        self.freshness = freshness
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.results = {}
+        self.stats = {'calls': 0, 'coalesced': 0, 'fresh_hits': 0, 'shared_hits': 0}
+
+    @classmethod
+    def from_env(cls, prefix):
+        directory = os.getenv("SINGLE_FLIGHT_DIR")
+        return cls(
+            freshness=float(os.getenv(f"{prefix}_FRESHNESS", "30")),
+            backend=DirectoryBackend(directory) if directory and fcntl is not None else None,
+        )
+
+    def do(self, key, fn):
+        now = time.monotonic()
+        with self.lock:
+            cached = self.results.get(key)
+            if cached is not None and now - cached[0] <= self.freshness:
+                self.stats['fresh_hits'] += 1
+                return cached[1]
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, fn)
+            with self.lock:
+                self.results[key] = (time.monotonic(), call.result)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def _run(self, key, fn):
+        if self.backend is None:
+            with self.lock:
+                self.stats['calls'] += 1
+            return fn()
+
+        result = self.backend.get(key, self.freshness)
+        if result is not None:
+            with self.lock:
+                self.stats['shared_hits'] += 1
+            return result
+        unlock = self.backend.lock(key)
+        try:
+            # Another worker may have produced the result while we waited for the lock.
+            result = self.backend.get(key, self.freshness) if unlock else None
+            if result is not None:
+                with self.lock:
+                    self.stats['shared_hits'] += 1
+                return result
+            with self.lock:
+                self.stats['calls'] += 1
+            result = fn()
+            self.backend.set(key, result)
+            return result
+        finally:
+            if unlock:
+                unlock()
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = len(self.calls)
+            return stats
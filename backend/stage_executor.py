@@ -0,0 +1,19 @@
+import os
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+
+STAGE_EXECUTOR_WORKERS = int(os.getenv("STAGE_EXECUTOR_WORKERS", "16"))
+
+# Shared by every request for independent I/O stages (Firestore reads/writes) and for
+# work that should finish after the response has been sent.
+stage_executor = ThreadPoolExecutor(max_workers=STAGE_EXECUTOR_WORKERS, thread_name_prefix="stage")
+
+
+def submit_stage(fn, *args, **kwargs):
+    """
+    Runs fn(*args, **kwargs) on the shared stage executor and returns a Future for its
+    result. fn runs in a copy of the caller's context, so its stage timings are
+    attributed to the request that submitted it.
+    """
+    return stage_executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
@@ -0,0 +1,156 @@
+import os
+import sys
+import time
+import threading
+import importlib
+from contextlib import contextmanager
+
+from structured_log import get_logger
+
+log = get_logger('startup')
+
+
+class StartupReport:
+    """Records how long each dependency took to import and initialize, per process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.process_started = time.time()
+        self.entries = []
+
+    def record(self, name, phase, started):
+        ms = round((time.perf_counter() - started) * 1000, 1)
+        with self.lock:
+            self.entries.append({'name': name, 'phase': phase, 'ms': ms, 'pid': os.getpid()})
+        return ms
+
+    @contextmanager
+    def timed(self, name, phase):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = self.record(name, phase, started)
+            log.debug("Startup step timed.", phase=phase, name=name, ms=ms)
+
+    def forked(self):
+        # Entries recorded before the fork (by the master) stay; their pid tells them apart.
+        with self.lock:
+            self.process_started = time.time()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'uptime_seconds': round(time.time() - self.process_started, 1),
+                'entries': list(self.entries),
+            }
+
+    def summary(self):
+        with self.lock:
+            entries = list(self.entries)
+        lines = [f"Startup report (pid {os.getpid()}):"]
+        for entry in entries:
+            lines.append(f"  {entry['phase']:<7} {entry['name']:<32} {entry['ms']:>8.1f} ms")
+        return "\n".join(lines)
+
+
+startup_report = StartupReport()
+
+
+def timed_import(module_name):
+    """importlib.import_module() that records the import time the first time a module is loaded."""
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    with startup_report.timed(module_name, 'import'):
+        return importlib.import_module(module_name)
+
+
+class LazyModule:
+    """Module proxy that imports (timed) on first attribute access."""
+
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = timed_import(self._module_name)
+        return getattr(self._module, attr)
+
+
+_lazy_clients = []
+
+
+class LazyClient:
+    """
+    Proxy for an SDK client (or anything that starts threads or opens connections) that
+    is built by factory() on first use rather than at import time. Each process gets its
+    own instance: after a fork the cached instance is dropped, so a pre-fork server can
+    import the app in the master and every worker still creates its own clients.
+    A factory may return None when the dependency is unavailable; the proxy is then falsy.
+    Clients with warm=False are skipped by warm_up().
+    """
+
+    def __init__(self, name, factory, warm=True):
+        self._name = name
+        self._factory = factory
+        self._warm = warm
+        self._lock = threading.Lock()
+        self._ready = False
+        self._value = None
+        _lazy_clients.append(self)
+
+    def instance(self):
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                with startup_report.timed(self._name, 'init'):
+                    self._value = self._factory()
+                self._ready = True
+        return self._value
+
+    @property
+    def initialized(self):
+        return self._ready
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._ready = False
+        self._value = None
+
+    def __getattr__(self, attr):
+        value = self.instance()
+        if value is None:
+            raise RuntimeError(f"{self._name} is not available.")
+        return getattr(value, attr)
+
+    def __bool__(self):
+        return self.instance() is not None
+
+
+def lazy_client_states():
+    states = {}
+    for client in _lazy_clients:
+        if not client.initialized:
+            states[client._name] = 'not initialized'
+        else:
+            states[client._name] = 'ready' if client.instance() is not None else 'unavailable'
+    return states
+
+
+def warm_up():
+    """Initializes every lazy client now, e.g. from a worker's post_fork hook."""
+    for client in _lazy_clients:
+        if client._warm:
+            client.instance()
+
+
+def _after_fork_in_child():
+    for client in _lazy_clients:
+        client._reset_after_fork()
+    startup_report.forked()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+
+ROOT_LOGGER_NAME = 'brocodeai'
+
+
+def cap_field(value, max_chars):
+    """Makes a log field JSON-safe and at most max_chars long. Bytes are summarized, never dumped."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    if not isinstance(value, str):
+        try:
+            value = json.dumps(value, ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            value = repr(value)
+    if len(value) > max_chars:
+        return f"{value[:max_chars]}...(+{len(value) - max_chars} chars)"
+    return value
+
+
+class StructuredFormatter(logging.Formatter):
+    """One JSON object per line (LOG_FORMAT=json), or 'LEVEL: [category] message key=value' (text)."""
+
+    def __init__(self, output_format='json', max_field_chars=1000):
+        super().__init__()
+        self.output_format = output_format
+        self.max_field_chars = max_field_chars
+
+    def format(self, record):
+        category = record.name[len(ROOT_LOGGER_NAME) + 1:] if record.name.startswith(ROOT_LOGGER_NAME + '.') else record.name
+        fields = {key: cap_field(value, self.max_field_chars) for key, value in getattr(record, 'fields', {}).items()}
+        if record.exc_info:
+            fields['exception'] = self.formatException(record.exc_info)
+        if self.output_format == 'json':
+            payload = {
+                'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+                'level': record.levelname,
+                'category': category,
+                'msg': record.getMessage(),
+                'pid': record.process,
+            }
+            payload.update(fields)
+            return json.dumps(payload, ensure_ascii=False, default=str)
+        line = f"{record.levelname}: [{category}] {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class CategorySampler(logging.Filter):
+    """
+    Keeps a fraction of DEBUG/INFO records per category (longest dotted prefix wins);
+    warnings and errors are never sampled out.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self.resolved = {}
+
+    def _rate(self, name):
+        rate = self.resolved.get(name)
+        if rate is None:
+            category = name[len(ROOT_LOGGER_NAME) + 1:] if name.startswith(ROOT_LOGGER_NAME + '.') else name
+            rate = 1.0
+            while category:
+                if category in self.rates:
+                    rate = self.rates[category]
+                    break
+                category = category.rpartition('.')[0]
+            self.resolved[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener thread without formatting them; drops (and counts) on overflow."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Message and field formatting happen on the listener thread, off the request path.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _parse_mapping(spec, convert):
+    mapping = {}
+    for item in (spec or "").split(','):
+        if '=' not in item:
+            continue
+        key, value = item.split('=', 1)
+        try:
+            mapping[key.strip()] = convert(value.strip())
+        except ValueError:
+            print(f"WARNING: Ignoring invalid logging setting '{item}'.", file=sys.stderr)
+    return mapping
+
+
+_state = {'handler': None, 'listener': None, 'output': None, 'queue_size': 10000}
+
+
+def _start_listener():
+    log_queue = queue.Queue(maxsize=_state['queue_size'])
+    _state['handler'].queue = log_queue
+    listener = QueueListener(log_queue, _state['output'], respect_handler_level=True)
+    listener.start()
+    _state['listener'] = listener
+
+
+def configure_logging():
+    """
+    Sets up the 'brocodeai' logger tree from the environment. Safe to call more than once.
+      LOG_LEVEL            default level (INFO)
+      LOG_LEVELS           per-category levels, e.g. "gemini=DEBUG,tts=WARNING"
+      LOG_SAMPLE_RATES     per-category DEBUG/INFO sampling, e.g. "gemini.prompt=0.01,chat=0.2"
+      LOG_MAX_FIELD_CHARS  cap for each logged field (1000)
+      LOG_FORMAT           json (default) or text
+      LOG_QUEUE_SIZE       records buffered for the writer thread before dropping (10000)
+    """
+    if _state['handler'] is not None:
+        return
+    root = logging.getLogger(ROOT_LOGGER_NAME)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    root.propagate = False
+    for category, level in _parse_mapping(os.getenv("LOG_LEVELS"), str.upper).items():
+        logging.getLogger(f"{ROOT_LOGGER_NAME}.{category}").setLevel(level)
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(StructuredFormatter(
+        output_format=os.getenv("LOG_FORMAT", "json").lower(),
+        max_field_chars=int(os.getenv("LOG_MAX_FIELD_CHARS", "1000")),
+    ))
+    handler = NonBlockingQueueHandler(None)
+    handler.addFilter(CategorySampler(_parse_mapping(os.getenv("LOG_SAMPLE_RATES"), float)))
+    root.addHandler(handler)
+
+    _state.update(handler=handler, output=output, queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    _start_listener()
+    atexit.register(lambda: _state['listener'].stop())
+
+
+def _restart_after_fork():
+    # The writer thread does not survive fork(); each worker gets its own queue and thread.
+    if _state['handler'] is not None:
+        _start_listener()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+class StructuredLogger:
+    """
+    Thin wrapper so call sites pass raw values as keyword fields:
+        log.debug("Sending prompt to Gemini", use='chat', prompt=prompt)
+    Nothing is formatted or serialized unless the level is enabled and the record is sampled in.
+    """
+
+    __slots__ = ('logger',)
+
+    def __init__(self, category):
+        self.logger = logging.getLogger(f"{ROOT_LOGGER_NAME}.{category}")
+
+    def enabled(self, level=logging.DEBUG):
+        return self.logger.isEnabledFor(level)
+
+    def _log(self, level, msg, fields, exc_info=False):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, msg, exc_info=exc_info, extra={'fields': fields})
+
+    def debug(self, msg, **fields):
+        self._log(logging.DEBUG, msg, fields)
+
+    def info(self, msg, **fields):
+        self._log(logging.INFO, msg, fields)
+
+    def warning(self, msg, **fields):
+        self._log(logging.WARNING, msg, fields)
+
+    def error(self, msg, **fields):
+        self._log(logging.ERROR, msg, fields)
+
+    def exception(self, msg, **fields):
+        self._log(logging.ERROR, msg, fields, exc_info=True)
+
+
+def get_logger(category):
+    configure_logging()
+    return StructuredLogger(category)
+
+
+def logging_snapshot():
+    handler = _state['handler']
+    if handler is None:
+        return {'configured': False}
+    return {
+        'configured': True,
+        'level': logging.getLevelName(logging.getLogger(ROOT_LOGGER_NAME).level),
+        'queued': handler.queue.qsize(),
+        'dropped': handler.dropped,
+    }
@@ -0,0 +1,42 @@
+import os
+import tempfile
+
+os.environ.setdefault('GEMINI_API_KEY', 'test-key')
+os.environ.setdefault('AUDIO_CACHE_DIR', tempfile.mkdtemp(prefix='audio_cache_'))
+os.environ.setdefault('MEME_CACHE_DIR', tempfile.mkdtemp(prefix='meme_cache_'))
+
+import app as app_module
+import metrics
+
+
+def metric_value(family, *labels):
+    child = family.children.get(labels)
+    return child[0] if child is not None else 0
+
+
+def histogram_count(family, *labels):
+    child = family.children.get(labels)
+    return sum(child[:-1]) if child is not None else 0
+
+
+def test_batch_leaves_request_metrics_balanced():
+    client = app_module.create_app().test_client()
+    observed = histogram_count(metrics.request_duration, '/batch', 'POST', '200')
+
+    response = client.post('/batch', json={'requests': [
+        {'id': index, 'op': 'search_image', 'body': {'query': f'cat {index}'}} for index in range(3)
+    ]})
+
+    assert response.status_code == 200
+    assert [result['status'] for result in response.get_json()['results']] == [200, 200, 200]
+    assert metric_value(metrics.requests_in_flight, '/batch') == 0
+    assert histogram_count(metrics.request_duration, '/batch', 'POST', '200') == observed + 1
+
+
+def test_batch_rejects_non_positive_deadline():
+    client = app_module.create_app().test_client()
+    for deadline_ms in (0, -5, 'nan'):
+        response = client.post('/batch', json={'deadline_ms': deadline_ms, 'requests': [
+            {'op': 'search_image', 'body': {'query': 'cat'}},
+        ]})
+        assert response.status_code == 400
@@ -0,0 +1,76 @@
+import os
+import re
+import json
+import random
+
+from markdown_cleaner import clean_markdown, IncrementalMarkdownCleaner
+
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'markdown_corpus.json')
+
+
+def legacy_clean_markdown(text):
+    # The original six-pass implementation, kept verbatim as the reference.
+    text = re.sub(r'\*([^\*]+)\*', r'\1', text)
+    text = re.sub(r'\_([^\_]+)\_', r'\1', text)
+    text = re.sub(r'^\s*#+\s*', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^\s*[-*]\s*', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\n+', '\n', text)
+    text = "\n".join([line.strip() for line in text.split('\n')])
+    return text.strip()
+
+
+def load_corpus():
+    with open(CORPUS_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def clean_incrementally(text, chunk_sizes):
+    cleaner = IncrementalMarkdownCleaner()
+    out = []
+    pos = 0
+    sizes = iter(chunk_sizes)
+    while pos < len(text):
+        size = next(sizes)
+        out.append(cleaner.feed(text[pos:pos + size]))
+        pos += size
+    out.append(cleaner.finish())
+    return "".join(out)
+
+
+def random_markdown(rng, length):
+    alphabet = ['*', '**', '_', '#', '##', '-', '\n', '\n\n', ' ', '  ', '\t', '\r', ' ',
+                'a', 'bhai', '.', '!', 'x y']
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def test_corpus_matches_legacy():
+    for text in load_corpus():
+        assert clean_markdown(text) == legacy_clean_markdown(text)
+
+
+def test_corpus_incremental_matches_legacy():
+    for text in load_corpus():
+        expected = legacy_clean_markdown(text)
+        for size in (1, 2, 3, 7, 16, len(text) or 1):
+            assert clean_incrementally(text, iter(lambda: size, None)) == expected
+
+
+def test_random_markdown_matches_legacy():
+    rng = random.Random(1234)
+    for _ in range(5000):
+        text = random_markdown(rng, rng.randint(0, 40))
+        expected = legacy_clean_markdown(text)
+        assert clean_markdown(text) == expected, repr(text)
+        chunk_sizes = iter(lambda: rng.randint(1, 6), None)
+        assert clean_incrementally(text, chunk_sizes) == expected, repr(text)
+
+
+def test_incremental_emits_before_finish():
+    cleaner = IncrementalMarkdownCleaner()
+    assert cleaner.feed("Wah *bhai*, kya") == "Wah bhai, kya"
+    # An unpaired '*' holds back the rest until it is resolved.
+    assert cleaner.feed(" *baat") == ""
+    assert cleaner.feed("* hai.\n- ") == " baat hai."
+    assert cleaner.feed("next") == "\nnext"
+    assert cleaner.finish() == ""
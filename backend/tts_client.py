@@ -0,0 +1,168 @@
+import os
+import time
+import random
+import base64
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from hedging import Hedger
+from metrics import audio_bytes as audio_bytes_histogram, stage
+from structured_log import get_logger
+
+log = get_logger('tts')
+
+
+RETRYABLE_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+MIN_AUDIO_BYTES = 100
+
+
+class SarvamTTSError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def is_sarvam_failure(error):
+    """Errors that say Sarvam itself is unhealthy; 4xx caused by our own request do not count."""
+    if not isinstance(error, SarvamTTSError):
+        return True
+    return error.status_code is None or error.status_code in RETRYABLE_STATUS_CODES
+
+
+class SarvamTTSClient:
+    """
+    Thread-safe Sarvam AI TTS client. Keeps a keep-alive connection pool so
+    consecutive utterances reuse the same TCP+TLS connection, and retries
+    429/5xx responses and connection failures with jittered exponential backoff.
+    Slow calls are hedged (see hedging.Hedger), against hedge_endpoint if one is set.
+    While the circuit breaker is open, synthesize() fails immediately.
+    """
+
+    def __init__(self, api_key, endpoint, pool_size=8, connect_timeout=3.05, read_timeout=10.0,
+                 max_retries=2, backoff_base=0.25, backoff_max=2.0, hedge_endpoint=None, hedger=None, breaker=None):
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.hedge_endpoint = hedge_endpoint or endpoint
+        self.hedger = hedger or Hedger('sarvam', enabled=False)
+        self.breaker = breaker or CircuitBreaker('sarvam', is_failure=is_sarvam_failure)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        # Retries are handled in synthesize() so they get jitter and Retry-After support.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0, pool_block=False)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "api-subscription-key": api_key or "",
+            "Content-Type": "application/json",
+        })
+
+    @classmethod
+    def from_env(cls):
+        worker_threads = int(os.getenv("WORKER_THREADS", "8"))
+        return cls(
+            api_key=os.getenv("SARVAM_AI_API_KEY"),
+            endpoint=os.getenv("SARVAM_AI_TTS_ENDPOINT", "https://api.sarvam.ai/text-to-speech"),
+            pool_size=int(os.getenv("SARVAM_TTS_POOL_SIZE", str(worker_threads))),
+            connect_timeout=float(os.getenv("SARVAM_TTS_CONNECT_TIMEOUT", "3.05")),
+            read_timeout=float(os.getenv("SARVAM_TTS_READ_TIMEOUT", "10")),
+            max_retries=int(os.getenv("SARVAM_TTS_MAX_RETRIES", "2")),
+            backoff_base=float(os.getenv("SARVAM_TTS_BACKOFF_BASE", "0.25")),
+            backoff_max=float(os.getenv("SARVAM_TTS_BACKOFF_MAX", "2.0")),
+            hedge_endpoint=os.getenv("SARVAM_TTS_HEDGE_ENDPOINT") or None,
+            hedger=Hedger.from_env('sarvam', "SARVAM_TTS"),
+            breaker=CircuitBreaker.from_env('sarvam', "SARVAM_TTS", slow_call_seconds=5.0, is_failure=is_sarvam_failure),
+        )
+
+    @property
+    def configured(self):
+        return bool(self.api_key and self.endpoint)
+
+    def _backoff_delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_max)
+                except ValueError:
+                    pass
+        # Full jitter: spreads retries from concurrent workers instead of synchronizing them.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _post(self, payload, endpoint):
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = self.session.post(endpoint, json=payload, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as req_err:
+                last_error = SarvamTTSError(f"Could not connect to Sarvam AI: {req_err}")
+            except requests.exceptions.RequestException as req_err:
+                raise SarvamTTSError(f"Could not connect to Sarvam AI: {req_err}")
+            else:
+                if response.status_code < 400:
+                    return response
+                last_error = SarvamTTSError(
+                    f"Sarvam AI HTTP error {response.status_code}: {response.text}",
+                    status_code=response.status_code,
+                )
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    raise last_error
+
+            if attempt < self.max_retries:
+                delay = self._backoff_delay(attempt, response)
+                log.warning("Sarvam AI TTS attempt failed. Retrying.", attempt=attempt + 1, delay=round(delay, 2), error=str(last_error))
+                time.sleep(delay)
+        raise last_error
+
+    def synthesize(self, text, target_language_code):
+        """
+        Returns the decoded audio bytes for `text`. Raises SarvamTTSError on any failure.
+        """
+        if not self.configured:
+            raise SarvamTTSError("Sarvam AI API Key not configured.")
+
+        try:
+            with self.breaker.guard():
+                return self.hedger.call(
+                    lambda: self._synthesize_once(text, target_language_code, self.endpoint),
+                    lambda: self._synthesize_once(text, target_language_code, self.hedge_endpoint),
+                )
+        except CircuitOpenError as e:
+            raise SarvamTTSError(str(e), status_code=503)
+
+    def _synthesize_once(self, text, target_language_code, endpoint):
+        payload = {
+            "text": text,
+            "target_language_code": target_language_code,
+        }
+        with stage('sarvam'):
+            response = self._post(payload, endpoint)
+
+        try:
+            response_json = response.json()
+        except ValueError:
+            raise SarvamTTSError("Sarvam AI returned unparseable JSON.", status_code=response.status_code)
+
+        audios = response_json.get('audios') if isinstance(response_json, dict) else None
+        if not isinstance(audios, list) or not audios or not audios[0]:
+            raise SarvamTTSError("Sarvam AI did not return audio content.")
+
+        audio_content_base64 = audios[0]
+        if audio_content_base64.startswith("data:"):
+            audio_content_base64 = audio_content_base64.split(',', 1)[1]
+
+        try:
+            audio_bytes = base64.b64decode(audio_content_base64)
+        except (ValueError, TypeError):
+            raise SarvamTTSError("Sarvam AI returned invalid or empty audio content.")
+
+        if len(audio_bytes) <= MIN_AUDIO_BYTES:
+            raise SarvamTTSError("Sarvam AI returned invalid or empty audio content.")
+        audio_bytes_histogram.observe(len(audio_bytes))
+        return audio_bytes
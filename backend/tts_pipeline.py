@@ -0,0 +1,141 @@
+import os
+import re
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from structured_log import get_logger
+
+log = get_logger('tts')
+
+
+# A sentence ends at a danda (।/॥), or at . ! ? (optionally followed by closing quotes or
+# brackets) when whitespace or end of line follows, so "3.5" and "v1.2" are not split.
+_SENTENCE_RE = re.compile(r'[^\n]+?(?:[।॥]+|[.!?…]+["\'”’)\]]*(?=\s|$)|$)', re.MULTILINE)
+# Clause boundaries used only when a single sentence is over the provider limit.
+_CLAUSE_SPLIT_RE = re.compile(r'(?<=[,;:])\s+|\s+(?=[-–—]\s)')
+
+
+def _hard_wrap(text, max_chars):
+    chunks = []
+    current = ""
+    for word in text.split():
+        while len(word) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(word[:max_chars])
+            word = word[max_chars:]
+        if not current:
+            current = word
+        elif len(current) + 1 + len(word) <= max_chars:
+            current = f"{current} {word}"
+        else:
+            chunks.append(current)
+            current = word
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _pack(pieces, max_chars):
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if not current:
+            current = piece
+        elif len(current) + 1 + len(piece) <= max_chars:
+            current = f"{current} {piece}"
+        else:
+            chunks.append(current)
+            current = piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_sentences(text):
+    return [m.group(0).strip() for m in _SENTENCE_RE.finditer(text) if m.group(0).strip()]
+
+
+def split_complete_sentences(buffer):
+    """
+    For streamed text: returns (complete_sentences, remainder). The last sentence in
+    the buffer may still be growing, so it is always held back in the remainder.
+    """
+    matches = [m for m in _SENTENCE_RE.finditer(buffer) if m.group(0).strip()]
+    if len(matches) < 2:
+        return [], buffer
+    return [m.group(0).strip() for m in matches[:-1]], buffer[matches[-1].start():]
+
+
+def split_tts_chunks(text, max_chars=500):
+    """
+    Splits cleaned text into chunks of at most max_chars, breaking at sentence
+    boundaries first, then clause boundaries, then whitespace. The first sentence is
+    always its own chunk so it can be synthesized (and played) as early as possible;
+    later sentences are packed together to keep the number of TTS calls down.
+    """
+    pieces = []
+    for sentence in split_sentences(text):
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+        for clause in _CLAUSE_SPLIT_RE.split(sentence):
+            clause = clause.strip()
+            if not clause:
+                continue
+            if len(clause) <= max_chars:
+                pieces.append(clause)
+            else:
+                pieces.extend(_hard_wrap(clause, max_chars))
+
+    if not pieces:
+        return []
+    return [pieces[0]] + _pack(pieces[1:], max_chars)
+
+
+class TTSPipeline:
+    """
+    Synthesizes a long reply as ordered segments on a bounded, shared worker pool.
+    `synthesize` is called as synthesize(chunk_text, language, voice_style) and returns
+    (audio_id, audio_bytes), raising on failure.
+    """
+
+    def __init__(self, synthesize, max_workers=4, max_chars=500):
+        self.synthesize = synthesize
+        self.max_chars = max_chars
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-pipeline")
+
+    @classmethod
+    def from_env(cls, synthesize):
+        return cls(
+            synthesize,
+            max_workers=int(os.getenv("TTS_PIPELINE_WORKERS", "4")),
+            max_chars=int(os.getenv("SARVAM_TTS_MAX_CHARS", "500")),
+        )
+
+    def submit(self, text, language, voice_style):
+        """
+        Returns a list of (chunk_text, future) in playback order. Chunks are submitted
+        in order, so the first sentence is always first in the worker queue.
+        """
+        return [
+            (chunk, self.executor.submit(contextvars.copy_context().run, self.synthesize, chunk, language, voice_style))
+            for chunk in split_tts_chunks(text, self.max_chars)
+        ]
+
+    def iter_segments(self, text, language, voice_style):
+        """
+        Yields one dict per chunk, in order, as soon as that chunk (and every chunk
+        before it) is ready. Failed chunks are yielded with audio_id None.
+        """
+        for index, (chunk, future) in enumerate(self.submit(text, language, voice_style)):
+            try:
+                audio_id, audio_bytes = future.result()
+            except Exception as e:
+                log.warning("TTS failed for segment.", segment=index, error=str(e))
+                audio_id, audio_bytes = None, None
+            yield {'index': index, 'text': chunk, 'audio_id': audio_id, 'audio_bytes': audio_bytes}
+
+    def synthesize_segments(self, text, language, voice_style):
+        return list(self.iter_segments(text, language, voice_style))
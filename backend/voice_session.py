@@ -0,0 +1,90 @@
+import os
+import threading
+
+from structured_log import get_logger
+
+
+log = get_logger('voice')
+
+
+class AudioFrames:
+    """
+    Iterator over microphone audio as it arrives in a (usually chunked) request body, in
+    frames of frame_bytes. Ends at the end of the body, after max_bytes, or once stop()
+    is called, e.g. when the recognizer has produced its final transcript. The recognizer
+    may consume it from its own thread.
+    WSGI input streams block until a whole frame has arrived, so a frame should hold no
+    more than ~100 ms of audio or interim results lag behind the speaker.
+    """
+
+    def __init__(self, stream, frame_bytes=1024, max_bytes=960000):
+        self.stream = stream
+        self.frame_bytes = frame_bytes
+        self.max_bytes = max_bytes
+        self.received = 0
+        self.stopped = threading.Event()
+
+    @classmethod
+    def from_env(cls, stream):
+        return cls(
+            stream,
+            frame_bytes=int(os.getenv("VOICE_FRAME_BYTES", "1024")),
+            max_bytes=int(os.getenv("VOICE_MAX_AUDIO_BYTES", "960000")),
+        )
+
+    def stop(self):
+        self.stopped.set()
+
+    def __iter__(self):
+        while not self.stopped.is_set() and self.received < self.max_bytes:
+            frame = self.stream.read(min(self.frame_bytes, self.max_bytes - self.received))
+            if not frame:
+                return
+            self.received += len(frame)
+            yield frame
+        if self.received >= self.max_bytes:
+            log.warning("Voice upload hit the audio size limit.", max_bytes=self.max_bytes)
+
+
+class GoogleStreamingRecognizer:
+    """
+    Streaming recognition on Google Cloud Speech. recognize(frames, language_code) sends
+    the frames as they are read and yields (transcript, is_final) for every interim and
+    final result. Any object with the same recognize() signature can stand in for it
+    (see bench_fakes.FakeRecognizer).
+    """
+
+    def __init__(self, client, speech, encoding='WEBM_OPUS', sample_rate=48000, model=None):
+        self.client = client
+        self.speech = speech
+        self.encoding = encoding
+        self.sample_rate = sample_rate
+        self.model = model
+
+    @classmethod
+    def from_env(cls, client, speech):
+        return cls(
+            client,
+            speech,
+            encoding=os.getenv("SPEECH_ENCODING", "WEBM_OPUS"),
+            sample_rate=int(os.getenv("SPEECH_SAMPLE_RATE", "48000")),
+            model=os.getenv("SPEECH_MODEL") or None,
+        )
+
+    def recognize(self, frames, language_code, encoding=None, sample_rate=None):
+        speech = self.speech
+        config = speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding[encoding or self.encoding],
+            sample_rate_hertz=sample_rate or self.sample_rate,
+            language_code=language_code,
+            enable_automatic_punctuation=True,
+            **({'model': self.model} if self.model else {}),
+        )
+        # single_utterance: the service ends the stream as soon as the speaker pauses,
+        # so the reply can start without waiting for the upload to finish.
+        streaming_config = speech.StreamingRecognitionConfig(config=config, interim_results=True, single_utterance=True)
+        requests = (speech.StreamingRecognizeRequest(audio_content=frame) for frame in frames)
+        for response in self.client.streaming_recognize(config=streaming_config, requests=requests):
+            for result in response.results:
+                if result.alternatives:
+                    yield result.alternatives[0].transcript, result.is_final
@@ -17,6 +17,17 @@ export default function Chat({
   onGenerateBrocodeMeme
 }) {
   const [isLoading, setIsLoading] = useState(false);
+  // The backend keeps the conversation per session; we only send the new message and the last seq we saw.
+  const [sessionId] = useState(() => {
+    const saved = localStorage.getItem('brocodeai_session_id');
+    if (saved) return saved;
+    const created = window.crypto?.randomUUID ? window.crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    localStorage.setItem('brocodeai_session_id', created);
+    localStorage.removeItem('brocodeai_session_seq');
+    return created;
+  });
+  // Persisted with the session id, so a reload does not get the whole stored history back as "missed".
+  const [sessionSeq, setSessionSeq] = useState(() => Number(localStorage.getItem('brocodeai_session_seq')) || 0);
   const [isRoastModalOpen, setIsRoastModalOpen] = useState(false);
   const [currentRoast, setCurrentRoast] = useState(null);
   const [isLoadingRoast, setIsLoadingRoast] = useState(false);
@@ -32,7 +43,11 @@ export default function Chat({
 
   const playAudioFromBase64 = useCallback(async (base64Audio, source = 'chat') => {
     if (!base64Audio) return;
-    const audio = new Audio(`data:audio/mp3;base64,${base64Audio}`);
+    // Backend now returns an /audio/<id> reference; inline base64 is still accepted.
+    const src = base64Audio.startsWith('/audio/')
+      ? `http://localhost:5002${base64Audio}`
+      : `data:audio/mp3;base64,${base64Audio}`;
+    const audio = new Audio(src);
     audio.volume = 1.0;
     document.body.appendChild(audio);
     try {
@@ -54,7 +69,8 @@ export default function Chat({
       });
       const data = await response.json();
       if (!response.ok) throw new Error(data.error || 'Failed to get audio.');
-      if (data.audio) await playAudioFromBase64(data.audio, 'humor panel');
+      const audioSource = data.audio_url || data.audio;
+      if (audioSource) await playAudioFromBase64(audioSource, 'humor panel');
       else displayMessageBox('No audio returned.', 'error');
     } catch (error) {
       displayMessageBox(`Failed to speak text: ${error.message}`, 'error');
@@ -79,16 +95,23 @@ export default function Chat({
           language: selectedLanguage,
           voice_style: selectedPersonaMode,
           persona_mode: selectedPersonaMode,
-          history: messages.slice(-5).map(msg => ({ text: msg.text, sender: msg.sender })),
+          session_id: sessionId,
+          seq: sessionSeq,
           user_id: userId,
           app_id: __app_id,
         }),
       });
       const data = await response.json();
       if (!response.ok) throw new Error(data.error || 'Chat failed.');
-      const botMessage = { text: data.text, sender: 'brocodeAI', audio: data.audio };
-      setMessages(prev => [...prev, botMessage]);
-      if (isAutoSpeakEnabled && data.audio) await playAudioFromBase64(data.audio, 'auto-speak chat');
+      const audioSource = data.audio_url || data.audio;
+      const botMessage = { text: data.text, sender: 'brocodeAI', audio: audioSource };
+      const missed = (data.missed || []).map(msg => ({ text: msg.text, sender: msg.sender }));
+      setMessages(prev => [...prev, ...missed, botMessage]);
+      if (data.seq) {
+        setSessionSeq(data.seq);
+        localStorage.setItem('brocodeai_session_seq', String(data.seq));
+      }
+      if (isAutoSpeakEnabled && audioSource) await playAudioFromBase64(audioSource, 'auto-speak chat');
     } catch (error) {
       displayMessageBox(`Chat error: ${error.message}`, 'error');
       setMessages(prev => [...prev, { text: `System: ${error.message}`, sender: 'brocodeAI' }]);
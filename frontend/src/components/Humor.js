@@ -26,10 +26,11 @@ export default function Humor({ selectedLanguage, selectedPersonaMode, displayMe
       }
 
       const result = await response.json();
-      console.log(`[Humor] Received audio data from backend. Length: ${result.audio ? result.audio.length : '0'}`);
-      if (result.audio) {
+      const audioSource = result.audio_url || result.audio;
+      console.log(`[Humor] Received audio reference from backend: ${audioSource ? audioSource.substring(0, 40) : 'none'}`);
+      if (audioSource) {
         // Use the playAudioFromBase64 function passed from App.js
-        await playAudioFromBase64(result.audio, "humor panel");
+        await playAudioFromBase64(audioSource, "humor panel");
       } else {
         console.warn("[Humor] Backend returned no audio data for text.");
         displayMessageBox("Voice module returned no audio for that. How disappointing.", "error");